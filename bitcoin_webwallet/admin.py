@@ -1,11 +1,25 @@
 from django.contrib import admin
-
-from decimal import Decimal
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html
 
 from models import Wallet, Address, Transaction, OutgoingTransaction
+from routers import replica_reads
+
+
+class ReplicaReadsAdmin(admin.ModelAdmin):
+    """ Lists are read from replica databases, if there are any.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super(ReplicaReadsAdmin, self).changelist_view(request, extra_context)
+        with replica_reads():
+            response = super(ReplicaReadsAdmin, self).changelist_view(request, extra_context)
+            # Response is rendered here, because rendering runs the queries
+            return response.render() if hasattr(response, 'render') else response
 
 
-class WalletAdmin(admin.ModelAdmin):
+class WalletAdmin(ReplicaReadsAdmin):
     readonly_fields = [
         'path',
         'internal_wallet',
@@ -13,33 +27,47 @@ class WalletAdmin(admin.ModelAdmin):
         'listTransactions',
     ]
 
+    list_display = ['__unicode__', 'internal_wallet']
+
+    # How many latest transactions are shown in wallet page.
+    # Full history is shown in paginated transaction list.
+    TRANSACTIONS_SHOWN = 50
+
+    def get_queryset(self, request):
+        return super(WalletAdmin, self).get_queryset(request).withBalances()
+
     def listTransactions(self, instance):
-        txs = Transaction.objects.filter(wallet=instance).order_by('created_at')
+        txs = list(instance.transactions.order_by('-created_at', '-id')[:self.TRANSACTIONS_SHOWN])
         result = ''
-        for tx in txs:
+        for tx in reversed(txs):
             result += str(tx.created_at) + ' ' + unicode(tx) + '\n'
-        return result
-    listTransactions.short_description = 'Transactions'
+        url = reverse('admin:bitcoin_webwallet_transaction_changelist') + '?wallet__id__exact=' + str(instance.pk)
+        return format_html(u'{}<a href="{}">Show all transactions</a>', result, url)
+    listTransactions.short_description = 'Latest transactions'
 
     def getBalanceInfo(self, instance):
         return u'Received: {}\nSent: {}\nTotal: {}'.format(
-            instance.getReceived(0),
-            instance.getSent(),
-            instance.getBalance(0)
+            instance.total_received,
+            instance.total_sent,
+            instance.total_balance
         )
 
     getBalanceInfo.short_description = 'Balance'
 
 
-class AddressAdmin(admin.ModelAdmin):
+class AddressAdmin(ReplicaReadsAdmin):
     readonly_fields = [
         'wallet',
         'subpath_number',
         'address',
+        'import_pending',
+        'import_attempts',
+        'import_retry_at',
+        'import_error',
     ]
 
 
-class OutgoingTransactionAdmin(admin.ModelAdmin):
+class OutgoingTransactionAdmin(ReplicaReadsAdmin):
     readonly_fields = [
         'created_at',
         'inputs_selected_at',
@@ -49,27 +77,28 @@ class OutgoingTransactionAdmin(admin.ModelAdmin):
         'getFee',
     ]
 
+    list_display = ['__unicode__', 'created_at', 'inputs_selected_at', 'sent_at', 'getFee']
+
+    def get_queryset(self, request):
+        return super(OutgoingTransactionAdmin, self).get_queryset(request).withSummaries()
+
     def listInputs(self, instance):
-        if instance.inputs.count() == 0:
-            return 'No inputs'
         result = ''
-        total = Decimal(0)
         for inpt in instance.inputs.all():
             result += unicode(inpt) + '\n'
-            total += inpt.amount
-        result += 'Total: ' + str(total) + ' BTC\n'
+        if not result:
+            return 'No inputs'
+        result += 'Total: ' + str(instance.getInputsTotal()) + ' BTC\n'
         return result
     listInputs.short_description = 'Inputs'
 
     def listOutputs(self, instance):
-        if instance.outputs.count() == 0:
-            return 'No outputs'
         result = ''
-        total = Decimal(0)
         for output in instance.outputs.all():
             result += unicode(output) + '\n'
-            total += output.amount
-        result += 'Total: ' + str(total) + ' BTC\n'
+        if not result:
+            return 'No outputs'
+        result += 'Total: ' + str(instance.getOutputsTotal()) + ' BTC\n'
         return result
     listOutputs.short_description = 'Outputs'
 
@@ -78,7 +107,7 @@ class OutgoingTransactionAdmin(admin.ModelAdmin):
     getFee.short_description = 'Fee'
 
 
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ReplicaReadsAdmin):
     readonly_fields = [
         'wallet',
         'created_at',
@@ -89,10 +118,15 @@ class TransactionAdmin(admin.ModelAdmin):
         'incoming_txid',
         'block_height',
         'outgoing_tx',
+        'sequence',
+        'running_balance',
     ]
 
     list_display = ['__unicode__', 'created_at', 'amount', 'description']
 
+    # Counting all transactions of huge ledger is slow
+    show_full_result_count = False
+
 admin.site.register(Wallet, WalletAdmin)
 admin.site.register(Address, AddressAdmin)
 admin.site.register(OutgoingTransaction, OutgoingTransactionAdmin)
@@ -0,0 +1,314 @@
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from decimal import Decimal
+import hashlib
+
+from fields import BitcoinAmountField, btc_to_satoshis, satoshis_to_btc
+from models import Address, ArchivedTransaction, BlockAudit, LedgerAudit, OutgoingTransactionOutput, Transaction, Wallet, WalletAudit, _get_current_block_height, _sum_amount
+from utils import INTERNAL_WALLET_CHANGE, get_final_block_height
+
+
+AUDIT_CHUNK_SIZE = 500
+
+WALLET_TX_FIELDS = ['pk', 'sequence', 'amount', 'running_balance', 'incoming_txid', 'receiving_address_id', 'outgoing_tx_id']
+
+
+def run_audit(rpc, read_rpc=None, full=False, lease=None):
+    """ Verifies ledger against itself and against node, and returns saved
+    LedgerAudit. Incremental audit checks only transactions and blocks
+    that came after the previous audit. Full audit checks everything and
+    rebuilds all checkpoints from scratch.
+    """
+    read_rpc = read_rpc or rpc
+    ledger_audit = LedgerAudit.objects.create(full=full)
+
+    audit_wallets(ledger_audit, full, lease)
+    audit_blocks(rpc, read_rpc, ledger_audit, full, lease)
+    if read_rpc.getblockcount() > _get_current_block_height():
+        ledger_audit.notes.append('Holdings were not compared, because ledger has not processed all blocks yet.')
+    elif WalletAudit.objects.exclude(problem='').exists():
+        ledger_audit.notes.append('Holdings were not compared, because some wallets could not be audited.')
+    else:
+        compare_holdings(rpc, ledger_audit, full)
+
+    ledger_audit.finished_at = now()
+    with transaction.atomic():
+        if lease:
+            lease.fence()
+        ledger_audit.save()
+    return ledger_audit
+
+
+def _tx_checksum(checksum, tx):
+    pk, sequence, amount, _, incoming_txid, receiving_address_id, outgoing_tx_id = tx
+    values = [checksum, pk, sequence, btc_to_satoshis(amount), incoming_txid or '', receiving_address_id or '', outgoing_tx_id or '']
+    return hashlib.sha256('|'.join(str(value) for value in values)).hexdigest()
+
+
+def _iterate_wallet_txs(wallet_id, after_sequence):
+    """ Yields transactions of wallet in order of sequence, both
+    live and compacted ones. Transactions are read in chunks.
+    """
+    while True:
+        chunk = []
+        for model in [Transaction, ArchivedTransaction]:
+            txs = model.objects.filter(wallet_id=wallet_id, sequence__gt=after_sequence).order_by('sequence')
+            chunk += list(txs.values_list(*WALLET_TX_FIELDS)[:AUDIT_CHUNK_SIZE])
+        if not chunk:
+            return
+        chunk = sorted(chunk, key=lambda tx: tx[1])[:AUDIT_CHUNK_SIZE]
+        for tx in chunk:
+            yield tx
+        after_sequence = chunk[-1][1]
+
+
+def audit_wallet(wallet_audit, rebuild=False):
+    """ Verifies transactions of wallet that came after the audited ones.
+    Running balance of each must be the previous one plus amount. Audit
+    advances to the last correct transaction. When rebuilding, returns
+    False if the previously audited transactions have changed.
+    """
+    old_sequence = wallet_audit.sequence
+    old_checksum = wallet_audit.checksum
+    if rebuild:
+        wallet_audit.sequence = 0
+        wallet_audit.balance = Decimal(0)
+        wallet_audit.checksum = ''
+    wallet_audit.problem = ''
+
+    history_intact = not rebuild or old_sequence == 0
+    for tx in _iterate_wallet_txs(wallet_audit.wallet_id, wallet_audit.sequence):
+        pk, sequence, amount, running_balance = tx[:4]
+        expected_balance = wallet_audit.balance + amount
+        if running_balance != expected_balance:
+            wallet_audit.problem = 'Transaction {} (sequence {}) has running balance {}, expected {}'.format(pk, sequence, running_balance, expected_balance)
+            break
+        wallet_audit.sequence = sequence
+        wallet_audit.balance = running_balance
+        wallet_audit.checksum = _tx_checksum(wallet_audit.checksum, tx)
+        if rebuild and sequence == old_sequence:
+            history_intact = wallet_audit.checksum == old_checksum
+    return history_intact
+
+
+def _save_wallet_audit(wallet_audit, ledger_audit, lease):
+    if wallet_audit.problem:
+        ledger_audit.problems.append('Wallet {}: {}'.format(wallet_audit.wallet_id, wallet_audit.problem))
+        wallet_audit.problem = wallet_audit.problem[:200]
+    with transaction.atomic():
+        if lease:
+            lease.fence()
+        wallet_audit.save()
+    ledger_audit.wallets_checked += 1
+
+
+def audit_wallets(ledger_audit, full, lease=None):
+    """ Incremental audit checks only wallets that have new transactions,
+    whose audited transactions have changed, or that had problems. Last
+    audited transaction of every wallet is found with the index of
+    wallet and sequence, so unchanged wallets cost one index lookup.
+    """
+    missing_ids = list(Wallet.objects.filter(audit__isnull=True).values_list('pk', flat=True))
+    WalletAudit.objects.bulk_create([WalletAudit(wallet_id=wallet_id) for wallet_id in missing_ids], batch_size=AUDIT_CHUNK_SIZE)
+
+    if full:
+        # Balances are also compared to sums of transactions, in case some have no sequence
+        for wallet in Wallet.objects.withBalances().select_related('audit').order_by('pk').iterator():
+            wallet_audit = wallet.audit
+            if not audit_wallet(wallet_audit, rebuild=True):
+                ledger_audit.notes.append('Wallet {}: Audited transactions have changed.'.format(wallet.pk))
+            if not wallet_audit.problem and wallet_audit.balance != wallet.total_balance:
+                wallet_audit.problem = 'Balance is {}, but transactions sum to {}'.format(wallet_audit.balance, wallet.total_balance)
+            _save_wallet_audit(wallet_audit, ledger_audit, lease)
+        return
+
+    def latest(model, field):
+        txs = model.objects.filter(wallet_id=OuterRef('wallet_id'), sequence__isnull=False).order_by('-sequence')
+        return Subquery(txs.values(field)[:1], output_field=models.PositiveIntegerField())
+
+    def at_audited_sequence(model):
+        txs = model.objects.filter(wallet_id=OuterRef('wallet_id'), sequence=OuterRef('sequence'))
+        return Subquery(txs.values('running_balance')[:1], output_field=BitcoinAmountField())
+
+    wallet_audits = WalletAudit.objects.annotate(
+        latest_sequence=Coalesce(latest(Transaction, 'sequence'), latest(ArchivedTransaction, 'sequence')),
+        audited_balance=Coalesce(at_audited_sequence(Transaction), at_audited_sequence(ArchivedTransaction)),
+    )
+    for wallet_audit in wallet_audits.order_by('wallet_id').iterator():
+        if wallet_audit.sequence and wallet_audit.audited_balance != wallet_audit.balance:
+            # Transactions may be removed because of a fork, for example
+            if not audit_wallet(wallet_audit, rebuild=True):
+                ledger_audit.notes.append('Wallet {}: Audited transactions have changed.'.format(wallet_audit.wallet_id))
+        elif (wallet_audit.latest_sequence or 0) > wallet_audit.sequence or wallet_audit.problem:
+            audit_wallet(wallet_audit)
+        else:
+            continue
+        _save_wallet_audit(wallet_audit, ledger_audit, lease)
+
+
+def _get_node_block_entries(rpc, read_rpc, first_height, last_height):
+    """ Returns incoming transactions to wallet addresses by block height,
+    as node sees them. Entries are (txid, address, satoshis) tuples.
+    Amounts to same address in same transaction are summed, like
+    AddRealBitcoinTransactions does.
+    """
+    since_hash = read_rpc.getblockhash(first_height - 1) if first_height > 1 else ''
+    amounts = {}
+    heights = {}
+    for tx_raw in rpc.listsinceblock(since_hash, 1, True)['transactions']:
+        if tx_raw['category'] != 'receive' or not tx_raw.get('blockhash'):
+            continue
+        key = (tx_raw['blockhash'], tx_raw['txid'], tx_raw['address'])
+        amounts[key] = amounts.get(key, Decimal(0)) + tx_raw['amount']
+        # Newer nodes tell the height, so block does not need to be asked
+        if 'blockheight' in tx_raw:
+            heights[tx_raw['blockhash']] = tx_raw['blockheight']
+    for block_hash in set(key[0] for key in amounts):
+        if block_hash not in heights:
+            heights[block_hash] = read_rpc.getblock(block_hash)['height']
+
+    # Transactions to addresses that do not belong to any wallet are skipped
+    addresses = list(set(key[2] for key in amounts))
+    known_addresses = set()
+    for i in range(0, len(addresses), AUDIT_CHUNK_SIZE):
+        known_addresses.update(Address.objects.filter(address__in=addresses[i:i + AUDIT_CHUNK_SIZE]).values_list('address', flat=True))
+
+    entries = {}
+    for (block_hash, txid, address), amount in amounts.items():
+        height = heights[block_hash]
+        if address in known_addresses and first_height <= height <= last_height:
+            entries.setdefault(height, []).append((txid, address, btc_to_satoshis(amount)))
+    for block_entries in entries.values():
+        block_entries.sort()
+    return entries
+
+
+def _get_ledger_block_entries(first_height, last_height):
+    """ Returns incoming transactions of ledger by block height,
+    in the same form as _get_node_block_entries().
+    """
+    entries = {}
+    for model in [Transaction, ArchivedTransaction]:
+        txs = model.objects.filter(incoming_txid__isnull=False, block_height__gte=first_height, block_height__lte=last_height)
+        for block_height, txid, address, amount in txs.values_list('block_height', 'incoming_txid', 'receiving_address__address', 'amount').iterator():
+            entries.setdefault(block_height, []).append((txid, address, btc_to_satoshis(amount)))
+    for block_entries in entries.values():
+        block_entries.sort()
+    return entries
+
+
+def _describe_block_difference(height, node_block, ledger_block):
+    different = sorted(set(node_block) ^ set(ledger_block))
+    return 'Block {}: Node has {} transactions of {} satoshis to wallet addresses, ledger has {} transactions of {} satoshis. First difference is transaction {} to {}.'.format(
+        height,
+        len(node_block),
+        sum(entry[2] for entry in node_block),
+        len(ledger_block),
+        sum(entry[2] for entry in ledger_block),
+        different[0][0],
+        different[0][1],
+    )
+
+
+def audit_blocks(rpc, read_rpc, ledger_audit, full, lease=None):
+    """ Compares incoming transactions of blocks to what node reports.
+    Incremental audit checks the final blocks after the previously
+    audited ones. Audit stops at the first block that differs, so
+    the same block is reported until the difference is fixed.
+    """
+    previous = LedgerAudit.objects.filter(finished_at__isnull=False, block_height__isnull=False).order_by('-pk').first()
+    previous_height = previous.block_height if previous else 0
+    first_height = 1 if full else previous_height + 1
+    # Only blocks that AddRealBitcoinTransactions does not process again are final enough
+    last_height = get_final_block_height(min(read_rpc.getblockcount(), _get_current_block_height()))
+    ledger_audit.block_height = previous_height if not full else 0
+    if last_height < first_height:
+        return
+
+    node_entries = _get_node_block_entries(rpc, read_rpc, first_height, last_height)
+    ledger_entries = _get_ledger_block_entries(first_height, last_height)
+
+    # Totals and checksum continue from the previously audited block
+    latest = BlockAudit.objects.filter(block_height__lt=first_height).order_by('-block_height').first()
+    total_transactions_count = latest.total_transactions_count if latest else 0
+    total_received = latest.total_received if latest else 0
+    checksum = latest.checksum if latest else ''
+
+    block_audits = []
+    audited_height = last_height
+    for height in sorted(set(node_entries) | set(ledger_entries)):
+        node_block = node_entries.get(height, [])
+        ledger_block = ledger_entries.get(height, [])
+        if node_block != ledger_block:
+            ledger_audit.problems.append(_describe_block_difference(height, node_block, ledger_block))
+            audited_height = height - 1
+            break
+        total_transactions_count += len(ledger_block)
+        received = sum(entry[2] for entry in ledger_block)
+        total_received += received
+        checksum = hashlib.sha256('{}|{}|{}'.format(checksum, height, ';'.join('{}:{}:{}'.format(*entry) for entry in ledger_block))).hexdigest()
+        block_audits.append(BlockAudit(
+            block_height=height,
+            transactions_count=len(ledger_block),
+            received=satoshis_to_btc(received),
+            total_transactions_count=total_transactions_count,
+            total_received=satoshis_to_btc(total_received),
+            checksum=checksum,
+        ))
+
+    if full:
+        stored = dict(BlockAudit.objects.filter(block_height__lte=previous_height).values_list('block_height', 'checksum'))
+        rebuilt = dict((block_audit.block_height, block_audit.checksum) for block_audit in block_audits if block_audit.block_height <= previous_height)
+        changed = [height for height in set(stored) | set(rebuilt) if stored.get(height) != rebuilt.get(height)]
+        if changed:
+            ledger_audit.notes.append('Audited blocks have changed since block {}.'.format(min(changed)))
+
+    with transaction.atomic():
+        if lease:
+            lease.fence()
+        BlockAudit.objects.filter(block_height__gte=first_height).delete()
+        BlockAudit.objects.bulk_create(block_audits, batch_size=AUDIT_CHUNK_SIZE)
+    ledger_audit.block_height = audited_height
+    ledger_audit.blocks_checked = max(0, audited_height - first_height + 1)
+
+
+def get_expected_holdings(ledger_total):
+    """ Returns what node should hold in confirmed unspent outputs, when
+    ledger_total is the balance of all wallets except the change wallet.
+    Change is credited to the change wallet when it is received, but it
+    is money that was already in the ledger, so it is left out. Node
+    does not count unconfirmed outputs, but ledger does count incoming
+    ones. Outputs of unsent outgoing transactions are still in node,
+    although they have been taken from wallets.
+    """
+    unconfirmed = _sum_amount(Transaction.objects.filter(incoming_txid__isnull=False, block_height__isnull=True))
+    own_addresses = Address.objects.values('address')
+    pending = _sum_amount(OutgoingTransactionOutput.objects.filter(tx__sent_at__isnull=True).exclude(bitcoin_address__in=own_addresses))
+    return ledger_total - unconfirmed + pending
+
+
+def compare_holdings(rpc, ledger_audit, full):
+    """ Incremental audit uses audited balances of wallets and asks balance
+    from node. Full audit sums all transactions and unspent outputs. The
+    totals can differ for a moment while new transactions are processed,
+    but a difference that stays over many audits is real.
+    """
+    change_wallets = Wallet.objects.filter(path=[0, INTERNAL_WALLET_CHANGE])
+    if full:
+        node_holdings = sum((unspent_output['amount'] for unspent_output in rpc.listunspent(1)), Decimal(0))
+        ledger_total = Wallet.objects.exclude(pk__in=change_wallets).getBalance(0)
+    else:
+        node_holdings = rpc.getbalance('*', 1, True)
+        ledger_total = WalletAudit.objects.exclude(wallet__in=change_wallets).aggregate(total=Sum('balance'))['total'] or Decimal(0)
+
+    ledger_audit.node_holdings = node_holdings
+    ledger_audit.expected_holdings = get_expected_holdings(ledger_total)
+    if ledger_audit.node_holdings != ledger_audit.expected_holdings:
+        ledger_audit.problems.append('Node holds {} BTC, but ledger expects {} BTC. Difference is {} BTC.'.format(
+            ledger_audit.node_holdings,
+            ledger_audit.expected_holdings,
+            ledger_audit.node_holdings - ledger_audit.expected_holdings,
+        ))
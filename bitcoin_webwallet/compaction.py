@@ -0,0 +1,120 @@
+from django.db import transaction
+from django.db.models import Case, Count, Max, Q, Sum, Value, When
+
+from decimal import Decimal
+
+from fields import BitcoinAmountField
+from models import ArchivedTransaction, Transaction, TransactionCheckpoint, Wallet, _exclude_unconfirmed, _get_current_block_height, _get_max_block_height, _sum_amount
+from utils import EXTRA_BLOCKS_TO_PROCESS, get_final_block_height
+
+
+ARCHIVE_CHUNK_SIZE = 1000
+
+ARCHIVED_FIELDS = [
+    'id', 'wallet_id', 'created_at', 'amount', 'description', 'receiving_address_id', 'sending_addresses',
+    'incoming_txid', 'block_height', 'outgoing_tx_id', 'sequence', 'running_balance',
+]
+
+
+def get_compactable_transactions(wallet, before, min_confirmations):
+    """ Returns transactions that will never change anymore. Incoming
+    transactions need enough confirmations, and they must be in blocks
+    that AddRealBitcoinTransactions does not process again, because it
+    would not find them and would add them again. Outgoing transactions
+    must be sent, because sending still needs their payers.
+    """
+    if min_confirmations <= EXTRA_BLOCKS_TO_PROCESS:
+        raise Exception('Compacted transactions need more than {} confirmations!'.format(EXTRA_BLOCKS_TO_PROCESS))
+    max_block_height = min(_get_max_block_height(min_confirmations), get_final_block_height(_get_current_block_height()))
+    txs = Transaction.objects.filter(wallet=wallet, created_at__lt=before, sequence__isnull=False)
+    txs = txs.filter(Q(incoming_txid__isnull=True) | Q(block_height__lte=max_block_height))
+    txs = txs.filter(Q(outgoing_tx__isnull=True) | Q(outgoing_tx__sent_at__isnull=False))
+    return txs
+
+
+def compact_wallet(wallet, before, min_confirmations):
+    """ Moves old transactions of wallet to archive and adds their totals
+    to the checkpoint of wallet. Returns number of compacted transactions.
+    """
+    amount_field = BitcoinAmountField()
+    with transaction.atomic():
+        # Wallet is locked, so no transactions are added meanwhile
+        Wallet.objects.select_for_update().get(pk=wallet.pk)
+
+        txs = get_compactable_transactions(wallet, before, min_confirmations)
+        totals = txs.aggregate(
+            count=Count('id'),
+            balance=Sum('amount'),
+            received=Sum(Case(When(amount__gt=0, then='amount'), default=Value(0), output_field=amount_field)),
+            max_block_height=Max('block_height'),
+        )
+        if not totals['count']:
+            return 0
+
+        # Move transactions to archive
+        while True:
+            chunk = list(txs.order_by('pk').values(*ARCHIVED_FIELDS)[:ARCHIVE_CHUNK_SIZE])
+            if not chunk:
+                break
+            ArchivedTransaction.objects.bulk_create([ArchivedTransaction(**values) for values in chunk])
+            Transaction.objects.filter(pk__in=[values['id'] for values in chunk]).delete()
+
+        checkpoint = TransactionCheckpoint.objects.filter(wallet=wallet).first()
+        if not checkpoint:
+            checkpoint = TransactionCheckpoint(wallet=wallet, compacted_until=before)
+        checkpoint.compacted_until = max(checkpoint.compacted_until, before)
+        if totals['max_block_height'] is not None:
+            checkpoint.max_block_height = max(checkpoint.max_block_height or 0, totals['max_block_height'])
+        checkpoint.transactions_count += totals['count']
+        checkpoint.received += totals['received'] or Decimal(0)
+        checkpoint.balance += totals['balance'] or Decimal(0)
+        checkpoint.sent = checkpoint.received - checkpoint.balance
+        checkpoint.save()
+
+        return totals['count']
+
+
+def verify_wallet(wallet, confirmations_list):
+    """ Compares checkpoint against archive, and balances of wallet against
+    totals calculated from both live and archived transactions. Returns
+    list of found problems.
+    """
+    problems = []
+
+    checkpoint = TransactionCheckpoint.objects.filter(wallet=wallet).first()
+    archived_txs = ArchivedTransaction.objects.filter(wallet=wallet)
+    if checkpoint:
+        expected = {
+            'transactions_count': archived_txs.count(),
+            'balance': _sum_amount(archived_txs),
+            'received': _sum_amount(archived_txs.filter(amount__gt=0)),
+            'sent': -_sum_amount(archived_txs.filter(amount__lt=0)),
+            'max_block_height': archived_txs.aggregate(Max('block_height'))['block_height__max'],
+        }
+        for name, value in expected.items():
+            if getattr(checkpoint, name) != value:
+                problems.append('Checkpoint {} is {}, but archive has {}'.format(name, getattr(checkpoint, name), value))
+    elif archived_txs.exists():
+        problems.append('Archived transactions exist without checkpoint')
+
+    # Calculate balances without checkpoint and compare them to what wallet reports
+    for confirmations in confirmations_list:
+        max_block_height = _get_max_block_height(confirmations)
+        expected_balance = Decimal(0)
+        expected_received = Decimal(0)
+        for txs in [wallet.transactions.all(), archived_txs]:
+            expected_balance += _sum_amount(_exclude_unconfirmed(txs, max_block_height))
+            if confirmations > 0:
+                expected_received += _sum_amount(_exclude_unconfirmed(txs.filter(amount__gt=0), max_block_height))
+            else:
+                expected_received += _sum_amount(txs)
+        if wallet.getBalance(confirmations) != expected_balance:
+            problems.append('Balance with {} confirmations is {}, expected {}'.format(confirmations, wallet.getBalance(confirmations), expected_balance))
+        if wallet.getReceived(confirmations) != expected_received:
+            problems.append('Received with {} confirmations is {}, expected {}'.format(confirmations, wallet.getReceived(confirmations), expected_received))
+
+    expected_sent = -_sum_amount(wallet.transactions.filter(amount__lt=0)) - _sum_amount(archived_txs.filter(amount__lt=0))
+    if wallet.getSent() != expected_sent:
+        problems.append('Sent is {}, expected {}'.format(wallet.getSent(), expected_sent))
+
+    return problems
@@ -1,30 +1,69 @@
 from django.conf import settings
 from django.core.cache import cache
-from django.db import transaction
-from django.db.models import Sum, Q
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max, Q, Sum
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now
 
 from django_cron import CronJobBase, Schedule
 
+from bitcoinrpc.authproxy import JSONRPCException
+
 import datetime
-from decimal import Decimal, ROUND_HALF_UP
-from bitcoinrpc.authproxy import AuthServiceProxy
+from collections import OrderedDict
+from decimal import Decimal
 import pytz
 import requests
-
-from models import Wallet, Address, Transaction, OutgoingTransaction, OutgoingTransactionInput, OutgoingTransactionOutput, CurrentBlockHeight
-from utils import get_fee_in_satoshis_per_byte, get_or_create_internal_wallet, INTERNAL_WALLET_CHANGE
+import threading
+import zlib
+
+from audit import run_audit
+from feed import prune_old_transaction_events, sequence_transaction_events
+from fields import btc_to_satoshis, satoshis_to_btc
+from keys import derive_address_and_private_key, get_master_key, get_watchonly_range_chunk, is_watchonly_mode
+from locks import DEFAULT_LEASE_SECONDS, acquire_lock
+from profiling import profiled
+from routers import primary_reads
+from rpc import get_read_rpc, get_rpc
+from models import LOCK_CHUNK_SIZE, Wallet, Address, Transaction, OutgoingTransaction, OutgoingTransactionInput, OutgoingTransactionOutput, CurrentBlockHeight
+from utils import get_fee_in_satoshis_per_byte, get_or_create_internal_wallet, EXTRA_BLOCKS_TO_PROCESS, INTERNAL_WALLET_CHANGE
+
+
+# Errors of sendrawtransaction, when transaction is already
+# in blockchain, or its inputs have already been spent.
+RPC_VERIFY_ERROR = -25
+RPC_VERIFY_ALREADY_IN_CHAIN = -27
+ALREADY_SENT_ERROR_CODES = [RPC_VERIFY_ERROR, RPC_VERIFY_ALREADY_IN_CHAIN]
+
+
+class LockedCronJobBase(CronJobBase):
+    """ Job that runs on only one server at a time, even if cron jobs
+    are run on many servers. Subclasses implement doLocked(). Reads
+    of the job are never routed to database replicas.
+    """
+    lease_seconds = DEFAULT_LEASE_SECONDS
+
+    @primary_reads()
+    def do(self):
+        lease = acquire_lock(self.code, self.lease_seconds)
+        if not lease:
+            # Some other server is running this job
+            return
+        with lease, profiled(self.code):
+            self.doLocked(lease)
 
 
-class AddRealBitcoinTransactions(CronJobBase):
+class AddRealBitcoinTransactions(LockedCronJobBase):
     schedule = Schedule(run_every_mins=1, retry_after_failure_mins=1)
     code = 'bitcoin_webwallet.cron.AddRealBitcoinTransactions'
 
-    def do(self):
-        rpc = AuthServiceProxy('http://' + settings.BITCOIN_RPC_USERNAME + ':' + settings.BITCOIN_RPC_PASSWORD + '@' + settings.BITCOIN_RPC_IP + ':' + str(settings.BITCOIN_RPC_PORT))
+    def doLocked(self, lease):
+        rpc = get_rpc()
+        # Block information does not need the wallet, so it can be read from any node
+        read_rpc = get_read_rpc()
 
         # Total number of blocks
-        blocks = rpc.getblockcount()
+        blocks = read_rpc.getblockcount()
         blocks_processed_queryset = CurrentBlockHeight.objects.order_by('-block_height')
         blocks_processed = blocks_processed_queryset[0].block_height if blocks_processed_queryset.count() else 0
 
@@ -32,13 +71,21 @@ class AddRealBitcoinTransactions(CronJobBase):
         # from new blocks are selected, but also transactions from several older blocks.
         # These extra transactions are updated in case something (for example fork?) is
         # able to modify transactions in old blocks.
-        EXTRA_BLOCKS_TO_PROCESS = 6
         process_since = max(0, blocks_processed - EXTRA_BLOCKS_TO_PROCESS)
-        process_since_hash = rpc.getblockhash(process_since)
+
+        # Keys of some addresses might have been imported after they were given
+        # out, so blocks since their creation are processed again to find
+        # incoming transactions that the node did not know about earlier.
+        imported_addresses = list(Address.objects.filter(import_pending=False, rescan_from_height__isnull=False).values_list('pk', 'rescan_from_height'))
+        if imported_addresses:
+            rescan_from_height = min(rescan_from_height for _, rescan_from_height in imported_addresses)
+            process_since = max(0, min(process_since, rescan_from_height - EXTRA_BLOCKS_TO_PROCESS))
+        process_since_hash = read_rpc.getblockhash(process_since)
 
         # Just to be sure: Reconstruct list of transactions, in case
-        # there are receiving to same address in same transaction.
-        txs_raw = rpc.listsinceblock(process_since_hash)['transactions']
+        # there are receiving to same address in same transaction. Watch-only
+        # transactions are included, because in watch-only mode node has no keys.
+        txs_raw = rpc.listsinceblock(process_since_hash, 1, True)['transactions']
         txs = []
         for tx_raw in txs_raw:
             # Skip other than receiving transactions
@@ -68,242 +115,553 @@ class AddRealBitcoinTransactions(CronJobBase):
                 assert tx['timereceived'] == tx_raw['timereceived']
                 tx['amount'] += tx_raw['amount']
 
-        # Get already existing transactions, so they are not created twice.
-        # This list is also used to delete those Transactions that might have
-        # disappeared because of fork or other rare event. Better be sure.
-        old_txs = Transaction.objects.filter(incoming_txid__isnull=False)
-        old_txs = old_txs.filter(Q(block_height__isnull=True) | Q(block_height__gt=process_since))
-        old_txs = list(old_txs)
-
-        # Go through transactions and create Transaction objects.
+        # Heights of blocks are read before database transaction, so it is kept short
+        block_heights = {}
         for tx in txs:
-            # Get required info
-            txid = tx['txid']
-            address = tx['address']
-            amount = tx['amount']
-            block_hash = tx['blockhash']
-            block_height = rpc.getblock(block_hash)['height'] if block_hash else None
-            created_at = datetime.datetime.utcfromtimestamp(tx['timereceived']).replace(tzinfo=pytz.utc)
-
-            # Skip transaction if it doesn't belong to any Wallet
-            try:
-                address = Address.objects.get(address=address)
-            except Address.DoesNotExist:
-                continue
+            if tx['blockhash'] and tx['blockhash'] not in block_heights:
+                block_heights[tx['blockhash']] = read_rpc.getblock(tx['blockhash'])['height']
+
+        # Last processed block is asked from primary node,
+        # because its wallet gave the transactions above.
+        blocks = rpc.getblockcount()
 
-            # Check if transaction already exists
-            already_found = False
+        # All changes are written in one transaction. If another server has
+        # taken over the lock meanwhile, nothing is written.
+        with transaction.atomic():
+            lease.fence()
+
+            # Get already existing transactions, so they are not created twice.
+            # This list is also used to delete those Transactions that might have
+            # disappeared because of fork or other rare event. Better be sure.
+            old_txs = Transaction.objects.filter(incoming_txid__isnull=False)
+            old_txs = old_txs.filter(Q(block_height__isnull=True) | Q(block_height__gt=process_since))
+            old_txs = list(old_txs)
+
+            # Lock wallets of all transactions that might be changed, in order,
+            # so that this can not deadlock with wallets sending to each other.
+            addresses = list(set(tx['address'] for tx in txs))
+            wallet_ids = set(old_tx.wallet_id for old_tx in old_txs)
+            for i in range(0, len(addresses), LOCK_CHUNK_SIZE):
+                wallet_ids.update(Address.objects.filter(address__in=addresses[i:i + LOCK_CHUNK_SIZE]).values_list('wallet_id', flat=True))
+            Wallet.objects.lockInOrder(wallet_ids)
+
+            # Go through transactions and create Transaction objects.
+            for tx in txs:
+                # Get required info
+                txid = tx['txid']
+                address = tx['address']
+                amount = tx['amount']
+                block_hash = tx['blockhash']
+                block_height = block_heights[block_hash] if block_hash else None
+                created_at = datetime.datetime.utcfromtimestamp(tx['timereceived']).replace(tzinfo=pytz.utc)
+
+                # Skip transaction if it doesn't belong to any Wallet
+                try:
+                    address = Address.objects.get(address=address)
+                except Address.DoesNotExist:
+                    continue
+
+                # Check if transaction already exists
+                already_found = False
+                for old_tx in old_txs:
+                    if old_tx.incoming_txid == txid and old_tx.receiving_address == address:
+                        assert old_tx.amount == amount
+                        # Check if transaction was confirmed
+                        if block_height and not old_tx.block_height:
+                            old_tx.setBlockHeight(block_height)
+                        # Do nothing more with transaction, as it already exists in database.
+                        old_txs.remove(old_tx)
+                        already_found = True
+                        break
+
+                # If transaction is new one
+                if not already_found:
+                    Transaction.objects.create(
+                        wallet=address.wallet,
+                        amount=amount,
+                        description='Received',
+                        incoming_txid=txid,
+                        block_height=block_height,
+                        receiving_address=address,
+                        created_at=created_at,
+                    )
+
+            # Clean remaining old transactions.
+            # The list should be empty, unless
+            # fork or something similar has happened.
             for old_tx in old_txs:
-                if old_tx.incoming_txid == txid and old_tx.receiving_address == address:
-                    assert old_tx.amount == amount
-                    # Check if transaction was confirmed
-                    if block_height and not old_tx.block_height:
-                        old_tx.block_height = block_height
-                        old_tx.save(update_fields=['block_height'])
-                    # Do nothing more with transaction, as it already exists in database.
-                    old_txs.remove(old_tx)
-                    already_found = True
-                    break
+                old_tx.delete()
 
-            # If transaction is new one
-            if not already_found:
-                new_tx = Transaction.objects.create(
-                    wallet=address.wallet,
-                    amount=amount,
-                    description='Received',
-                    incoming_txid=txid,
-                    block_height=block_height,
-                    receiving_address=address,
-                )
-                new_tx.created_at = created_at
-                new_tx.save(update_fields=['created_at'])
+            # Mark down what the last processed block was
+            if blocks_processed_queryset.exists():
+                blocks_processed_queryset.update(block_height=blocks)
+            else:
+                CurrentBlockHeight.objects.create(block_height=blocks)
 
-        # Clean remaining old transactions.
-        # The list should be empty, unless
-        # fork or something similar has happened.
-        for old_tx in old_txs:
-            old_tx.delete()
-
-        # Mark down what the last processed block was
-        blocks = rpc.getblockcount()
-        if blocks_processed_queryset.exists():
-            blocks_processed_queryset.update(block_height=blocks)
-        else:
-            CurrentBlockHeight.objects.create(block_height=blocks)
+            # Blocks of imported addresses do not need to be processed again
+            if imported_addresses:
+                Address.objects.filter(pk__in=[pk for pk, _ in imported_addresses]).update(rescan_from_height=None)
 
 
-class SendOutgoingTransactions(CronJobBase):
+class SendOutgoingTransactions(LockedCronJobBase):
     schedule = Schedule(run_every_mins=1, retry_after_failure_mins=1)
     code = 'bitcoin_webwallet.cron.SendOutgoingTransactions'
 
-    def do(self):
-        rpc = AuthServiceProxy('http://' + settings.BITCOIN_RPC_USERNAME + ':' + settings.BITCOIN_RPC_PASSWORD + '@' + settings.BITCOIN_RPC_IP + ':' + str(settings.BITCOIN_RPC_PORT))
+    def doLocked(self, lease):
+        self.processOutgoingTransactions(get_rpc(), lease=lease)
 
+    def processOutgoingTransactions(self, rpc, lease=None, worker_index=0, worker_count=1):
+        """ Sends outgoing transactions that are ready, and selects inputs
+        for new ones. Every outgoing transaction is claimed by locking its
+        row, so many workers can run this at the same time. Returns number
+        of sent transactions and number of transactions that got inputs.
+        """
         # Send all outgoing transactions that are ready to go
-        otxs_to_send = OutgoingTransaction.objects.filter(inputs_selected_at__isnull=False, sent_at=None)
-        for otx in otxs_to_send:
-            # Gather inputs argument
-            inputs = []
-            for inpt in otx.inputs.all():
-                inputs.append({
-                    'txid': inpt.bitcoin_txid,
-                    'vout': inpt.bitcoin_vout,
-                })
-            # Gather outputs argument
-            outputs = {}
-            for output in otx.outputs.all():
-                outputs.setdefault(output.bitcoin_address, Decimal(0))
-                outputs[output.bitcoin_address] += output.amount
-            # Use arguments to create, sign and send raw transaction
-            raw_tx = rpc.createrawtransaction(inputs, outputs)
-            signing_result = rpc.signrawtransaction(raw_tx)
-            raw_tx_signed = signing_result['hex']
-            if signing_result['complete']:
-                # Calculate how much fee each wallet needs to pay. Each
-                # sender pays average fee from every outgoing transaction
-                # it has, however rounding is done in a way that the
-                # total sum is exatcly the same as the total fee.
-                fees_for_wallets = []
-                fees_to_pay_left = otx.calculateFee()
-                fee_payers_left = otx.txs.count()
-                if fees_to_pay_left:
-                    txs_count = len(otx.txs.all())
-                    for tx in otx.txs.all():
-                        # Calculate fee for this payer
-                        assert fee_payers_left > 0
-                        fee = (fees_to_pay_left / fee_payers_left).quantize(Decimal('0.00000001'), rounding=ROUND_HALF_UP)
-                        fee_payers_left -= 1
-                        fees_to_pay_left -= fee
-                        if fee > 0:
-                            # Mark fee paying to correct wallet
-                            wallet_found = False
-                            for fee_for_wallet in fees_for_wallets:
-                                if fee_for_wallet['wallet'] == tx.wallet:
-                                    fee_for_wallet['amount'] += fee
-                                    wallet_found = True
-                            if not wallet_found:
-                                fees_for_wallets.append({
-                                    'wallet': tx.wallet,
-                                    'amount': fee,
-                                })
-                    assert fee_payers_left == 0
-                assert fees_to_pay_left == Decimal(0)
-
-                rpc.sendrawtransaction(raw_tx_signed)
-
-                # Atomically mark outgoing transaction as sent and
-                # add fee paying transactions to sending wallets.
-                with transaction.atomic():
-                    otx.sent_at = now()
-                    otx.save(update_fields=['sent_at'])
-
-                    for fee_for_wallet in fees_for_wallets:
-                        wallet = fee_for_wallet['wallet']
-                        amount = fee_for_wallet['amount']
-
-                        # Create fee paying transaction
-                        Transaction.objects.create(
-                            wallet=wallet,
-                            amount=str(-amount),
-                            description='Fee from sent Bitcoins',
-                            outgoing_tx=otx,
-                        )
-
-            elif signing_result.get('errors'):
-                raise Exception('Unable to sign outgoing transaction!')
-
-        # Get all outgoing transactions that do not have any inputs selected
-        otxs_without_inputs = OutgoingTransaction.objects.filter(inputs_selected_at=None)
+        sent_count = 0
+        skipped_ids = []
+        while True:
+            with transaction.atomic():
+                otx = self.claimOutgoingTransaction(
+                    OutgoingTransaction.objects.filter(inputs_selected_at__isnull=False, sent_at=None).exclude(pk__in=skipped_ids).withSummaries()
+                )
+                if not otx:
+                    break
+                if lease:
+                    lease.fence()
+                if self.sendOutgoingTransaction(rpc, otx, lease):
+                    sent_count += 1
+                else:
+                    skipped_ids.append(otx.pk)
 
         # If all outgoing transactions are fine, then do nothing more
-        if otxs_without_inputs.count() == 0:
-            return
+        if not OutgoingTransaction.objects.filter(inputs_selected_at=None).exists():
+            return sent_count, 0
 
-        # TODO: Some lock here might be a good idea, just to be sure!
+        unspent_outputs = self.getUnspentOutputs(rpc, worker_index, worker_count)
 
-        # List all unspent outputs that aren't already assigned to some outgoing transaction
+        # Assign inputs to those transactions that do not have them set
+        inputs_selected_count = 0
+        while True:
+            # Inputs of each transaction are assigned atomically, and
+            # only if this server still owns the lock. This way no other
+            # server can assign same unspent outputs at the same time.
+            with transaction.atomic():
+                otx = self.claimOutgoingTransaction(OutgoingTransaction.objects.filter(inputs_selected_at=None))
+                if not otx:
+                    break
+                if lease:
+                    lease.fence()
+                # If there was no suitable unspent outputs, then it means hot wallet does not
+                # have enough funds for this transaction. We have to give up. Already assigned
+                # inputs are, however, not cleared. Because of this, we have to give up
+                # totally, because this transaction wasted rest of the available outputs.
+                if not self.selectInputs(otx, unspent_outputs):
+                    break
+                inputs_selected_count += 1
+
+        return sent_count, inputs_selected_count
+
+    def claimOutgoingTransaction(self, otxs):
+        """ Locks and returns next outgoing transaction that no other worker
+        has locked. Must be called inside transaction, and the outgoing
+        transaction stays claimed until the transaction ends.
+        """
+        return otxs.selectForUpdateSkipLocked().order_by('id').first()
+
+    def sendOutgoingTransaction(self, rpc, otx, lease=None):
+        """ Creates, signs and sends outgoing transaction, and
+        makes sending wallets pay the fee. Returns True if sent.
+        """
+        # Gather inputs argument
+        inputs = []
+        for inpt in otx.inputs.all():
+            inputs.append({
+                'txid': inpt.bitcoin_txid,
+                'vout': inpt.bitcoin_vout,
+            })
+        # Gather outputs argument
+        outputs = {}
+        for output in otx.outputs.all():
+            outputs.setdefault(output.bitcoin_address, Decimal(0))
+            outputs[output.bitcoin_address] += output.amount
+        # Use arguments to create, sign and send raw transaction
+        raw_tx = rpc.createrawtransaction(inputs, outputs)
+        if is_watchonly_mode():
+            # Node only watches the addresses, so keys are provided here
+            signing_result = rpc.signrawtransactionwithkey(raw_tx, self.getPrivateKeysForInputs(rpc, otx))
+        else:
+            signing_result = rpc.signrawtransaction(raw_tx)
+        raw_tx_signed = signing_result['hex']
+        if not signing_result['complete']:
+            if signing_result.get('errors'):
+                raise Exception('Unable to sign outgoing transaction!')
+            return False
+
+        # Calculate how much fee each wallet needs to pay. Each
+        # sender pays average fee from every outgoing transaction
+        # it has, however rounding is done in a way that the
+        # total sum is exatcly the same as the total fee.
+        # Calculation is done in integer satoshis.
+        fees_for_wallets = OrderedDict()
+        total_fee = otx.calculateFee()
+        assert total_fee is not None
+        fees_to_pay_left = btc_to_satoshis(total_fee)
+        fee_payers_left = otx.getTxsCount()
+        if fees_to_pay_left:
+            for tx in otx.txs.select_related('wallet'):
+                # Calculate fee for this payer. Rounding is half up.
+                assert fee_payers_left > 0
+                fee = (2 * fees_to_pay_left + fee_payers_left) // (2 * fee_payers_left)
+                fee_payers_left -= 1
+                fees_to_pay_left -= fee
+                if fee > 0:
+                    # Mark fee paying to correct wallet
+                    fee_for_wallet = fees_for_wallets.setdefault(tx.wallet_id, {'wallet': tx.wallet, 'amount': 0})
+                    fee_for_wallet['amount'] += fee
+            assert fee_payers_left == 0
+        assert fees_to_pay_left == 0
+
+        if lease:
+            lease.check()
+        try:
+            rpc.sendrawtransaction(raw_tx_signed)
+        except JSONRPCException as err:
+            # If lock was lost after this was sent, but before it was marked
+            # sent, the new owner sends the same transaction again. The node
+            # refuses it, so it is marked sent if the node knows it already.
+            if err.code not in ALREADY_SENT_ERROR_CODES or not self.isTransactionKnown(rpc, raw_tx_signed):
+                raise
+
+        # Mark outgoing transaction as sent and add fee paying
+        # transactions to sending wallets. This is done in the same
+        # database transaction that claimed the outgoing transaction.
+        otx.sent_at = now()
+        otx.save(update_fields=['sent_at'])
+
+        # Wallets are locked in order, so that charging them
+        # can not deadlock with wallets sending to each other.
+        Wallet.objects.lockInOrder(fees_for_wallets.keys())
+        for fee_for_wallet in fees_for_wallets.values():
+            wallet = fee_for_wallet['wallet']
+            amount = satoshis_to_btc(fee_for_wallet['amount'])
+
+            # Create fee paying transaction
+            Transaction.objects.create(
+                wallet=wallet,
+                amount=-amount,
+                description='Fee from sent Bitcoins',
+                outgoing_tx=otx,
+            )
+
+        return True
+
+    def isTransactionKnown(self, rpc, raw_tx):
+        txid = rpc.decoderawtransaction(raw_tx)['txid']
+        try:
+            rpc.gettransaction(txid, True)
+        except JSONRPCException:
+            return False
+        return True
+
+    def getUnspentOutputs(self, rpc, worker_index=0, worker_count=1):
+        """ Lists unspent outputs that aren't already assigned to some outgoing
+        transaction. Outputs with most confirmations are first. When there are
+        many workers, outputs of this worker's partition are first, so
+        workers rarely try to assign the same outputs.
+        """
         unspent_outputs_raw = rpc.listunspent(settings.CONFIRMED_THRESHOLD)
         unspent_outputs = []
         for unspent_output in unspent_outputs_raw:
             txid = unspent_output['txid']
             vout = unspent_output['vout']
 
-            if unspent_output['spendable']:
+            # Watch-only outputs are not spendable by the node, but they can be signed here
+            if unspent_output['spendable'] or (is_watchonly_mode() and unspent_output.get('solvable')):
 
                 # If there is no existing input, then this output isn't assigned yet
-                if OutgoingTransactionInput.objects.filter(bitcoin_txid=txid, bitcoin_vout=vout).count() == 0:
+                if unspent_output['confirmations'] > 0 and not OutgoingTransactionInput.objects.filter(bitcoin_txid=txid, bitcoin_vout=vout).exists():
                     unspent_outputs.append(unspent_output)
 
-        # Assign inputs to those transactions that do not have them set
-        for otx in otxs_without_inputs:
-            # Calculate how much is being sent
-            outputs_total = otx.outputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
-
-            # Calculate fee
-            tx_size = 148 * otx.inputs.count() + 34 * (otx.outputs.count() + 1) + 10
-            fee = Decimal(get_fee_in_satoshis_per_byte()) * Decimal(tx_size) * Decimal('0.00000001')
-            fee = fee.quantize(Decimal('0.00000001'))
-
-            # Now assign inputs until there is enough for outputs
-            inputs_total = otx.inputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
-            while inputs_total < outputs_total + fee and len(unspent_outputs) > 0:
-                # Find unspent output that has most confirmations
-                best_unspent_output = None
-                best_unspent_output_i = None
-                best_unspent_output_confirmations = 0
-                for unspent_outputs_i in range(len(unspent_outputs)):
-                    unspent_output = unspent_outputs[unspent_outputs_i]
-                    if unspent_output['confirmations'] > best_unspent_output_confirmations:
-                        best_unspent_output = unspent_output
-                        best_unspent_output_i = unspent_outputs_i
-                        best_unspent_output_confirmations = unspent_output['confirmations']
-
-                # Assign this unspent output as input
-                OutgoingTransactionInput.objects.create(
-                    tx=otx,
-                    amount=best_unspent_output['amount'],
-                    bitcoin_txid=best_unspent_output['txid'],
-                    bitcoin_vout=best_unspent_output['vout'],
-                )
-                inputs_total += best_unspent_output['amount']
-
-                # Recalculate fee
-                tx_size += 148
-                fee = Decimal(get_fee_in_satoshis_per_byte()) * Decimal(tx_size) * Decimal('0.00000001')
-                fee = fee.quantize(Decimal('0.00000001'))
-
-                # Remove the best output from unspent outputs
-                del unspent_outputs[best_unspent_output_i]
-
-            # If there was no suitable unspent outputs, then it means hot wallet does not
-            # have enough funds for this transaction. We have to give up. Already assigned
-            # inputs are, however, not cleared. Because of this, we have to give up
-            # totally, because this transaction wasted rest of the available outputs.
-            if inputs_total < outputs_total + fee:
-                break
-
-            # Calculate how much extra there is, and send it back to some of the change
-            # addresses. If the system fails right after this operation, it doesn't matter,
-            # because the inputs and outputs have perfect match, and next runs will do
-            # nothing but set the "inputs_selected_at" timestamp.
-            extra_amount = inputs_total - (outputs_total + fee)
-            if extra_amount > Decimal(0):
-                change_wallet = get_or_create_internal_wallet(INTERNAL_WALLET_CHANGE)
-                change_address = change_wallet.getUnusedAddress()
-                OutgoingTransactionOutput.objects.create(tx=otx, amount=extra_amount, bitcoin_address=change_address.address)
-
-            # Enough inputs was assigned, so marking this transaction fully assigned
-            otx.inputs_selected_at = now()
-            otx.save(update_fields=['inputs_selected_at'])
-
-
-class FetchProperFee(CronJobBase):
+        def sort_key(unspent_output):
+            partition = zlib.crc32('{}:{}'.format(unspent_output['txid'], unspent_output['vout'])) % worker_count
+            return (partition != worker_index, -unspent_output['confirmations'])
+        unspent_outputs.sort(key=sort_key)
+        return unspent_outputs
+
+    def selectInputs(self, otx, unspent_outputs):
+        """ Assigns inputs from unspent_outputs until there is enough for
+        outputs and fee, and adds change output. Used outputs are removed
+        from the list. Returns False if there was not enough unspent outputs.
+        """
+        # Calculate how much is being sent
+        outputs_total = otx.outputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
+        outputs_count = otx.outputs.count()
+        fee_per_byte = get_fee_in_satoshis_per_byte()
+
+        def calculate_fee(inputs_count):
+            tx_size = 148 * inputs_count + 34 * (outputs_count + 1) + 10
+            fee = Decimal(fee_per_byte) * Decimal(tx_size) * Decimal('0.00000001')
+            return fee.quantize(Decimal('0.00000001'))
+
+        # Now assign inputs until there is enough for outputs and fee
+        inputs_count = otx.inputs.count()
+        inputs_total = otx.inputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
+        fee = calculate_fee(inputs_count)
+        while inputs_total < outputs_total + fee and len(unspent_outputs) > 0:
+            # Pick the best remaining outputs until they are enough
+            picked_outputs = []
+            picked_total = Decimal(0)
+            while inputs_total + picked_total < outputs_total + calculate_fee(inputs_count + len(picked_outputs)) and len(unspent_outputs) > 0:
+                picked_outputs.append(unspent_outputs.pop(0))
+                picked_total += picked_outputs[-1]['amount']
+
+            # Assign picked outputs as inputs. If another worker has assigned
+            # some of them already, the unique constraint refuses it. They are
+            # assigned in order of txid and vout, so workers that try to assign
+            # the same outputs wait for each other instead of deadlocking.
+            picked_outputs.sort(key=lambda unspent_output: (unspent_output['txid'], unspent_output['vout']))
+            for unspent_output in picked_outputs:
+                try:
+                    with transaction.atomic():
+                        OutgoingTransactionInput.objects.create(
+                            tx=otx,
+                            amount=unspent_output['amount'],
+                            bitcoin_txid=unspent_output['txid'],
+                            bitcoin_vout=unspent_output['vout'],
+                        )
+                except IntegrityError:
+                    continue
+                inputs_count += 1
+                inputs_total += unspent_output['amount']
+            fee = calculate_fee(inputs_count)
+
+        if inputs_total < outputs_total + fee:
+            return False
+
+        # Calculate how much extra there is, and send it back to some of the change
+        # addresses. If the system fails right after this operation, it doesn't matter,
+        # because the inputs and outputs have perfect match, and next runs will do
+        # nothing but set the "inputs_selected_at" timestamp.
+        extra_amount = inputs_total - (outputs_total + fee)
+        if extra_amount > Decimal(0):
+            change_wallet = get_or_create_internal_wallet(INTERNAL_WALLET_CHANGE)
+            change_address = change_wallet.getUnusedAddress()
+            OutgoingTransactionOutput.objects.create(tx=otx, amount=extra_amount, bitcoin_address=change_address.address)
+
+        # Enough inputs was assigned, so marking this transaction fully assigned
+        otx.inputs_selected_at = now()
+        otx.save(update_fields=['inputs_selected_at'])
+        return True
+
+    def getPrivateKeysForInputs(self, rpc, otx):
+        # Find out the addresses that are being spent
+        addresses_by_output = {}
+        for unspent_output in rpc.listunspent(0):
+            addresses_by_output[(unspent_output['txid'], unspent_output['vout'])] = unspent_output['address']
+        input_addresses = set()
+        for inpt in otx.inputs.all():
+            input_address = addresses_by_output.get((inpt.bitcoin_txid, inpt.bitcoin_vout))
+            if not input_address:
+                raise Exception('Unable to find address of outgoing transaction input!')
+            input_addresses.add(input_address)
+
+        # Derive private keys of those addresses
+        master_key = get_master_key()
+        private_keys = []
+        for address in Address.objects.filter(address__in=input_addresses).select_related('wallet'):
+            btc_address, btc_private_key = derive_address_and_private_key(master_key, address.wallet.path + [address.subpath_number])
+            assert btc_address == address.address
+            private_keys.append(btc_private_key)
+        if len(private_keys) != len(input_addresses):
+            raise Exception('Outgoing transaction spends from unknown addresses!')
+        return private_keys
+
+
+def process_outgoing_transactions_in_workers(worker_count, get_worker_rpc=get_rpc):
+    """ Processes outgoing transactions in worker threads until there is
+    nothing left to do. Returns total counts of sent transactions and
+    transactions that got inputs.
+    """
+    if worker_count > 1 and not connection.features.has_select_for_update_skip_locked:
+        raise Exception('Many workers need database that supports SELECT ... FOR UPDATE SKIP LOCKED!')
+
+    totals = [0, 0]
+    totals_lock = threading.Lock()
+    errors = []
+
+    def work(worker_index):
+        try:
+            rpc = get_worker_rpc()
+            job = SendOutgoingTransactions()
+            while True:
+                sent_count, inputs_selected_count = job.processOutgoingTransactions(rpc, worker_index=worker_index, worker_count=worker_count)
+                with totals_lock:
+                    totals[0] += sent_count
+                    totals[1] += inputs_selected_count
+                if not sent_count and not inputs_selected_count:
+                    return
+        except Exception as err:
+            errors.append(err)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(worker_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return totals[0], totals[1]
+
+
+class ImportPendingAddresses(LockedCronJobBase):
+    schedule = Schedule(run_every_mins=1, retry_after_failure_mins=1)
+    code = 'bitcoin_webwallet.cron.ImportPendingAddresses'
+
+    def doLocked(self, lease):
+        rpc = get_rpc()
+        batch_size = getattr(settings, 'ADDRESS_IMPORT_BATCH_SIZE', 500)
+
+        # Import keys in batches, until there is nothing to import or node fails
+        while True:
+            addresses = Address.objects.filter(import_pending=True)
+            addresses = addresses.filter(Q(import_retry_at__isnull=True) | Q(import_retry_at__lte=now()))
+            addresses = list(addresses.select_related('wallet').order_by('pk')[:batch_size])
+            if not addresses:
+                return
+            lease.check()
+            if self.importAddresses(rpc, addresses) is None:
+                return
+
+    def importAddresses(self, rpc, addresses, private_keys=None):
+        """ Imports private keys of addresses to node with one call, and
+        marks them imported. Node rescans blocks since the oldest of the
+        addresses was created. Failed addresses are retried later. Returns
+        number of imported addresses, or None if node could not be used.
+        Private keys are derived here, unless they are given.
+        """
+        master_key = get_master_key()
+        requests = []
+        try:
+            timestamp = self.getRescanTimestamp([address.rescan_from_height for address in addresses])
+            for i, address in enumerate(addresses):
+                if private_keys:
+                    btc_address, btc_private_key = address.address, private_keys[i]
+                else:
+                    btc_address, btc_private_key = derive_address_and_private_key(master_key, address.wallet.path + [address.subpath_number])
+                assert btc_address == address.address
+                requests.append({
+                    'scriptPubKey': {'address': btc_address},
+                    'keys': [btc_private_key],
+                    'timestamp': timestamp,
+                })
+            results = rpc.importmulti(requests, {'rescan': True})
+        except Exception as err:
+            for address in addresses:
+                self.markImportFailed(address, 'Unable to use Bitcoin node: {}'.format(err))
+            return None
+
+        imported_ids = []
+        for address, result in zip(addresses, results):
+            if result.get('success'):
+                imported_ids.append(address.pk)
+            else:
+                error = result.get('error') or {}
+                self.markImportFailed(address, 'Unable to import: {}'.format(error.get('message') if isinstance(error, dict) else error))
+        Address.objects.filter(pk__in=imported_ids).update(import_pending=False, import_retry_at=None, import_error='')
+        return len(imported_ids)
+
+    def getRescanTimestamp(self, block_heights):
+        """ Returns time of the oldest block, so node
+        knows where to start rescanning from.
+        """
+        block_heights = [block_height for block_height in block_heights if block_height is not None]
+        if not block_heights:
+            return 'now'
+        read_rpc = get_read_rpc()
+        return read_rpc.getblock(read_rpc.getblockhash(min(block_heights)))['time']
+
+    def markImportFailed(self, address, error):
+        # Wait longer after every failure, but at most an hour
+        delay_mins = min(2 ** address.import_attempts, 60)
+        Address.objects.filter(pk=address.pk).update(
+            import_attempts=F('import_attempts') + 1,
+            import_retry_at=now() + datetime.timedelta(minutes=delay_mins),
+            import_error=error[:200],
+        )
+
+
+class ExtendWatchedRanges(CronJobBase):
+    schedule = Schedule(run_every_mins=5, retry_after_failure_mins=1)
+    code = 'bitcoin_webwallet.cron.ExtendWatchedRanges'
+
+    @profiled(code)
+    @primary_reads()
+    def do(self):
+        if not is_watchonly_mode():
+            return
+
+        rpc = get_rpc()
+
+        # Extend ranges of those wallets that have used more than half of
+        # their registered range, so creating addresses never needs the node.
+        chunk = get_watchonly_range_chunk()
+        wallets = Wallet.objects.annotate(max_subpath_number=Coalesce(Max('addresses__subpath_number'), -1))
+        wallets = wallets.filter(watched_range_end__lte=F('max_subpath_number') + chunk // 2)
+        for wallet in wallets:
+            wallet.extendWatchedRange(rpc, wallet.max_subpath_number + 1 + chunk)
+
+
+class AuditLedger(LockedCronJobBase):
+    schedule = Schedule(run_every_mins=10, retry_after_failure_mins=10)
+    code = 'bitcoin_webwallet.cron.AuditLedger'
+
+    def doLocked(self, lease):
+        ledger_audit = run_audit(get_rpc(), get_read_rpc(), lease=lease)
+        # Failure makes problems visible in the log of cron jobs
+        if ledger_audit.problems:
+            raise Exception('Ledger audit found {} problems: {}'.format(len(ledger_audit.problems), ' '.join(ledger_audit.problems[:10])))
+
+
+class SequenceTransactionEvents(CronJobBase):
+    schedule = Schedule(run_every_mins=1, retry_after_failure_mins=1)
+    code = 'bitcoin_webwallet.cron.SequenceTransactionEvents'
+
+    @profiled(code)
+    def do(self):
+        # Writers give positions to their events after commit. This
+        # gives them to events whose writer failed to do it.
+        sequence_transaction_events()
+
+
+class PruneTransactionEvents(LockedCronJobBase):
+    schedule = Schedule(run_every_mins=24*60, retry_after_failure_mins=60)
+    code = 'bitcoin_webwallet.cron.PruneTransactionEvents'
+
+    def doLocked(self, lease):
+        prune_old_transaction_events()
+
+
+class FetchProperFee(LockedCronJobBase):
     schedule = Schedule(run_every_mins=20, retry_after_failure_mins=5)
     code = 'bitcoin_webwallet.cron.FetchProperFee'
 
-    def do(self):
-        response = requests.get('https://bitcoinfees.21.co/api/v1/fees/recommended')
-        response_data = response.json()
-        fee = response_data.get('fastestFee')
+    def doLocked(self, lease):
+        fee = None
+        try:
+            response = requests.get('https://bitcoinfees.21.co/api/v1/fees/recommended', timeout=30)
+            fee = response.json().get('fastestFee')
+        except (requests.RequestException, ValueError):
+            pass
+
+        # If fee service is not available, ask estimate from nodes
+        if not fee:
+            estimate = get_read_rpc().estimatesmartfee(2)
+            if estimate.get('feerate'):
+                # Convert BTC per kilobyte to satoshis per byte
+                fee = int((Decimal(estimate['feerate']) * 100000).to_integral_value())
+
         if fee:
+            lease.check()
             cache.set('fee_satoshis_per_byte', fee, 60*60)
@@ -0,0 +1,173 @@
+from django.db import router
+from django.db.models import F, Q, TextField
+from django.db.models.functions import Cast
+
+import csv
+import datetime
+import heapq
+import json
+from decimal import Decimal
+from io import BytesIO
+
+from keys import path_to_str
+from models import ArchivedTransaction, OutgoingTransaction, OutgoingTransactionOutput, Transaction
+from routers import replica_reads
+
+
+# Columns of every export. JSON columns are exported as
+# they are stored, so they do not need to be decoded.
+EXPORTS = {
+    'transactions': {
+        'fields': [
+            'id', 'wallet_id', 'wallet_path', 'created_at', 'amount', 'description', 'receiving_address',
+            'sending_addresses', 'incoming_txid', 'block_height', 'outgoing_tx_id', 'sequence', 'running_balance',
+        ],
+        'json_fields': ['sending_addresses'],
+    },
+    'outgoing_transactions': {
+        'fields': [
+            'id', 'created_at', 'inputs_selected_at', 'sent_at', 'inputs_total', 'outputs_total', 'fee', 'outputs_count', 'txs_count',
+        ],
+        'json_fields': [],
+    },
+    'outgoing_outputs': {
+        'fields': ['id', 'tx_id', 'created_at', 'sent_at', 'amount', 'bitcoin_address'],
+        'json_fields': [],
+    },
+}
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+
+
+def get_export_querysets(kind, wallet_ids=None, path=None, since=None, until=None):
+    """ Returns querysets of dicts for export, that together have all
+    rows. Transactions are exported from both the live ledger and the
+    archive of compacted transactions. Rows are filtered by wallets, by
+    BIP32 subtree of wallets and by creation time.
+    """
+    tx_querysets = []
+    for model in [Transaction, ArchivedTransaction]:
+        txs = model.objects.all()
+        if wallet_ids:
+            txs = txs.filter(wallet_id__in=wallet_ids)
+        if path is not None:
+            txs = txs.filter(wallet__path__subtree=path)
+        tx_querysets.append(txs)
+    # Outgoing transactions of the wallets, also those whose payments are compacted
+    of_wallets = Q(pk__in=tx_querysets[0].values('outgoing_tx')) | Q(pk__in=tx_querysets[1].values('outgoing_tx'))
+
+    if kind == 'transactions':
+        querysets = [
+            txs.annotate(
+                wallet_path=F('wallet__path'),
+                receiving_address_str=F('receiving_address__address'),
+                sending_addresses_json=Cast('sending_addresses', TextField()),
+            ).values(
+                'id', 'wallet_id', 'wallet_path', 'created_at', 'amount', 'description', 'receiving_address_str',
+                'sending_addresses_json', 'incoming_txid', 'block_height', 'outgoing_tx_id', 'sequence', 'running_balance',
+            )
+            for txs in tx_querysets
+        ]
+        created_at_field = 'created_at'
+    elif kind == 'outgoing_transactions':
+        queryset = OutgoingTransaction.objects.withSummaries()
+        if wallet_ids or path is not None:
+            queryset = queryset.filter(of_wallets)
+        querysets = [queryset.values(*EXPORTS[kind]['fields'])]
+        created_at_field = 'created_at'
+    elif kind == 'outgoing_outputs':
+        queryset = OutgoingTransactionOutput.objects.all()
+        if wallet_ids or path is not None:
+            queryset = queryset.filter(tx__in=OutgoingTransaction.objects.filter(of_wallets))
+        queryset = queryset.annotate(created_at=F('tx__created_at'), sent_at=F('tx__sent_at'))
+        querysets = [queryset.values(*EXPORTS[kind]['fields'])]
+        created_at_field = 'tx__created_at'
+    else:
+        raise ValueError('Unknown export: {}'.format(kind))
+
+    if since:
+        querysets = [queryset.filter(**{created_at_field + '__gte': since}) for queryset in querysets]
+    if until:
+        querysets = [queryset.filter(**{created_at_field + '__lt': until}) for queryset in querysets]
+    return querysets
+
+
+def iterate_in_chunks(querysets):
+    """ Iterates rows of querysets of dicts in primary key order. Compacted
+    transactions keep their primary keys, so they are merged with live
+    ones in their original order. iterator() fetches rows in chunks, from
+    a server side cursor on PostgreSQL, so rows are not loaded to memory
+    at once. Rows are read from replica databases, if there are any.
+    """
+    iterators = []
+    for queryset in querysets:
+        with replica_reads():
+            db_alias = router.db_for_read(queryset.model)
+        iterators.append(((row['id'], row) for row in queryset.using(db_alias).order_by('id').iterator()))
+    for _, row in heapq.merge(*iterators):
+        yield row
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return path_to_str(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _export_row(kind, row):
+    if kind == 'transactions':
+        row['receiving_address'] = row.pop('receiving_address_str')
+        row['sending_addresses'] = row.pop('sending_addresses_json')
+    return row
+
+
+def export_csv(kind, queryset):
+    """ Yields CSV export line by line.
+    """
+    fields = EXPORTS[kind]['fields']
+    buf = BytesIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for row in queryset:
+        row = _export_row(kind, row)
+        writer.writerow([_format_value(row[field]) for field in fields])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def export_jsonl(kind, queryset):
+    """ Yields JSON Lines export line by line.
+    """
+    fields = EXPORTS[kind]['fields']
+    json_fields = EXPORTS[kind]['json_fields']
+    for row in queryset:
+        row = _export_row(kind, row)
+        parts = []
+        for field in fields:
+            if field in json_fields:
+                value = row[field] or 'null'
+            elif isinstance(row[field], (int, long)) or row[field] is None:
+                value = json.dumps(row[field])
+            else:
+                value = json.dumps(_format_value(row[field]))
+            parts.append(json.dumps(field) + ': ' + value)
+        yield '{' + ', '.join(parts) + '}\n'
+
+
+def export(kind, export_format, **filters):
+    queryset = iterate_in_chunks(get_export_querysets(kind, **filters))
+    if export_format == 'csv':
+        return export_csv(kind, queryset)
+    if export_format == 'jsonl':
+        return export_jsonl(kind, queryset)
+    raise ValueError('Unknown export format: {}'.format(export_format))
@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Max, Value, When
+from django.utils.timezone import now
+
+import datetime
+import time
+
+from models import JobLock, TransactionEvent
+from routers import primary_reads
+
+
+FEED_PAGE_SIZE = 100
+
+# Positions of a chunk are set in one query, that has three parameters per event
+SEQUENCE_CHUNK_SIZE = 300
+
+# Row of JobLock that is locked while positions are given
+SEQUENCER_LOCK_NAME = 'transaction_event_sequencer'
+
+# How often waiting for events checks the database
+LONG_POLL_INTERVAL = 1.0
+
+EVENT_FIELDS = ['id', 'position', 'wallet_id', 'tx_id', 'kind', 'amount', 'block_height', 'balance', 'created_at']
+
+
+def get_event_retention_days():
+    return getattr(settings, 'TRANSACTION_EVENT_RETENTION_DAYS', 30)
+
+
+@primary_reads()
+def sequence_transaction_events():
+    """ Gives positions to committed events that do not have one yet, in
+    order of ID. Events get their ID when they are inserted, but database
+    transactions commit in any order, so an event with smaller ID can
+    become visible after a cursor has passed it. Positions are given
+    only to visible events, so they never appear behind a cursor.
+    Writers of events call this after they have committed, and the
+    SequenceTransactionEvents cron job calls it in case they fail.
+    Returns the number of events that got a position.
+    """
+    events = TransactionEvent.objects.filter(position__isnull=True)
+    if not events.exists():
+        return 0
+    JobLock.objects.get_or_create(name=SEQUENCER_LOCK_NAME)
+    count = 0
+    with transaction.atomic():
+        # Only one sequencer at a time, so no position is given twice
+        JobLock.objects.select_for_update().get(name=SEQUENCER_LOCK_NAME)
+        position = TransactionEvent.objects.aggregate(Max('position'))['position__max'] or 0
+        while True:
+            event_ids = list(events.order_by('pk').values_list('pk', flat=True)[:SEQUENCE_CHUNK_SIZE])
+            if not event_ids:
+                return count
+            positions = [When(pk=event_id, then=Value(position + i + 1)) for i, event_id in enumerate(event_ids)]
+            TransactionEvent.objects.filter(pk__in=event_ids).update(position=Case(*positions, output_field=BigIntegerField()))
+            position += len(event_ids)
+            count += len(event_ids)
+
+
+def get_latest_cursor():
+    """ Returns cursor that follows only future events. Clients read
+    this before reading balances, and follow events from there.
+    """
+    return TransactionEvent.objects.aggregate(Max('position'))['position__max'] or 0
+
+
+def get_transaction_events(cursor=0, wallet_ids=None, limit=FEED_PAGE_SIZE):
+    """ Returns events after cursor as dicts, oldest first, and cursor for
+    the next call. Cursor is a position, so events that are committed
+    late are not missed, neither when following all wallets. Events of
+    a wallet are always in order. Events get positions after they are
+    committed, so this only reads.
+    """
+    events = TransactionEvent.objects.filter(position__gt=cursor)
+    if wallet_ids:
+        events = events.filter(wallet_id__in=wallet_ids)
+    events = list(events.order_by('position').values(*EVENT_FIELDS)[:limit])
+    next_cursor = events[-1]['position'] if events else cursor
+    return events, next_cursor
+
+
+def wait_for_transaction_events(cursor=0, wallet_ids=None, limit=FEED_PAGE_SIZE, timeout=30):
+    """ Like get_transaction_events(), but if there are no events yet,
+    waits for them at most timeout seconds.
+    """
+    deadline = time.time() + timeout
+    while True:
+        events, next_cursor = get_transaction_events(cursor, wallet_ids, limit)
+        remaining = deadline - time.time()
+        if events or remaining <= 0:
+            return events, next_cursor
+        time.sleep(min(LONG_POLL_INTERVAL, remaining))
+
+
+def is_cursor_expired(cursor):
+    """ Returns True if events after cursor might have been pruned.
+    Then client must read balances again and start from latest cursor.
+    """
+    oldest = TransactionEvent.objects.filter(position__isnull=False).order_by('position').values_list('position', flat=True).first()
+    return bool(cursor) and oldest is not None and cursor < oldest - 1
+
+
+def prune_transaction_events(before):
+    """ Removes events created before given time. Latest event is
+    always kept, so expired cursors can be noticed. Events without
+    position have not been read yet, so they are kept too.
+    """
+    latest_cursor = get_latest_cursor()
+    return TransactionEvent.objects.filter(created_at__lt=before, position__lt=latest_cursor).delete()[0]
+
+
+def prune_old_transaction_events():
+    return prune_transaction_events(now() - datetime.timedelta(days=get_event_retention_days()))
@@ -1,20 +1,24 @@
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models.fields import Field
+from django.db.models import Lookup
+from django.db.models.fields import BigIntegerField, Field
 from django.utils.six import with_metaclass
 from django.utils.translation import ugettext_lazy as _
 
-from pycoin.key.validate import is_address_valid, is_private_bip32_valid
+from decimal import Decimal, InvalidOperation
+
+from pycoin.key.validate import is_private_bip32_valid
+
+from validation import is_address_valid
 
 
 class BitcoinAddressValidator():
     def __call__(self, value):
-        value = str(value)
         if getattr(settings, 'TESTNET', False):
-            if is_address_valid(value) != 'XTN':
+            if not is_address_valid(value, 'XTN'):
                 raise ValidationError(_(u'%s is not a valid bitcoin testnet address!') % value)
         else:
-            if is_address_valid(value) != 'BTC':
+            if not is_address_valid(value, 'BTC'):
                 raise ValidationError(_(u'%s is not a valid bitcoin address!') % value)
 
 
@@ -35,6 +39,46 @@ class BitcoinAddressField(Field):
         return value
 
 
+SATOSHIS_PER_BTC = 100000000
+
+
+def btc_to_satoshis(amount):
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * SATOSHIS_PER_BTC).to_integral_value())
+
+
+def satoshis_to_btc(satoshis):
+    return Decimal(satoshis).scaleb(-8)
+
+
+class BitcoinAmountField(BigIntegerField):
+    """ Stores amount as integer satoshis, so database sums integers.
+    For Python code, amounts are Decimal bitcoins, just like before.
+    """
+
+    description = 'Amount of bitcoins, stored as satoshis'
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return None
+        return satoshis_to_btc(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value))
+        except InvalidOperation:
+            raise ValidationError(u'%s is not a valid bitcoin amount!' % value)
+
+    def get_prep_value(self, value):
+        value = Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        return btc_to_satoshis(self.to_python(value))
+
+
 class BIP32PrivateKeyValidator():
     def __call__(self, value):
         value = str(value)
@@ -95,3 +139,20 @@ class BIP32PathField(Field):
                 raise ValidationError('BIP32Path must be list of integers or longs!')
             # TODO: Check min and max values!
         return '/'.join([str(i) for i in value])
+
+
+@BIP32PathField.register_lookup
+class BIP32PathSubtree(Lookup):
+    """ Matches given path and all paths below it. Paths are
+    compared as prefixes, so that index can be used, and
+    separator is included, so that 1/2 does not match 1/23.
+    """
+    lookup_name = 'subtree'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        path_str = self.lhs.output_field.get_prep_value(list(self.rhs))
+        if not path_str:
+            return '%s IS NOT NULL' % lhs, lhs_params
+        return '(%s = %%s OR %s LIKE %%s)' % (lhs, lhs), lhs_params + [path_str] + lhs_params + [path_str + '/%']
@@ -0,0 +1,110 @@
+from django.conf import settings
+
+from pycoin.key import Key
+
+
+DESCRIPTOR_INPUT_CHARSET = '0123456789()[],\'/*abcdefgh@:$%{}IJKLMNOPQRSTUVWXYZ&+-.;<=>?!^_|~ijklmnopqrstuvwxyzABCDEFGH`#"\\ '
+DESCRIPTOR_CHECKSUM_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+DESCRIPTOR_GENERATOR = [0xf5dee51989, 0xa9fdca3312, 0x1bab10e32d, 0x3706b1677a, 0x644d626ffd]
+
+
+def is_watchonly_mode():
+    return getattr(settings, 'BITCOIN_WATCHONLY', False)
+
+
+def get_watchonly_range_chunk():
+    return getattr(settings, 'WATCHONLY_RANGE_CHUNK', 1000)
+
+
+def get_master_key():
+    return Key.from_text(settings.MASTERWALLET_BIP32_KEY)
+
+
+def path_to_str(path):
+    return '/'.join([str(i) for i in path])
+
+
+def path_from_str(path_str):
+    return [int(i_str) for i_str in path_str.strip('/').split('/') if i_str]
+
+
+def derive_address_and_private_key(master_key, full_path):
+    subkey = master_key.subkeys(path_to_str(full_path)).next()
+    return subkey.address(use_uncompressed=False), subkey.wif(use_uncompressed=False)
+
+
+def derive_first_address(master_key, wallet_path, with_descriptor=False):
+    """ Returns first address of wallet, its private key, and ranged
+    descriptor of wallet if asked. Wallet key is derived only once.
+    """
+    wallet_key = master_key.subkey_for_path(path_to_str(wallet_path))
+    subkey = wallet_key.subkey(0)
+    descriptor = _get_descriptor(wallet_key) if with_descriptor else None
+    return subkey.address(use_uncompressed=False), subkey.wif(use_uncompressed=False), descriptor
+
+
+# Master key of worker process. It is parsed only once per
+# process, instead of once per derived address.
+_worker_master_key = None
+
+
+def init_derivation_worker(master_key_text):
+    """ Initializer for multiprocessing.Pool that derives keys.
+    """
+    global _worker_master_key
+    _worker_master_key = Key.from_text(master_key_text)
+
+
+def derive_address_and_private_key_in_worker(full_path):
+    return derive_address_and_private_key(_worker_master_key, full_path)
+
+
+def derive_first_address_in_worker(args):
+    wallet_path, with_descriptor = args
+    return derive_first_address(_worker_master_key, wallet_path, with_descriptor)
+
+
+def _descriptor_polymod(c, val):
+    c0 = c >> 35
+    c = ((c & 0x7ffffffff) << 5) ^ val
+    for i in range(5):
+        if (c0 >> i) & 1:
+            c ^= DESCRIPTOR_GENERATOR[i]
+    return c
+
+
+def descriptor_checksum(descriptor):
+    """ Calculates checksum of output script descriptor, so
+    descriptors can be given to node without asking it first.
+    """
+    c = 1
+    cls = 0
+    clscount = 0
+    for ch in descriptor:
+        pos = DESCRIPTOR_INPUT_CHARSET.find(ch)
+        if pos == -1:
+            raise ValueError('Invalid character in descriptor!')
+        c = _descriptor_polymod(c, pos & 31)
+        cls = cls * 3 + (pos >> 5)
+        clscount += 1
+        if clscount == 3:
+            c = _descriptor_polymod(c, cls)
+            cls = 0
+            clscount = 0
+    if clscount > 0:
+        c = _descriptor_polymod(c, cls)
+    for i in range(8):
+        c = _descriptor_polymod(c, 0)
+    c ^= 1
+    return ''.join([DESCRIPTOR_CHECKSUM_CHARSET[(c >> (5 * (7 - i))) & 31] for i in range(8)])
+
+
+def get_wallet_descriptor(master_key, wallet_path):
+    """ Returns ranged descriptor that covers all addresses of a wallet.
+    """
+    return _get_descriptor(master_key.subkey_for_path(path_to_str(wallet_path)))
+
+
+def _get_descriptor(wallet_key):
+    descriptor = 'pkh(' + wallet_key.hwif(as_private=False) + '/*)'
+    return descriptor + '#' + descriptor_checksum(descriptor)
@@ -0,0 +1,140 @@
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+
+from models import JobLock
+
+
+DEFAULT_LEASE_SECONDS = 120
+
+
+class LockLost(Exception):
+    pass
+
+
+class Lease(object):
+    """ Ownership of JobLock for limited time. Heartbeat thread renews the
+    lease while the job runs. Writes that must not be done twice should
+    be made in transaction that calls fence() first.
+    """
+
+    def __init__(self, name, owner, token, lease_seconds):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self.expires_at = time.time() + lease_seconds
+        self.lost = False
+        self.stop_heartbeat = threading.Event()
+        self.thread = None
+
+    def _lock(self):
+        return JobLock.objects.filter(name=self.name, owner=self.owner, token=self.token)
+
+    def renew(self):
+        renewed_at = time.time()
+        moment = now()
+        updated = self._lock().update(
+            expires_at=moment + datetime.timedelta(seconds=self.lease_seconds),
+            heartbeat_at=moment,
+        )
+        if not updated:
+            self.lost = True
+            raise LockLost('Lock {} was taken by someone else!'.format(self.name))
+        self.expires_at = renewed_at + self.lease_seconds
+
+    def check(self):
+        """ Quick check without database. Use before calls that
+        can not be part of database transaction.
+        """
+        if self.lost or time.time() >= self.expires_at:
+            raise LockLost('Lock {} has expired!'.format(self.name))
+
+    def fence(self):
+        """ Verifies that lock is still owned, and keeps the lock row
+        locked until the current transaction ends. Nobody can take the
+        lock over before the writes of the transaction are committed.
+        """
+        if not transaction.get_connection().in_atomic_block:
+            raise RuntimeError('Fence must be inside transaction!')
+        self.check()
+        updated = self._lock().filter(expires_at__gt=now()).update(heartbeat_at=now())
+        if not updated:
+            self.lost = True
+            raise LockLost('Lock {} was taken by someone else!'.format(self.name))
+
+    def release(self):
+        self.stopHeartbeat()
+        if not self.lost:
+            self._lock().update(owner='', expires_at=None)
+            self.lost = True
+
+    def startHeartbeat(self):
+        self.thread = threading.Thread(target=self._runHeartbeat, name='bitcoin_webwallet lock ' + self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stopHeartbeat(self):
+        if self.thread:
+            self.stop_heartbeat.set()
+            self.thread.join()
+            self.thread = None
+
+    def _runHeartbeat(self):
+        try:
+            while not self.stop_heartbeat.wait(self.lease_seconds / 3.0):
+                try:
+                    self.renew()
+                except LockLost:
+                    return
+                except Exception:
+                    # Database might be busy, so try again soon. If renewing
+                    # keeps failing, the lease expires and check() notices it.
+                    pass
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.startHeartbeat()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def get_owner_id():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:12])
+
+
+def acquire_lock(name, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """ Tries to take the lock. Returns Lease, or None if the
+    lock is currently owned by someone else.
+    """
+    try:
+        JobLock.objects.get_or_create(name=name)
+    except IntegrityError:
+        # Someone else created it at the same time
+        pass
+
+    owner = get_owner_id()
+    moment = now()
+    with transaction.atomic():
+        # Lock is taken with single conditional update, so
+        # two servers can never both succeed at the same time.
+        updated = JobLock.objects.filter(name=name).filter(Q(expires_at__isnull=True) | Q(expires_at__lte=moment)).update(
+            owner=owner,
+            token=F('token') + 1,
+            expires_at=moment + datetime.timedelta(seconds=lease_seconds),
+            heartbeat_at=moment,
+        )
+        if not updated:
+            return None
+        token = JobLock.objects.get(name=name, owner=owner).token
+    return Lease(name, owner, token, lease_seconds)
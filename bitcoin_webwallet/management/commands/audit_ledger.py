@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import time
+
+from bitcoin_webwallet.audit import run_audit
+from bitcoin_webwallet.cron import AuditLedger
+from bitcoin_webwallet.locks import acquire_lock
+from bitcoin_webwallet.rpc import get_read_rpc, get_rpc
+
+
+class Command(BaseCommand):
+    help = 'Verifies ledger against itself and Bitcoin node. By default only changes since the previous audit are checked.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', default=False, help='Check everything and rebuild audit checkpoints from scratch.')
+
+    def handle(self, *args, **options):
+        # Same lock as cron job, so audits never run at the same time
+        lease = acquire_lock(AuditLedger.code, AuditLedger.lease_seconds)
+        if not lease:
+            raise CommandError('Ledger is being audited already!')
+
+        started_at = time.time()
+        with lease:
+            ledger_audit = run_audit(get_rpc(), get_read_rpc(), full=options['full'], lease=lease)
+
+        self.stdout.write('Checked {} wallets and {} blocks in {:.1f} seconds. Blocks are audited until {}.'.format(
+            ledger_audit.wallets_checked,
+            ledger_audit.blocks_checked,
+            time.time() - started_at,
+            ledger_audit.block_height,
+        ))
+        if ledger_audit.node_holdings is not None:
+            self.stdout.write('Node holds {} BTC, ledger expects {} BTC.'.format(ledger_audit.node_holdings, ledger_audit.expected_holdings))
+        for note in ledger_audit.notes:
+            self.stdout.write(note)
+        for problem in ledger_audit.problems:
+            self.stdout.write(problem)
+        if ledger_audit.problems:
+            raise CommandError('Found {} problems!'.format(len(ledger_audit.problems)))
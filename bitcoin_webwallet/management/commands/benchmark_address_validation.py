@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from pycoin.key import Key
+from pycoin.key.validate import is_address_valid as pycoin_is_address_valid
+
+import random
+import time
+
+from bitcoin_webwallet.validation import clear_validation_cache, validate_addresses
+
+
+class Command(BaseCommand):
+    help = 'Compares batch address validation against validating every address with pycoin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50000, help='How many addresses are validated.')
+        parser.add_argument('--unique', type=int, default=5000, help='How many different addresses there are.')
+
+    def handle(self, *args, **options):
+        for netcode in ['BTC', 'XTN']:
+            addresses = self.generateAddresses(netcode, options['count'], options['unique'])
+
+            started_at = time.time()
+            pycoin_results = [pycoin_is_address_valid(address) == netcode for address in addresses]
+            pycoin_time = time.time() - started_at
+
+            clear_validation_cache()
+            started_at = time.time()
+            batch_results = validate_addresses(addresses, netcode)
+            batch_time = time.time() - started_at
+
+            started_at = time.time()
+            validate_addresses(addresses, netcode)
+            cached_time = time.time() - started_at
+
+            assert pycoin_results == batch_results
+
+            self.stdout.write('{}: {} addresses, {} valid'.format(netcode, len(addresses), sum(batch_results)))
+            self.stdout.write('  pycoin:       {:.3f} s'.format(pycoin_time))
+            self.stdout.write('  batch:        {:.3f} s'.format(batch_time))
+            self.stdout.write('  batch cached: {:.3f} s'.format(cached_time))
+
+    def generateAddresses(self, netcode, count, unique):
+        addresses = []
+        for i in range(unique):
+            address = Key(secret_exponent=i + 1, netcode=netcode).address(use_uncompressed=False)
+            # Every tenth address gets a typo
+            if i % 10 == 0:
+                address = address[:-1] + ('1' if address[-1] != '1' else '2')
+            addresses.append(address)
+        return [random.choice(addresses) for i in range(count)]
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from bitcoin_webwallet.fields import btc_to_satoshis, satoshis_to_btc
+
+
+class Command(BaseCommand):
+    help = 'Compares Decimal amounts with integer satoshi amounts in database sums and fee calculation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='How many amounts are summed in database.')
+        parser.add_argument('--payers', type=int, default=200000, help='How many payers share the fee.')
+
+    def handle(self, *args, **options):
+        satoshi_amounts = [random.randint(-10 ** 8, 10 ** 9) for i in range(options['rows'])]
+
+        # Sum same amounts stored both ways. Temporary table is dropped with the rollback.
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute('CREATE TEMPORARY TABLE bitcoin_webwallet_benchmark (amount_decimal DECIMAL(16, 8), amount_satoshis BIGINT)')
+            cursor.executemany(
+                'INSERT INTO bitcoin_webwallet_benchmark (amount_decimal, amount_satoshis) VALUES (%s, %s)',
+                [(satoshis_to_btc(amount), amount) for amount in satoshi_amounts]
+            )
+            for column in ['amount_decimal', 'amount_satoshis']:
+                started_at = time.time()
+                for i in range(5):
+                    cursor.execute('SELECT SUM({}) FROM bitcoin_webwallet_benchmark'.format(column))
+                    cursor.fetchone()
+                self.stdout.write('SUM of {} rows using {}: {:.4f} s'.format(len(satoshi_amounts), column, (time.time() - started_at) / 5))
+            transaction.set_rollback(True)
+
+        # Share fee between payers, like when outgoing transaction is sent
+        total_fee = Decimal('0.12345678')
+        payers = options['payers']
+
+        started_at = time.time()
+        fees_to_pay_left = total_fee
+        for fee_payers_left in range(payers, 0, -1):
+            fee = (fees_to_pay_left / fee_payers_left).quantize(Decimal('0.00000001'), rounding=ROUND_HALF_UP)
+            fees_to_pay_left -= fee
+        assert fees_to_pay_left == 0
+        self.stdout.write('Fee shared to {} payers using Decimal: {:.4f} s'.format(payers, time.time() - started_at))
+
+        started_at = time.time()
+        fees_to_pay_left = btc_to_satoshis(total_fee)
+        for fee_payers_left in range(payers, 0, -1):
+            fee = (2 * fees_to_pay_left + fee_payers_left) // (2 * fee_payers_left)
+            fees_to_pay_left -= fee
+        assert fees_to_pay_left == 0
+        self.stdout.write('Fee shared to {} payers using satoshis: {:.4f} s'.format(payers, time.time() - started_at))
@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+import os
+import random
+import time
+from decimal import Decimal
+
+from bitcoin_webwallet.cron import process_outgoing_transactions_in_workers
+from bitcoin_webwallet.keys import derive_address_and_private_key, get_master_key, is_watchonly_mode
+from bitcoin_webwallet.models import OutgoingTransaction, OutgoingTransactionInput, OutgoingTransactionOutput, Transaction, Wallet
+from bitcoin_webwallet.utils import get_fee_in_satoshis_per_byte, get_or_create_internal_wallet, INTERNAL_WALLET_CHANGE
+
+
+class FakeRPC(object):
+    """ Answers the calls that are needed for sending outgoing
+    transactions. Every call takes given time, like a real node.
+    """
+
+    def __init__(self, unspent_outputs, latency):
+        self.unspent_outputs = unspent_outputs
+        self.latency = latency
+
+    def listunspent(self, minconf):
+        time.sleep(self.latency)
+        return [unspent_output for unspent_output in self.unspent_outputs if unspent_output['confirmations'] >= minconf]
+
+    def createrawtransaction(self, inputs, outputs):
+        time.sleep(self.latency)
+        return 'raw'
+
+    def signrawtransaction(self, raw_tx):
+        time.sleep(self.latency)
+        return {'hex': 'signed', 'complete': True}
+
+    def sendrawtransaction(self, raw_tx):
+        time.sleep(self.latency)
+        return os.urandom(32).encode('hex')
+
+
+class Command(BaseCommand):
+    help = 'Measures throughput of sending outgoing transactions with given numbers of workers, using a fake Bitcoin node'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=200, help='How many outgoing transactions are sent on every round.')
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma separated list of worker counts to measure.')
+        parser.add_argument('--rpc-latency', type=float, default=0.02, help='How many seconds every call to the Bitcoin node takes.')
+        parser.add_argument('--path', type=int, default=999999, help='Root of BIP32 paths for temporary wallets.')
+
+    def handle(self, *args, **options):
+        worker_counts = [int(workers) for workers in options['workers'].split(',')]
+        if max(worker_counts) > 1 and not connection.features.has_select_for_update_skip_locked:
+            raise CommandError('Many workers need database that supports SELECT ... FOR UPDATE SKIP LOCKED!')
+        if is_watchonly_mode():
+            raise CommandError('Benchmark does not support watch-only mode!')
+        # Workers would send real pending transactions with fake node
+        if OutgoingTransaction.objects.filter(sent_at=None).exists():
+            raise CommandError('There must be no pending outgoing transactions in database!')
+        if Wallet.objects.subtree([options['path']]).exists():
+            raise CommandError('There are already wallets under path {}!'.format(options['path']))
+
+        # Workers create change addresses for fake outputs. They are removed
+        # afterwards, so they are not imported to the Bitcoin node.
+        change_wallet = get_or_create_internal_wallet(INTERNAL_WALLET_CHANGE)
+        latest_change_subpath = change_wallet.addresses.aggregate(Max('subpath_number'))['subpath_number__max']
+        if latest_change_subpath is None:
+            latest_change_subpath = -1
+
+        master_key = get_master_key()
+        wallets = [Wallet.objects.create(path=[options['path'], i]) for i in range(options['transactions'])]
+        target_address = derive_address_and_private_key(master_key, [options['path'], 0, 0])[0]
+        try:
+            for worker_count in worker_counts:
+                fake_rpc = self.createOutgoingTransactions(wallets, target_address, options['rpc_latency'])
+
+                started_at = time.time()
+                sent_count, inputs_selected_count = process_outgoing_transactions_in_workers(worker_count, lambda: fake_rpc)
+                elapsed = time.time() - started_at
+
+                assert sent_count == inputs_selected_count == len(wallets)
+                assert OutgoingTransactionOutput.objects.filter(tx__txs__wallet__in=wallets).distinct().count() == 2 * len(wallets)
+                assert not OutgoingTransaction.objects.filter(sent_at=None).exists()
+                self.stdout.write('{} workers: {} transactions in {:.2f} s, {:.1f} transactions per second'.format(
+                    worker_count,
+                    sent_count,
+                    elapsed,
+                    sent_count / elapsed,
+                ))
+
+                self.deleteOutgoingTransactions(wallets)
+        finally:
+            self.deleteOutgoingTransactions(wallets)
+            Wallet.objects.filter(pk__in=[wallet.pk for wallet in wallets]).delete()
+            change_wallet.addresses.filter(subpath_number__gt=latest_change_subpath).delete()
+
+    def createOutgoingTransactions(self, wallets, target_address, latency):
+        """ Creates one outgoing transaction for every wallet, and one
+        unspent output for each of them. Every unspent output pays any
+        one transaction and leaves change, so workers also allocate
+        change addresses concurrently, like in production.
+        """
+        satoshi = Decimal('0.00000001')
+        amount = Decimal(random.randint(10000, 10 ** 8)) * satoshi
+        # Fee for one input and output plus change, like when inputs are selected
+        fee = (Decimal(get_fee_in_satoshis_per_byte()) * Decimal(148 + 34 * 2 + 10) * satoshi).quantize(satoshi)
+        unspent_outputs = []
+        with transaction.atomic():
+            for wallet in wallets:
+                otx = OutgoingTransaction.objects.create()
+                OutgoingTransactionOutput.objects.create(tx=otx, amount=amount, bitcoin_address=target_address)
+                Transaction.objects.create(wallet=wallet, amount=-amount, description='Benchmark', outgoing_tx=otx)
+                unspent_outputs.append({
+                    'txid': os.urandom(32).encode('hex'),
+                    'vout': 0,
+                    'amount': amount + fee + Decimal(random.randint(1000, 10 ** 6)) * satoshi,
+                    'confirmations': random.randint(1, 1000),
+                    'spendable': True,
+                })
+        return FakeRPC(unspent_outputs, latency)
+
+    def deleteOutgoingTransactions(self, wallets):
+        wallet_ids = [wallet.pk for wallet in wallets]
+        otx_ids = list(Transaction.objects.filter(wallet_id__in=wallet_ids).values_list('outgoing_tx_id', flat=True).distinct())
+        Transaction.objects.filter(wallet_id__in=wallet_ids).delete()
+        OutgoingTransactionInput.objects.filter(tx_id__in=otx_ids).delete()
+        OutgoingTransactionOutput.objects.filter(tx_id__in=otx_ids).delete()
+        OutgoingTransaction.objects.filter(pk__in=otx_ids).delete()
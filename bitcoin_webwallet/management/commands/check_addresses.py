@@ -1,45 +1,177 @@
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
+from bitcoinrpc.authproxy import JSONRPCException
 
-from pycoin.key import Key
+import json
+import multiprocessing
+import os
+import time
 
-from bitcoin_webwallet.models import Address
+from bitcoin_webwallet.cron import ImportPendingAddresses
+from bitcoin_webwallet.keys import derive_address_and_private_key_in_worker, get_master_key, get_wallet_descriptor, init_derivation_worker, is_watchonly_mode
+from bitcoin_webwallet.models import Address, Wallet
+from bitcoin_webwallet.rpc import get_rpc
 
 
 class Command(BaseCommand):
     help = 'Makes sure Bitcoin node is aware of all addresses'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='How many addresses are checked and imported at once.')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Number of processes used for key derivation.')
+        parser.add_argument('--checkpoint', default=None, help='File where progress is stored. If it exists, checking resumes from it.')
+        parser.add_argument('--birth-timestamp', type=int, default=0, help='Unix timestamp given to importmulti as the creation time of the imported keys.')
+        parser.add_argument('--rescan', action='store_true', default=False, help='Ask node to rescan blockchain after each imported chunk.')
+        parser.add_argument('--pending', action='store_true', default=False, help='Only import addresses that are waiting to be imported, without waiting for retry delays.')
+
     def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+        if chunk_size < 1:
+            raise CommandError('Chunk size must be at least one!')
+
+        rpc = get_rpc()
+
+        if options['pending']:
+            self.importPending(rpc, chunk_size)
+            self.reportPending()
+            return
+
+        last_pk = self.readCheckpoint(checkpoint)
+        if last_pk:
+            self.stdout.write('Resuming after address #{}'.format(last_pk))
+
+        pool = multiprocessing.Pool(max(1, options['workers']), init_derivation_worker, (settings.MASTERWALLET_BIP32_KEY,))
 
-        rpc = AuthServiceProxy('http://' + settings.BITCOIN_RPC_USERNAME + ':' + settings.BITCOIN_RPC_PASSWORD + '@' + settings.BITCOIN_RPC_IP + ':' + str(settings.BITCOIN_RPC_PORT))
+        addresses_checked = 0
+        addresses_imported = 0
+        started_at = time.time()
 
-        private_keys_imported = False
+        try:
+            while True:
+                # Pending addresses are imported by ImportPendingAddresses
+                addresses = Address.objects.filter(pk__gt=last_pk, import_pending=False).order_by('pk')
+                addresses = addresses.values_list('pk', 'address', 'subpath_number', 'wallet__path')
+                addresses = list(addresses[:chunk_size].iterator())
+                if not addresses:
+                    break
 
-        for address in Address.objects.all():
-            address_found = True
-            try:
-                rpc.dumpprivkey(address.address)
-            except JSONRPCException as e:
-                if e.code == -4:
-                    # Address is not found
-                    print 'Address ' + address.address + ' was not found. Importing it...'
+                # Find out which of the addresses are unknown to the node
+                missing = [address for address, known in zip(addresses, self.checkAddresses(rpc, [a[1] for a in addresses])) if not known]
 
+                if missing and is_watchonly_mode():
+                    addresses_imported += self.registerWallets(rpc, missing, options['birth_timestamp'], options['rescan'])
+                elif missing:
                     # Do some key magic
-                    new_address_full_path = address.wallet.path + [address.subpath_number]
-                    new_address_full_path_str = '/'.join([str(i) for i in new_address_full_path])
-                    key = Key.from_text(settings.MASTERWALLET_BIP32_KEY)
-                    subkey = key.subkeys(new_address_full_path_str).next()
+                    derived = pool.map(derive_address_and_private_key_in_worker, [wallet_path + [subpath_number] for _, _, subpath_number, wallet_path in missing])
 
-                    # Check address and form the private key
-                    btc_address = subkey.address(use_uncompressed=False)
-                    assert btc_address == address.address
-                    btc_private_key = subkey.wif(use_uncompressed=False)
+                    requests = []
+                    for (_, address, _, _), (btc_address, btc_private_key) in zip(missing, derived):
+                        assert btc_address == address
+                        requests.append({
+                            'scriptPubKey': {'address': btc_address},
+                            'keys': [btc_private_key],
+                            'timestamp': options['birth_timestamp'],
+                        })
 
                     # Do the importing
-                    rpc.importprivkey(btc_private_key, '', False)
-                    private_keys_imported = True
+                    for request, result in zip(requests, rpc.importmulti(requests, {'rescan': options['rescan']})):
+                        if not result.get('success'):
+                            raise CommandError('Unable to import address {}: {}'.format(request['scriptPubKey']['address'], result.get('error')))
+                    addresses_imported += len(requests)
+
+                last_pk = addresses[-1][0]
+                self.writeCheckpoint(checkpoint, last_pk)
+
+                addresses_checked += len(addresses)
+                elapsed = max(time.time() - started_at, 0.000001)
+                self.stdout.write('Checked {} addresses, imported {}. {:.1f} addresses per second.'.format(addresses_checked, addresses_imported, addresses_checked / elapsed))
+        finally:
+            pool.terminate()
+
+        if addresses_imported and not options['rescan']:
+            self.stdout.write('Note! Addresses were added, but they were not scanned! Please restart bitcoin with -rescan option!')
+
+        self.reportPending()
+
+    def importPending(self, rpc, chunk_size):
+        """ Imports addresses that are waiting to be imported. Addresses
+        that node already knows are only marked imported.
+        """
+        importer = ImportPendingAddresses()
+        last_pk = 0
+        while True:
+            addresses = list(Address.objects.filter(pk__gt=last_pk, import_pending=True).select_related('wallet').order_by('pk')[:chunk_size])
+            if not addresses:
+                break
+            last_pk = addresses[-1].pk
+
+            known = []
+            missing = []
+            for address, is_known in zip(addresses, self.checkAddresses(rpc, [address.address for address in addresses])):
+                (known if is_known else missing).append(address)
+            Address.objects.filter(pk__in=[address.pk for address in known]).update(import_pending=False, import_retry_at=None, import_error='')
+
+            imported = importer.importAddresses(rpc, missing) if missing else 0
+            if imported is None:
+                raise CommandError('Unable to import addresses, because Bitcoin node could not be used!')
+            self.stdout.write('Marked {} known addresses imported, imported {} and failed {}.'.format(len(known), imported, len(missing) - imported))
+
+    def reportPending(self):
+        pending = Address.objects.filter(import_pending=True)
+        failing = pending.filter(import_attempts__gt=0)
+        self.stdout.write('{} addresses are waiting to be imported, {} of them have failed.'.format(pending.count(), failing.count()))
+        for address in failing.select_related('wallet').order_by('-import_attempts', 'pk')[:10]:
+            self.stdout.write('  {}: {} attempts, next at {}: {}'.format(address, address.import_attempts, address.import_retry_at, address.import_error))
+
+    def registerWallets(self, rpc, missing, birth_timestamp, rescan):
+        """ Registers ranged descriptors again for the wallets of missing addresses.
+        """
+        range_ends = {}
+        for _, _, subpath_number, wallet_path in missing:
+            key = tuple(wallet_path)
+            range_ends[key] = max(range_ends.get(key, 0), subpath_number + 1)
+
+        master_key = get_master_key()
+        requests = []
+        for wallet in Wallet.objects.filter(path__in=[list(wallet_path) for wallet_path in range_ends]):
+            requests.append({
+                'desc': get_wallet_descriptor(master_key, wallet.path),
+                'range': [0, max(wallet.watched_range_end, range_ends[tuple(wallet.path)]) - 1],
+                'timestamp': birth_timestamp,
+                'watchonly': True,
+            })
+        for request, result in zip(requests, rpc.importmulti(requests, {'rescan': rescan})):
+            if not result.get('success'):
+                raise CommandError('Unable to register descriptor {}: {}'.format(request['desc'], result.get('error')))
+        return len(missing)
+
+    def checkAddresses(self, rpc, addresses):
+        """ Returns list of booleans telling which addresses node is aware of.
+        In watch-only mode it is enough that node watches the address.
+        """
+        try:
+            infos = rpc.batch_([['getaddressinfo', address] for address in addresses])
+        except JSONRPCException as e:
+            # Older nodes do not have getaddressinfo
+            if e.code != -32601:
+                raise
+            infos = rpc.batch_([['validateaddress', address] for address in addresses])
+        if is_watchonly_mode():
+            return [bool(info.get('ismine') or info.get('iswatchonly')) for info in infos]
+        return [bool(info.get('ismine')) for info in infos]
+
+    def readCheckpoint(self, checkpoint):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as checkpoint_file:
+            return json.load(checkpoint_file)['last_address_id']
 
-        if private_keys_imported:
-            print 'Note! Private keys were added, but they were not scanned! Please restart bitcoin with -rescan option!'
+    def writeCheckpoint(self, checkpoint, last_pk):
+        if not checkpoint:
+            return
+        # Write atomically, so crash never leaves broken checkpoint behind
+        with open(checkpoint + '.tmp', 'w') as checkpoint_file:
+            json.dump({'last_address_id': last_pk}, checkpoint_file)
+        os.rename(checkpoint + '.tmp', checkpoint)
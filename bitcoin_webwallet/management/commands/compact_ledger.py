@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+import datetime
+import time
+
+from bitcoin_webwallet.compaction import compact_wallet
+from bitcoin_webwallet.models import Wallet
+from bitcoin_webwallet.utils import EXTRA_BLOCKS_TO_PROCESS
+
+
+class Command(BaseCommand):
+    help = 'Moves old and deeply confirmed transactions to archive and keeps their totals in wallet checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='Compact transactions older than this many days.')
+        parser.add_argument('--confirmations', type=int, default=1000, help='How many confirmations incoming transactions need to be compacted.')
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids', help='Only compact wallet with this ID. Can be given many times.')
+
+    def handle(self, *args, **options):
+        if options['confirmations'] <= EXTRA_BLOCKS_TO_PROCESS:
+            raise CommandError('More than {} confirmations are required!'.format(EXTRA_BLOCKS_TO_PROCESS))
+        before = now() - datetime.timedelta(days=options['days'])
+
+        wallets = Wallet.objects.order_by('pk')
+        if options['wallet_ids']:
+            wallets = wallets.filter(pk__in=options['wallet_ids'])
+
+        started_at = time.time()
+        total = 0
+        for wallet in wallets.iterator():
+            compacted = compact_wallet(wallet, before, options['confirmations'])
+            if compacted:
+                self.stdout.write('Compacted {} transactions of wallet {}'.format(compacted, wallet.pk))
+            total += compacted
+        self.stdout.write('Compacted {} transactions in {:.1f} seconds.'.format(total, time.time() - started_at))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+import sys
+
+from bitcoin_webwallet.export import EXPORTS, EXPORT_FORMATS, export
+from bitcoin_webwallet.keys import path_from_str
+
+
+class Command(BaseCommand):
+    help = 'Streams ledger data as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS.keys()))
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids', help='Only export rows of wallet with this ID. Can be given many times.')
+        parser.add_argument('--path', help='Only export rows of wallets in this BIP32 subtree, for example 5/17.')
+        parser.add_argument('--since', help='Only export rows created at or after this moment.')
+        parser.add_argument('--until', help='Only export rows created before this moment.')
+        parser.add_argument('--output', help='File to write to. Default is standard output.')
+
+    def handle(self, *args, **options):
+        filters = {
+            'wallet_ids': options['wallet_ids'],
+            'path': parse_path(options['path']),
+            'since': parse_moment(options['since']),
+            'until': parse_moment(options['until']),
+        }
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            for line in export(options['kind'], options['format'], **filters):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
+
+
+def parse_path(value):
+    if value is None:
+        return None
+    try:
+        return path_from_str(value)
+    except ValueError:
+        raise CommandError('Invalid BIP32 path: {}'.format(value))
+
+
+def parse_moment(value):
+    if value is None:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        # Well formed, but out of range, like 2020-13-40T00:00
+        moment = None
+    if not moment:
+        raise CommandError('Invalid date and time: {}'.format(value))
+    return moment
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+import time
+
+from bitcoin_webwallet.cron import process_outgoing_transactions_in_workers
+
+
+class Command(BaseCommand):
+    help = 'Selects inputs for outgoing transactions and sends them using many workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='How many workers process outgoing transactions at the same time.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('At least one worker is required!')
+        if options['workers'] > 1 and not connection.features.has_select_for_update_skip_locked:
+            raise CommandError('Many workers need database that supports SELECT ... FOR UPDATE SKIP LOCKED!')
+
+        started_at = time.time()
+        sent_count, inputs_selected_count = process_outgoing_transactions_in_workers(options['workers'])
+        self.stdout.write('Selected inputs for {} and sent {} outgoing transactions in {:.1f} seconds.'.format(
+            inputs_selected_count,
+            sent_count,
+            time.time() - started_at,
+        ))
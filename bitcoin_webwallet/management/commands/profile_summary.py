@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import json
+import pstats
+import re
+from io import BytesIO
+
+from bitcoin_webwallet.profiling import get_profiling_dir, list_dumps
+
+
+def normalize_sql(sql):
+    """ Replaces values in SQL, so same queries with
+    different parameters can be grouped together.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\((?:\?, )+\?\)', '(...)', sql)
+    return sql
+
+
+class Command(BaseCommand):
+    help = 'Summarizes hot spots from profiles of slow cron runs and wallet operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Directory of profiles. Default is PROFILING_DIR setting.')
+        parser.add_argument('--name', help='Only include profiles whose name contains this.')
+        parser.add_argument('--limit', type=int, default=20, help='How many hot spots are shown in every section.')
+        parser.add_argument('--sort', choices=['cumulative', 'tottime', 'ncalls'], default='cumulative', help='How Python functions are sorted.')
+
+    def handle(self, *args, **options):
+        profiling_dir = options['dir'] or get_profiling_dir()
+        if not profiling_dir:
+            raise CommandError('Give --dir or set PROFILING_DIR!')
+
+        dumps = []
+        for path in list_dumps(profiling_dir):
+            with open(path + '.json') as json_file:
+                info = json.load(json_file)
+            if options['name'] and options['name'] not in info['name']:
+                continue
+            info['path'] = path
+            dumps.append(info)
+        if not dumps:
+            self.stdout.write('No profiles found.')
+            return
+        limit = options['limit']
+
+        self.stdout.write('Slowest of {} profiles:'.format(len(dumps)))
+        for info in sorted(dumps, key=lambda info: -info['duration'])[:limit]:
+            self.stdout.write('  {:8.2f} s  {}  {}{}  {} queries {:.2f} s, {} RPC calls {:.2f} s'.format(
+                info['duration'],
+                info['started_at'],
+                info['name'],
+                ' (failed)' if info['failed'] else '',
+                info.get('queries_count', len(info['queries'])),
+                sum(query['time'] for query in info['queries']),
+                len(info['rpc_calls']),
+                sum(rpc_call['time'] for rpc_call in info['rpc_calls']),
+            ))
+
+        # Same queries and RPC methods from every profile are grouped together
+        queries = {}
+        rpc_calls = {}
+        for info in dumps:
+            for query in info['queries']:
+                total = queries.setdefault(normalize_sql(query['sql']), {'count': 0, 'time': 0.0})
+                total['count'] += 1
+                total['time'] += query['time']
+            for rpc_call in info['rpc_calls']:
+                total = rpc_calls.setdefault(rpc_call['method'], {'count': 0, 'time': 0.0, 'max': 0.0})
+                total['count'] += 1
+                total['time'] += rpc_call['time']
+                total['max'] = max(total['max'], rpc_call['time'])
+
+        self.stdout.write('')
+        self.stdout.write('Slowest queries in total:')
+        for sql, total in sorted(queries.items(), key=lambda item: -item[1]['time'])[:limit]:
+            self.stdout.write('  {:8.2f} s  {:6} times  {}'.format(total['time'], total['count'], sql[:300]))
+
+        self.stdout.write('')
+        self.stdout.write('Slowest RPC methods in total:')
+        for method, total in sorted(rpc_calls.items(), key=lambda item: -item[1]['time'])[:limit]:
+            self.stdout.write('  {:8.2f} s  {:6} times  max {:.2f} s  {}'.format(total['time'], total['count'], total['max'], method))
+
+        self.stdout.write('')
+        self.stdout.write('Python functions:')
+        output = BytesIO()
+        stats = pstats.Stats(*[info['path'] + '.prof' for info in dumps], stream=output)
+        stats.sort_stats(options['sort']).print_stats(limit)
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import multiprocessing
+
+from bitcoin_webwallet.keys import path_from_str
+from bitcoin_webwallet.provisioning import PROVISION_CHUNK_SIZE, provision_wallets
+
+
+class Command(BaseCommand):
+    help = 'Creates many wallets under a path at once, for example for a batch of new users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Parent path of the wallets, like "5/17". Wallets are created at parent/start ... parent/start+count-1.')
+        parser.add_argument('--start', type=int, default=0, help='Last part of path of first wallet.')
+        parser.add_argument('--count', type=int, default=100000, help='How many wallets are created.')
+        parser.add_argument('--chunk-size', type=int, default=PROVISION_CHUNK_SIZE, help='How many wallets are inserted and imported at once.')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Number of processes used for key derivation.')
+        parser.add_argument('--no-import', action='store_true', default=False, help='Do not import keys to node. ImportPendingAddresses imports them later.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['count'] < 1:
+            raise CommandError('Count and chunk size must be at least one!')
+        try:
+            parent_path = path_from_str(options['path'])
+        except ValueError:
+            raise CommandError('Invalid path "{}"!'.format(options['path']))
+        if options['start'] < 0 or any(i < 0 for i in parent_path):
+            raise CommandError('Path can not contain negative numbers!')
+        if (parent_path + [options['start']])[0] == 0:
+            raise CommandError('Wallet paths starting with zero are reserved for internal wallets!')
+
+        def progress(stats, elapsed):
+            self.stdout.write('{} created, {} skipped, {} imported, {:.1f} wallets per second'.format(
+                stats['created'],
+                stats['skipped'],
+                stats['imported'],
+                (stats['created'] + stats['skipped']) / max(elapsed, 0.001),
+            ))
+
+        stats = provision_wallets(
+            parent_path,
+            options['start'],
+            options['count'],
+            workers=max(1, options['workers']),
+            chunk_size=options['chunk_size'],
+            import_keys=not options['no_import'],
+            progress=progress,
+        )
+
+        not_imported = stats['created'] - stats['imported']
+        if not_imported:
+            self.stdout.write('{} wallets were not imported to node. Background jobs will import them.'.format(not_imported))
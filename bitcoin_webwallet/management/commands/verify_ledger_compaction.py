@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bitcoin_webwallet.compaction import verify_wallet
+from bitcoin_webwallet.models import Wallet
+
+
+class Command(BaseCommand):
+    help = 'Makes sure compacted wallets report exactly the same totals as they would without compaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids', help='Only verify wallet with this ID. Can be given many times.')
+        parser.add_argument('--all', action='store_true', default=False, help='Verify also wallets that have never been compacted.')
+
+    def handle(self, *args, **options):
+        wallets = Wallet.objects.order_by('pk')
+        if options['wallet_ids']:
+            wallets = wallets.filter(pk__in=options['wallet_ids'])
+        elif not options['all']:
+            wallets = wallets.filter(checkpoint__isnull=False)
+
+        confirmations_list = sorted(set([0, 1, settings.CONFIRMED_THRESHOLD, 1000000]))
+
+        wallets_verified = 0
+        wallets_failed = 0
+        for wallet in wallets.iterator():
+            problems = verify_wallet(wallet, confirmations_list)
+            for problem in problems:
+                self.stdout.write('Wallet {}: {}'.format(wallet.pk, problem))
+            wallets_verified += 1
+            if problems:
+                wallets_failed += 1
+
+        if wallets_failed:
+            raise CommandError('{} of {} wallets have problems!'.format(wallets_failed, wallets_verified))
+        self.stdout.write('All {} wallets are fine.'.format(wallets_verified))
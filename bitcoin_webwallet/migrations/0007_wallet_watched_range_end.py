@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0006_proper_unique_for_transactions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='watched_range_end',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
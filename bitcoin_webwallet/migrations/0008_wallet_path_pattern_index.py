@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# PostgreSQL can use normal index for prefix LIKE only when
+# database uses C locale, so separate pattern index is needed.
+
+def create_path_pattern_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE INDEX bitcoin_webwallet_wallet_path_like ON bitcoin_webwallet_wallet (path varchar_pattern_ops)')
+
+
+def drop_path_pattern_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS bitcoin_webwallet_wallet_path_like')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0007_wallet_watched_range_end'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_path_pattern_index, drop_path_pattern_index),
+    ]
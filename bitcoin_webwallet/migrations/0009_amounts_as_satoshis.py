@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, Func, Value
+import bitcoin_webwallet.fields
+
+
+AMOUNT_MODELS = ['Transaction', 'OutgoingTransactionInput', 'OutgoingTransactionOutput']
+
+
+def amounts_to_satoshis(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for model_name in AMOUNT_MODELS:
+        model = apps.get_model('bitcoin_webwallet', model_name)
+        satoshis = Func(F('amount') * Value(Decimal('100000000'), output_field=models.DecimalField()), function='ROUND')
+        model.objects.using(db_alias).update(amount_satoshis=ExpressionWrapper(satoshis, output_field=models.BigIntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0008_wallet_path_pattern_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='amount_satoshis',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='outgoingtransactioninput',
+            name='amount_satoshis',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='outgoingtransactionoutput',
+            name='amount_satoshis',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(max_digits=16, decimal_places=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='outgoingtransactioninput',
+            name='amount',
+            field=models.DecimalField(max_digits=16, decimal_places=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='outgoingtransactionoutput',
+            name='amount',
+            field=models.DecimalField(max_digits=16, decimal_places=8, null=True),
+        ),
+        # Not reversible, because BitcoinAmountField reads every amount as satoshis
+        migrations.RunPython(amounts_to_satoshis),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='outgoingtransactioninput',
+            name='amount',
+        ),
+        migrations.RemoveField(
+            model_name='outgoingtransactionoutput',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='transaction',
+            old_name='amount_satoshis',
+            new_name='amount',
+        ),
+        migrations.RenameField(
+            model_name='outgoingtransactioninput',
+            old_name='amount_satoshis',
+            new_name='amount',
+        ),
+        migrations.RenameField(
+            model_name='outgoingtransactionoutput',
+            old_name='amount_satoshis',
+            new_name='amount',
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=bitcoin_webwallet.fields.BitcoinAmountField(),
+        ),
+        migrations.AlterField(
+            model_name='outgoingtransactioninput',
+            name='amount',
+            field=bitcoin_webwallet.fields.BitcoinAmountField(),
+        ),
+        migrations.AlterField(
+            model_name='outgoingtransactionoutput',
+            name='amount',
+            field=bitcoin_webwallet.fields.BitcoinAmountField(),
+        ),
+    ]
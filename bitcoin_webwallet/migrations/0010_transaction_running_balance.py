@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import bitcoin_webwallet.fields
+
+
+def calculate_running_balances(apps, schema_editor):
+    Wallet = apps.get_model('bitcoin_webwallet', 'Wallet')
+    Transaction = apps.get_model('bitcoin_webwallet', 'Transaction')
+    db_alias = schema_editor.connection.alias
+    for wallet_id in Wallet.objects.using(db_alias).values_list('pk', flat=True).iterator():
+        sequence = 0
+        running_balance = Decimal(0)
+        for tx_id, amount in Transaction.objects.using(db_alias).filter(wallet_id=wallet_id).order_by('pk').values_list('pk', 'amount').iterator():
+            sequence += 1
+            running_balance += amount
+            Transaction.objects.using(db_alias).filter(pk=tx_id).update(sequence=sequence, running_balance=running_balance)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0009_amounts_as_satoshis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='running_balance',
+            field=bitcoin_webwallet.fields.BitcoinAmountField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='sequence',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.RunPython(calculate_running_balances, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together=set([('receiving_address', 'incoming_txid'), ('wallet', 'sequence')]),
+        ),
+    ]
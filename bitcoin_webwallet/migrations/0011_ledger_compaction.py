@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bitcoin_webwallet.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0010_transaction_running_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('amount', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('description', models.CharField(max_length=200)),
+                ('sending_addresses', jsonfield.fields.JSONField(blank=True, default=None, null=True)),
+                ('incoming_txid', models.CharField(blank=True, default=None, max_length=64, null=True)),
+                ('block_height', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('sequence', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('running_balance', bitcoin_webwallet.fields.BitcoinAmountField(blank=True, default=None, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('outgoing_tx', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_txs', to='bitcoin_webwallet.OutgoingTransaction')),
+                ('receiving_address', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_incoming_transactions', to='bitcoin_webwallet.Address')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_transactions', to='bitcoin_webwallet.Wallet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TransactionCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('compacted_until', models.DateTimeField()),
+                ('max_block_height', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('transactions_count', models.PositiveIntegerField(default=0)),
+                ('received', bitcoin_webwallet.fields.BitcoinAmountField(default=0)),
+                ('sent', bitcoin_webwallet.fields.BitcoinAmountField(default=0)),
+                ('balance', bitcoin_webwallet.fields.BitcoinAmountField(default=0)),
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoint', to='bitcoin_webwallet.Wallet')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0011_ledger_compaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('owner', models.CharField(blank=True, default=b'', max_length=200)),
+                ('token', models.BigIntegerField(default=0)),
+                ('expires_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, default=None, null=True)),
+            ],
+        ),
+    ]
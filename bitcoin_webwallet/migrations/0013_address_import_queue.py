@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0012_job_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='import_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='import_error',
+            field=models.CharField(blank=True, default=b'', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='import_pending',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='import_retry_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='rescan_from_height',
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
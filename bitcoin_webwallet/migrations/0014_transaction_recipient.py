@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bitcoin_webwallet.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0013_address_import_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionRecipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('amount', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('address', bitcoin_webwallet.fields.BitcoinAddressField(blank=True, default=None, null=True)),
+                ('tx', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='recipients', to='bitcoin_webwallet.Transaction')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='transactionrecipient',
+            index_together=set([('address', 'created_at')]),
+        ),
+    ]
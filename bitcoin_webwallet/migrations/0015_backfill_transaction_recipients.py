@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from decimal import Decimal
+
+from django.db import migrations, transaction
+
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_recipients(apps, schema_editor):
+    """ Creates recipients from sending_addresses of live and archived
+    transactions. Every chunk is committed separately, so huge ledgers
+    do not need one huge transaction. If migration is interrupted, it
+    can be run again, because transactions that already have
+    recipients are skipped.
+    """
+    TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+    db_alias = schema_editor.connection.alias
+    for model_name in ['Transaction', 'ArchivedTransaction']:
+        model = apps.get_model('bitcoin_webwallet', model_name)
+        txs = model.objects.using(db_alias).filter(sending_addresses__isnull=False).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(txs.filter(pk__gt=last_pk).values_list('pk', 'created_at', 'sending_addresses')[:BACKFILL_CHUNK_SIZE])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            with transaction.atomic(using=db_alias):
+                done_ids = set(TransactionRecipient.objects.using(db_alias).filter(tx_id__in=[tx_id for tx_id, _, _ in chunk]).values_list('tx_id', flat=True))
+                TransactionRecipient.objects.using(db_alias).bulk_create([
+                    TransactionRecipient(
+                        tx_id=tx_id,
+                        created_at=created_at,
+                        amount=Decimal(sending_address['amount']),
+                        address=sending_address.get('address'),
+                    )
+                    for tx_id, created_at, sending_addresses in chunk if tx_id not in done_ids
+                    for sending_address in sending_addresses or []
+                ])
+
+
+class Migration(migrations.Migration):
+
+    # Chunks are committed one by one
+    atomic = False
+
+    dependencies = [
+        ('bitcoin_webwallet', '0014_transaction_recipient'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_recipients, migrations.RunPython.noop),
+    ]
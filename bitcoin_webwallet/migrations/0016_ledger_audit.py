@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bitcoin_webwallet.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0015_backfill_transaction_recipients'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockAudit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_height', models.PositiveIntegerField(unique=True)),
+                ('transactions_count', models.PositiveIntegerField()),
+                ('received', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('total_transactions_count', models.PositiveIntegerField()),
+                ('total_received', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('checksum', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerAudit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('block_height', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('wallets_checked', models.PositiveIntegerField(default=0)),
+                ('blocks_checked', models.PositiveIntegerField(default=0)),
+                ('expected_holdings', bitcoin_webwallet.fields.BitcoinAmountField(blank=True, default=None, null=True)),
+                ('node_holdings', bitcoin_webwallet.fields.BitcoinAmountField(blank=True, default=None, null=True)),
+                ('problems', jsonfield.fields.JSONField(default=list)),
+                ('notes', jsonfield.fields.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletAudit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(default=0)),
+                ('balance', bitcoin_webwallet.fields.BitcoinAmountField(default=0)),
+                ('checksum', models.CharField(blank=True, default=b'', max_length=64)),
+                ('problem', models.CharField(blank=True, default=b'', max_length=200)),
+                ('audited_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='audit', to='bitcoin_webwallet.Wallet')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='block_height',
+            field=models.PositiveIntegerField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
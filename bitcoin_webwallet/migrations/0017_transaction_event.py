@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import bitcoin_webwallet.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0016_ledger_audit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tx_id', models.IntegerField()),
+                ('kind', models.CharField(choices=[(b'created', b'Created'), (b'confirmed', b'Confirmed'), (b'deleted', b'Deleted')], max_length=10)),
+                ('amount', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('block_height', models.PositiveIntegerField(blank=True, default=None, null=True)),
+                ('balance', bitcoin_webwallet.fields.BitcoinAmountField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_events', to='bitcoin_webwallet.Wallet')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='transactionevent',
+            index_together=set([('wallet', 'id')]),
+        ),
+    ]
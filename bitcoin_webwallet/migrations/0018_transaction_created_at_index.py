@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0017_transaction_event'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='archivedtransaction',
+            index_together=set([('wallet', 'created_at')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='transaction',
+            index_together=set([('wallet', 'created_at')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0018_transaction_created_at_index'),
+    ]
+
+    operations = [
+        # Foreign key without constraint becomes plain integer.
+        # Column and its index are already there.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='transactionrecipient',
+                    name='tx',
+                ),
+                migrations.AddField(
+                    model_name='transactionrecipient',
+                    name='tx_id',
+                    field=models.IntegerField(db_index=True),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transactionrecipient',
+            name='wallet',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transaction_recipients', to='bitcoin_webwallet.Wallet'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_wallets(apps, schema_editor):
+    """ Copies wallet of live or archived transaction to its recipients.
+    Every chunk is committed separately. If migration is interrupted,
+    it can be run again, because only recipients without wallet are
+    processed.
+    """
+    TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+    Transaction = apps.get_model('bitcoin_webwallet', 'Transaction')
+    ArchivedTransaction = apps.get_model('bitcoin_webwallet', 'ArchivedTransaction')
+    db_alias = schema_editor.connection.alias
+    recipients = TransactionRecipient.objects.using(db_alias).filter(wallet__isnull=True).order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(recipients.filter(pk__gt=last_pk).values_list('pk', 'tx_id')[:BACKFILL_CHUNK_SIZE])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        tx_ids = set(tx_id for _, tx_id in chunk)
+        wallet_ids = {}
+        for model in [Transaction, ArchivedTransaction]:
+            wallet_ids.update(model.objects.using(db_alias).filter(pk__in=tx_ids).values_list('pk', 'wallet_id'))
+        with transaction.atomic(using=db_alias):
+            for wallet_id in set(wallet_ids.values()):
+                TransactionRecipient.objects.using(db_alias).filter(
+                    pk__in=[pk for pk, _ in chunk],
+                    tx_id__in=[tx_id for tx_id, tx_wallet_id in wallet_ids.items() if tx_wallet_id == wallet_id],
+                ).update(wallet_id=wallet_id)
+            # Transaction of recipient has been deleted, so there is nothing to refer to
+            TransactionRecipient.objects.using(db_alias).filter(pk__in=[pk for pk, tx_id in chunk if tx_id not in wallet_ids]).delete()
+
+
+class Migration(migrations.Migration):
+
+    # Chunks are committed one by one
+    atomic = False
+
+    dependencies = [
+        ('bitcoin_webwallet', '0019_transaction_recipient_wallet'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_wallets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0020_backfill_transaction_recipient_wallets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactionrecipient',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_recipients', to='bitcoin_webwallet.Wallet'),
+        ),
+    ]
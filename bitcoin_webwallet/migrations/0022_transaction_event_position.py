@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_positions(apps, schema_editor):
+    """ Existing events are already committed, so their IDs are
+    valid positions, and cursors given so far stay valid.
+    """
+    TransactionEvent = apps.get_model('bitcoin_webwallet', 'TransactionEvent')
+    TransactionEvent.objects.using(schema_editor.connection.alias).update(position=models.F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0021_transaction_recipient_wallet_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionevent',
+            name='position',
+            field=models.BigIntegerField(blank=True, default=None, null=True, unique=True),
+        ),
+        migrations.RunPython(set_positions, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='transactionevent',
+            index_together=set([('wallet', 'position')]),
+        ),
+    ]
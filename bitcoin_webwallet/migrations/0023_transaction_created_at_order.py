@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bitcoin_webwallet', '0022_transaction_event_position'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedtransaction',
+            index_together=set([('wallet', 'created_at', 'sequence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='transaction',
+            index_together=set([('wallet', 'created_at', 'sequence')]),
+        ),
+    ]
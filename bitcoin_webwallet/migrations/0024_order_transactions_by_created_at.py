@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+
+
+def clamp_created_at(apps, schema_editor):
+    """ Moves creation time of transactions that were added late, like
+    deposits received before the latest transaction, to the creation time
+    of the transaction before them. After this transactions are in the
+    same order by creation time as by sequence, like new transactions are.
+    Sequences and running balances stay as they are. Every wallet is
+    committed separately and wallets that are already in order are not
+    changed, so the migration can be run again if it is interrupted.
+    """
+    Wallet = apps.get_model('bitcoin_webwallet', 'Wallet')
+    Transaction = apps.get_model('bitcoin_webwallet', 'Transaction')
+    ArchivedTransaction = apps.get_model('bitcoin_webwallet', 'ArchivedTransaction')
+    db_alias = schema_editor.connection.alias
+    for wallet_id in Wallet.objects.using(db_alias).order_by('pk').values_list('pk', flat=True).iterator():
+        with transaction.atomic(using=db_alias):
+            txs = []
+            for model in [Transaction, ArchivedTransaction]:
+                for pk, sequence, created_at in model.objects.using(db_alias).filter(wallet_id=wallet_id, sequence__isnull=False).values_list('pk', 'sequence', 'created_at'):
+                    txs.append((sequence, created_at, model, pk))
+            txs.sort(key=lambda tx: tx[0])
+            latest_created_at = None
+            for sequence, created_at, model, pk in txs:
+                if latest_created_at and created_at < latest_created_at:
+                    model.objects.using(db_alias).filter(pk=pk).update(created_at=latest_created_at)
+                else:
+                    latest_created_at = created_at
+
+
+class Migration(migrations.Migration):
+
+    # Wallets are committed one by one
+    atomic = False
+
+    dependencies = [
+        ('bitcoin_webwallet', '0023_transaction_created_at_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(clamp_created_at, migrations.RunPython.noop),
+    ]
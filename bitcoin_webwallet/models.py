@@ -1,16 +1,128 @@
-from django.conf import settings
-from django.db import models, transaction
-from django.db.models import Sum
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 
 from decimal import Decimal
+import heapq
 
-from pycoin.key import Key
+from jsonfield import JSONField
 
-from bitcoinrpc.authproxy import AuthServiceProxy
+from fields import BIP32PathField, BitcoinAddressField, BitcoinAmountField
+from keys import derive_address_and_private_key, get_master_key, get_watchonly_range_chunk, get_wallet_descriptor, is_watchonly_mode
+from profiling import profiled
+from rpc import get_rpc
 
-from jsonfield import JSONField
 
-from fields import BIP32PathField, BitcoinAddressField
+# Wallets are locked this many at a time, to stay below query parameter limits
+LOCK_CHUNK_SIZE = 500
+
+
+def _get_current_block_height():
+    current_block_height = CurrentBlockHeight.objects.order_by('-block_height').first()
+    return current_block_height.block_height if current_block_height else 0
+
+
+def _get_max_block_height(confirmations):
+    """ Returns the highest block height that has enough confirmations,
+    or None if confirmations do not matter.
+    """
+    if confirmations <= 0:
+        return None
+    return max(0, _get_current_block_height() - confirmations + 1)
+
+
+def _exclude_unconfirmed(txs, max_block_height):
+    """ Leaves out incoming transactions that do not have enough confirmations.
+    """
+    if max_block_height is None:
+        return txs
+    return txs.exclude(block_height__isnull=True, incoming_txid__isnull=False).exclude(block_height__gt=max_block_height)
+
+
+def _sum_amount(txs):
+    return txs.aggregate(Sum('amount')).get('amount__sum') or Decimal(0)
+
+
+def _get_latest_transaction(wallet_id):
+    """ Returns sequence, running balance and creation time of the latest
+    transaction of wallet, or zeros and None if there are none.
+    Compaction can archive transactions that are newer than the live
+    ones, or all of them, so both live and compacted transactions are
+    looked at.
+    """
+    latest = (0, Decimal(0), None)
+    for model in [Transaction, ArchivedTransaction]:
+        values = model.objects.filter(wallet_id=wallet_id, sequence__isnull=False).order_by('-sequence').values_list('sequence', 'running_balance', 'created_at').first()
+        if values and values[0] > latest[0]:
+            latest = values
+    return latest
+
+
+def _get_latest_running_balance(wallet_id):
+    """ Returns balance of wallet after its latest transaction,
+    without caring about confirmations.
+    """
+    return _get_latest_transaction(wallet_id)[1]
+
+
+def _compacted_total(wallet_ids, total, max_block_height):
+    """ Returns total of compacted transactions of wallets. Total can be
+    'balance', 'received' or 'sent'. Checkpoints are used when all their
+    transactions are confirmed enough, otherwise the archive is summed.
+    """
+    checkpoints = TransactionCheckpoint.objects.filter(wallet__in=wallet_ids)
+    if max_block_height is None or not checkpoints.filter(max_block_height__gt=max_block_height).exists():
+        return checkpoints.aggregate(result=Sum(total))['result'] or Decimal(0)
+    archived_txs = _exclude_unconfirmed(ArchivedTransaction.objects.filter(wallet__in=wallet_ids), max_block_height)
+    if total == 'received':
+        return _sum_amount(archived_txs.filter(amount__gt=0))
+    if total == 'sent':
+        return -_sum_amount(archived_txs.filter(amount__lt=0))
+    return _sum_amount(archived_txs)
+
+
+class WalletQuerySet(models.QuerySet):
+
+    def subtree(self, path):
+        """ Returns wallet of given path and all wallets below it.
+        """
+        return self.filter(path__subtree=path)
+
+    def lockInOrder(self, wallet_ids):
+        """ Locks wallets of given IDs in order of primary key. Database
+        transactions that change many wallets must lock them all with this
+        first, so that two of them can never wait for each other.
+        """
+        wallet_ids = sorted(set(wallet_ids))
+        for i in range(0, len(wallet_ids), LOCK_CHUNK_SIZE):
+            list(self.select_for_update().filter(pk__in=wallet_ids[i:i + LOCK_CHUNK_SIZE]).order_by('pk').values_list('pk', flat=True))
+
+    def getBalance(self, confirmations):
+        """ Returns total balance of all wallets in queryset.
+        """
+        max_block_height = _get_max_block_height(confirmations)
+        wallet_ids = self.values('pk')
+        txs = _exclude_unconfirmed(Transaction.objects.filter(wallet__in=wallet_ids), max_block_height)
+        return _sum_amount(txs) + _compacted_total(wallet_ids, 'balance', max_block_height)
+
+    def withBalances(self):
+        """ Annotates total_received, total_sent and total_balance to
+        each wallet. These do not care about confirmations.
+        """
+        amount_field = BitcoinAmountField()
+        return self.annotate(
+            total_received=(
+                Coalesce(Sum(Case(When(transactions__amount__gt=0, then='transactions__amount'), default=Value(0), output_field=amount_field)), Value(0), output_field=amount_field) +
+                Coalesce('checkpoint__received', Value(0), output_field=amount_field)
+            ),
+            total_balance=(
+                Coalesce(Sum('transactions__amount'), Value(0), output_field=amount_field) +
+                Coalesce('checkpoint__balance', Value(0), output_field=amount_field)
+            ),
+        ).annotate(
+            total_sent=F('total_received') - F('total_balance'),
+        )
 
 
 class Wallet(models.Model):
@@ -25,71 +137,135 @@ class Wallet(models.Model):
     # never create wallets where this is set to True.
     internal_wallet = models.BooleanField(default=False)
 
-    def getBalance(self, confirmations):
-        current_block_height_queryset = CurrentBlockHeight.objects.order_by('-block_height')
-        current_block_height = current_block_height_queryset[0].block_height if current_block_height_queryset.count() else 0
-        max_block_height = max(0, current_block_height - confirmations + 1)
+    # In watch-only mode, this tells how many addresses of
+    # the wallet have been registered to the Bitcoin node.
+    watched_range_end = models.PositiveIntegerField(default=0)
 
-        if confirmations > 0:
-            txs = self.transactions.exclude(block_height__isnull=True, incoming_txid__isnull=False).exclude(block_height__gt=max_block_height)
-        else:
-            txs = self.transactions.all()
-        return txs.aggregate(Sum('amount')).get('amount__sum') or Decimal(0)
+    objects = WalletQuerySet.as_manager()
+
+    def getBalance(self, confirmations):
+        max_block_height = _get_max_block_height(confirmations)
+        txs = _exclude_unconfirmed(self.transactions.all(), max_block_height)
+        return _sum_amount(txs) + _compacted_total([self.pk], 'balance', max_block_height)
 
     def getReceived(self, confirmations):
-        current_block_height_queryset = CurrentBlockHeight.objects.order_by('-block_height')
-        current_block_height = current_block_height_queryset[0].block_height if current_block_height_queryset.count() else 0
-        max_block_height = max(0, current_block_height - confirmations + 1)
+        max_block_height = _get_max_block_height(confirmations)
 
         if confirmations > 0:
-            txs = self.transactions.filter(amount__gt=0).exclude(block_height__isnull=True, incoming_txid__isnull=False).exclude(block_height__gt=max_block_height)
-        else:
-            txs = self.transactions.all()
-        return txs.aggregate(Sum('amount')).get('amount__sum') or Decimal(0)
+            txs = _exclude_unconfirmed(self.transactions.filter(amount__gt=0), max_block_height)
+            return _sum_amount(txs) + _compacted_total([self.pk], 'received', max_block_height)
+        return _sum_amount(self.transactions.all()) + _compacted_total([self.pk], 'balance', None)
 
     def getSent(self):
         txs = self.transactions.filter(amount__lt=0)
-        return -(txs.aggregate(Sum('amount')).get('amount__sum') or Decimal(0))
-
+        return -_sum_amount(txs) + _compacted_total([self.pk], 'sent', None)
+
+    def getBalanceAt(self, moment):
+        """ Returns balance after the transactions that were created at or
+        before given moment, compacted ones included. Confirmations are
+        ignored. Transactions are in order of creation time, so this is
+        the running balance of the latest of them, which is found with
+        the index of wallet, creation time and sequence.
+        """
+        latest = (0, Decimal(0))
+        for txs in [self.transactions.all(), self.archived_transactions.all()]:
+            values = txs.filter(created_at__lte=moment, sequence__isnull=False).order_by('-created_at', '-sequence').values_list('sequence', 'running_balance').first()
+            if values and values[0] > latest[0]:
+                latest = values
+        return latest[1]
+
+    def getStatement(self, since=None, until=None):
+        """ Yields transactions in order of creation time, compacted ones
+        included. Each has balance, which is balance of wallet after it.
+        """
+        filters = {}
+        if since:
+            filters['created_at__gte'] = since
+        if until:
+            filters['created_at__lte'] = until
+        statements = [
+            (((tx.created_at, tx.sequence), tx) for tx in txs.filter(**filters).order_by('created_at', 'sequence').iterator())
+            for txs in [self.transactions.all(), self.archived_transactions.all()]
+        ]
+        for _, tx in heapq.merge(*statements):
+            tx.balance = tx.running_balance
+            yield tx
+
+    @profiled('Wallet.getOrCreateAddress')
     def getOrCreateAddress(self, subpath_number):
         try:
             return Address.objects.get(wallet=self, subpath_number=subpath_number)
         except Address.DoesNotExist:
             pass
 
-        new_address_full_path = self.path + [subpath_number]
-        new_address_full_path_str = '/'.join([str(i) for i in new_address_full_path])
-
-        # Create raw bitcoin address and key
-        key = Key.from_text(settings.MASTERWALLET_BIP32_KEY)
-        subkey = key.subkeys(new_address_full_path_str).next()
+        # Create raw bitcoin address
+        btc_address = derive_address_and_private_key(get_master_key(), self.path + [subpath_number])[0]
 
-        btc_address = subkey.address(use_uncompressed=False)
-        btc_private_key = subkey.wif(use_uncompressed=False)
-
-        # Make sure private key is stored to the database of bitcoind
-        rpc = AuthServiceProxy('http://' + settings.BITCOIN_RPC_USERNAME + ':' + settings.BITCOIN_RPC_PASSWORD + '@' + settings.BITCOIN_RPC_IP + ':' + str(settings.BITCOIN_RPC_PORT))
-        try:
-            rpc.importprivkey(btc_private_key, '', False)
-        except:
-            raise Exception('Unable to store Bitcoin address to Bitcoin node!')
-
-        # Create new Address and return it
-        new_address = Address(wallet=self, subpath_number=subpath_number, address=btc_address)
-        new_address.save()
+        with transaction.atomic():
+            # Lock the wallet, so concurrent callers, like workers that
+            # need change address, do not create the same address twice.
+            # Those that waited for the lock return the created address.
+            Wallet.objects.select_for_update().get(pk=self.pk)
+            try:
+                return Address.objects.get(wallet=self, subpath_number=subpath_number)
+            except Address.DoesNotExist:
+                pass
+
+            if is_watchonly_mode():
+                # Address is already known by the Bitcoin node, unless
+                # the registered range of the wallet has run out.
+                if subpath_number >= self.watched_range_end:
+                    rpc = get_rpc()
+                    try:
+                        self.extendWatchedRange(rpc, subpath_number + get_watchonly_range_chunk())
+                    except:
+                        raise Exception('Unable to store Bitcoin address to Bitcoin node!')
+                new_address = Address(wallet=self, subpath_number=subpath_number, address=btc_address)
+            else:
+                # Private key is imported to Bitcoin node later by ImportPendingAddresses,
+                # so slow or unreachable node does not prevent creating addresses. Blocks
+                # since current height are processed again after the import.
+                new_address = Address(
+                    wallet=self,
+                    subpath_number=subpath_number,
+                    address=btc_address,
+                    import_pending=True,
+                    rescan_from_height=_get_current_block_height(),
+                )
+
+            # Create new Address and return it
+            new_address.save()
 
         return new_address
 
+    def extendWatchedRange(self, rpc, range_end):
+        """ Registers addresses of this wallet up to range_end
+        to Bitcoin node as watch-only ranged descriptor.
+        """
+        if range_end <= self.watched_range_end:
+            return
+        result = rpc.importmulti([{
+            'desc': get_wallet_descriptor(get_master_key(), self.path),
+            'range': [self.watched_range_end, range_end - 1],
+            'timestamp': 'now',
+            'watchonly': True,
+        }], {'rescan': False})[0]
+        if not result.get('success'):
+            raise Exception('Unable to register wallet to Bitcoin node: {}'.format(result.get('error')))
+        Wallet.objects.filter(pk=self.pk, watched_range_end__lt=range_end).update(watched_range_end=range_end)
+        self.watched_range_end = range_end
+
     def getUnusedAddress(self):
         latest_address = self.addresses.order_by('-subpath_number').first()
         if not latest_address:
             return self.getOrCreateAddress(0)
         # If there are on-chain incoming transactions, then return fresh address
-        if latest_address.incoming_transactions.filter(incoming_txid__isnull=False).exists():
+        if latest_address.incoming_transactions.filter(incoming_txid__isnull=False).exists() or latest_address.archived_incoming_transactions.filter(incoming_txid__isnull=False).exists():
             return self.getOrCreateAddress(latest_address.subpath_number + 1)
         # No on-chain incoming transaction
         return latest_address
 
+    @profiled('Wallet.sendTo')
     def sendTo(self, targets_and_amounts, required_confirmations, sender_transaction_description=None):
         # First make sure all amounts are valid. Also sum up the total amount
         total_amount = Decimal(0)
@@ -106,6 +282,20 @@ class Wallet(models.Model):
         # Start the sending process. This is done atomically,
         # to prevent problems with concurrency
         with transaction.atomic():
+            # Find out which target addresses belong to some of the internal wallets
+            target_addresses = [target_and_amount[0] for target_and_amount in targets_and_amounts if isinstance(target_and_amount[0], basestring)]
+            internal_addresses = {}
+            for i in range(0, len(target_addresses), LOCK_CHUNK_SIZE):
+                for address in Address.objects.filter(address__in=target_addresses[i:i + LOCK_CHUNK_SIZE]).select_related('wallet'):
+                    internal_addresses[address.address] = address
+
+            # Lock the wallet, so concurrent sendings can not both spend the same
+            # balance. Receiving wallets are locked too, all in order of primary
+            # key, so that two wallets sending to each other can not deadlock.
+            receiving_wallet_ids = [target_and_amount[0].pk for target_and_amount in targets_and_amounts if isinstance(target_and_amount[0], Wallet)]
+            receiving_wallet_ids += [address.wallet_id for address in internal_addresses.values()]
+            Wallet.objects.lockInOrder([self.pk] + receiving_wallet_ids)
+
             # Make sure this transaction does not make the balance go negative.
             if self.getBalance(required_confirmations) < total_amount:
                 raise Wallet.NotEnoughBalance('Not enough balance!')
@@ -142,12 +332,10 @@ class Wallet(models.Model):
                     })
 
                     # Check if this address belongs to some of the internal wallets
-                    try:
-                        target_internal_address = Address.objects.get(address=target_address)
+                    if target_address in internal_addresses:
+                        target_internal_address = internal_addresses[target_address]
                         target_wallet = target_internal_address.wallet
                         target_address = None
-                    except Address.DoesNotExist:
-                        pass
                 else:
                     raise Exception('Invalid target!')
 
@@ -166,7 +354,9 @@ class Wallet(models.Model):
                     # If there is no outgoing transaction, then try
                     # to use some pending outgoing transaction
                     if not outgoing_tx:
-                        outgoing_tx = OutgoingTransaction.objects.filter(inputs_selected_at__isnull=True, sent_at__isnull=True).first()
+                        # Outgoing transactions that are being processed by workers are skipped
+                        pending_otxs = OutgoingTransaction.objects.filter(inputs_selected_at__isnull=True, sent_at__isnull=True)
+                        outgoing_tx = pending_otxs.selectForUpdateSkipLocked().order_by('id').first()
                         # If there was no existing outgoing
                         # transaction, then create a new one.
                         if not outgoing_tx:
@@ -180,6 +370,7 @@ class Wallet(models.Model):
             if tx_sending_addresses:
                 tx.sending_addresses = tx_sending_addresses
                 tx.save(update_fields=['sending_addresses'])
+                TransactionRecipient.objects.bulk_create(TransactionRecipient.fromSendingAddresses(tx.pk, self.pk, tx.created_at, tx_sending_addresses))
 
     def save(self, *args, **kwargs):
         if self.path[0] == 0 and not self.internal_wallet:
@@ -187,7 +378,9 @@ class Wallet(models.Model):
         super(Wallet, self).save(*args, **kwargs)
 
     def __unicode__(self):
-        return '/'.join([str(i) for i in self.path]) + ' balance: ' + ('%.8f' % self.getBalance(0)) + ' BTC'
+        # Use annotated balance, if wallet was fetched using withBalances()
+        balance = self.total_balance if hasattr(self, 'total_balance') else self.getBalance(0)
+        return '/'.join([str(i) for i in self.path]) + ' balance: ' + ('%.8f' % balance) + ' BTC'
 
 
 class Address(models.Model):
@@ -197,6 +390,17 @@ class Address(models.Model):
 
     address = BitcoinAddressField()
 
+    # Private key of address is imported to Bitcoin node in background.
+    # Failed imports are retried later with increasing delay.
+    import_pending = models.BooleanField(default=False, db_index=True)
+    import_attempts = models.PositiveIntegerField(default=0)
+    import_retry_at = models.DateTimeField(null=True, blank=True, default=None)
+    import_error = models.CharField(max_length=200, blank=True, default='')
+
+    # Block height when address was created. Once the key is imported,
+    # incoming transactions since this height are processed again.
+    rescan_from_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+
     def __unicode__(self):
         full_path = self.wallet.path + [self.subpath_number]
         return '/'.join([str(i) for i in full_path]) + ' ' + str(self.address)
@@ -208,9 +412,10 @@ class Address(models.Model):
 class Transaction(models.Model):
     wallet = models.ForeignKey(Wallet, related_name='transactions')
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Transactions of wallet are in the same order by creation time as by sequence
+    created_at = models.DateTimeField(default=now)
 
-    amount = models.DecimalField(max_digits=16, decimal_places=8)
+    amount = BitcoinAmountField()
 
     description = models.CharField(max_length=200)
 
@@ -219,11 +424,74 @@ class Transaction(models.Model):
 
     # Incoming details from real Bitcoin network
     incoming_txid = models.CharField(max_length=64, null=True, blank=True, default=None)
-    block_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+    block_height = models.PositiveIntegerField(null=True, blank=True, default=None, db_index=True)
 
     # Outgoing details from real Bitcoin network
     outgoing_tx = models.ForeignKey('OutgoingTransaction', related_name='txs', null=True, blank=True, default=None)
 
+    # Order of transaction in its wallet, and balance of
+    # wallet after it. These are set when transaction is
+    # created, and fixed when transactions are deleted.
+    sequence = models.PositiveIntegerField(null=True, blank=True, default=None)
+    running_balance = BitcoinAmountField(null=True, blank=True, default=None)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super(Transaction, self).save(*args, **kwargs)
+        with transaction.atomic():
+            # Lock the wallet, so no other transaction gets the same sequence
+            Wallet.objects.select_for_update().get(pk=self.wallet_id)
+            latest_sequence, latest_balance, latest_created_at = _get_latest_transaction(self.wallet_id)
+            # Transaction that is added late, like a deposit that the node
+            # received before the latest transaction, is created at the same
+            # time as the latest one. This way historical balances are the
+            # running balances of transactions created before given moment.
+            if latest_created_at and self.created_at < latest_created_at:
+                self.created_at = latest_created_at
+            self.sequence = latest_sequence + 1
+            self.running_balance = latest_balance + self._meta.get_field('amount').to_python(self.amount)
+            result = super(Transaction, self).save(*args, **kwargs)
+            self._addEvent(TransactionEvent.CREATED, self.running_balance)
+            return result
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Wallet.objects.select_for_update().get(pk=self.wallet_id)
+            TransactionRecipient.objects.filter(tx_id=self.pk).delete()
+            tx_id = self.pk
+            result = super(Transaction, self).delete(*args, **kwargs)
+            # Fix running balances of all later transactions
+            if self.sequence is not None:
+                amount = Value(self._meta.get_field('amount').to_python(self.amount), output_field=BitcoinAmountField())
+                # Later transactions may have been compacted already
+                for model in [Transaction, ArchivedTransaction]:
+                    later_txs = model.objects.filter(wallet_id=self.wallet_id, sequence__gt=self.sequence)
+                    later_txs.update(running_balance=F('running_balance') - amount)
+            self._addEvent(TransactionEvent.DELETED, _get_latest_running_balance(self.wallet_id), tx_id=tx_id)
+            return result
+
+    def setBlockHeight(self, block_height):
+        """ Marks incoming transaction confirmed in block.
+        """
+        with transaction.atomic():
+            Wallet.objects.select_for_update().get(pk=self.wallet_id)
+            self.block_height = block_height
+            self.save(update_fields=['block_height'])
+            self._addEvent(TransactionEvent.CONFIRMED, _get_latest_running_balance(self.wallet_id))
+
+    def _addEvent(self, kind, balance, tx_id=None):
+        # Wallet is locked by caller, so events of wallet are created in order
+        TransactionEvent.objects.create(
+            wallet_id=self.wallet_id,
+            tx_id=tx_id or self.pk,
+            kind=kind,
+            amount=self.amount,
+            block_height=self.block_height,
+            balance=balance,
+        )
+        # Event gets its position once it is visible to readers of the feed
+        transaction.on_commit(_sequence_transaction_events)
+
     def getConfirmations(self):
         if not self.block_height:
             return 0
@@ -242,7 +510,219 @@ class Transaction(models.Model):
         return result
 
     class Meta:
-        unique_together = ('receiving_address', 'incoming_txid')
+        unique_together = [
+            ('receiving_address', 'incoming_txid'),
+            ('wallet', 'sequence'),
+        ]
+        index_together = [('wallet', 'created_at', 'sequence')]
+
+
+def _sequence_transaction_events():
+    """ Gives positions to committed events. Transaction is already
+    committed, so failing here would only hide that. Events that do
+    not get a position here get it from SequenceTransactionEvents.
+    """
+    from feed import sequence_transaction_events
+    try:
+        sequence_transaction_events()
+    except DatabaseError:
+        pass
+
+
+class TransactionEvent(models.Model):
+    """ Change to transaction of wallet, for the change feed. Event is
+    created in the same database transaction as the change, while the
+    wallet is locked, so events of every wallet are in order of ID.
+    Position is given after the event has been committed, so events
+    are in order of position in the same order they became visible.
+    """
+    CREATED = 'created'
+    CONFIRMED = 'confirmed'
+    DELETED = 'deleted'
+    KIND_CHOICES = (
+        (CREATED, 'Created'),
+        (CONFIRMED, 'Confirmed'),
+        (DELETED, 'Deleted'),
+    )
+
+    wallet = models.ForeignKey(Wallet, related_name='transaction_events')
+
+    # Not a foreign key, because deleted transactions have events too
+    tx_id = models.IntegerField()
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+
+    amount = BitcoinAmountField()
+    block_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+
+    # Balance of wallet after the change, without caring about confirmations
+    balance = BitcoinAmountField()
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    # Given by sequence_transaction_events() after commit. Cursor of the feed is a position.
+    position = models.BigIntegerField(unique=True, null=True, blank=True, default=None)
+
+    def __unicode__(self):
+        return u'Transaction {} of wallet {} {}'.format(self.tx_id, self.wallet_id, self.kind)
+
+    class Meta:
+        index_together = [('wallet', 'position')]
+
+
+class TransactionRecipientQuerySet(models.QuerySet):
+
+    def toAddress(self, address, since=None, until=None):
+        """ Payments sent to address, optionally only those created
+        between since and until. Uses index of address and time.
+        """
+        recipients = self.filter(address=address)
+        if since:
+            recipients = recipients.filter(created_at__gte=since)
+        if until:
+            recipients = recipients.filter(created_at__lt=until)
+        return recipients
+
+    def getTotal(self):
+        return _sum_amount(self)
+
+
+class TransactionRecipient(models.Model):
+    """ One target of sent Transaction. Same information as in
+    sending_addresses of Transaction, but it can be queried. Address
+    is empty when target was a wallet. Rows are kept when transactions
+    are compacted, so tx_id refers to either Transaction or
+    ArchivedTransaction. Use getTransaction() to get it.
+    """
+    tx_id = models.IntegerField(db_index=True)
+
+    # Sending wallet and creation time are copied from transaction,
+    # so they are available even when transaction has been compacted.
+    wallet = models.ForeignKey(Wallet, related_name='transaction_recipients')
+    created_at = models.DateTimeField()
+
+    amount = BitcoinAmountField()
+
+    address = BitcoinAddressField(null=True, blank=True, default=None)
+
+    objects = TransactionRecipientQuerySet.as_manager()
+
+    @staticmethod
+    def fromSendingAddresses(tx_id, wallet_id, created_at, sending_addresses):
+        """ Converts sending_addresses of a transaction to recipients.
+        """
+        return [
+            TransactionRecipient(
+                tx_id=tx_id,
+                wallet_id=wallet_id,
+                created_at=created_at,
+                amount=Decimal(sending_address['amount']),
+                address=sending_address.get('address'),
+            )
+            for sending_address in sending_addresses
+        ]
+
+    def getTransaction(self):
+        """ Returns the sent Transaction, or ArchivedTransaction
+        if the transaction has been compacted.
+        """
+        tx = Transaction.objects.filter(pk=self.tx_id).first()
+        return tx or ArchivedTransaction.objects.get(pk=self.tx_id)
+
+    def __unicode__(self):
+        return u'{} BTC to {}'.format(self.amount, self.address or 'wallet')
+
+    class Meta:
+        index_together = [('address', 'created_at')]
+
+
+class ArchivedTransaction(models.Model):
+    """ Transaction that has been compacted. Primary key is
+    the same that the original Transaction had.
+    """
+    id = models.IntegerField(primary_key=True)
+
+    wallet = models.ForeignKey(Wallet, related_name='archived_transactions')
+
+    created_at = models.DateTimeField()
+
+    amount = BitcoinAmountField()
+
+    description = models.CharField(max_length=200)
+
+    receiving_address = models.ForeignKey(Address, related_name='archived_incoming_transactions', null=True, blank=True, default=None)
+    sending_addresses = JSONField(null=True, blank=True, default=None)
+
+    incoming_txid = models.CharField(max_length=64, null=True, blank=True, default=None)
+    block_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+
+    outgoing_tx = models.ForeignKey('OutgoingTransaction', related_name='archived_txs', null=True, blank=True, default=None)
+
+    sequence = models.PositiveIntegerField(null=True, blank=True, default=None)
+    running_balance = BitcoinAmountField(null=True, blank=True, default=None)
+
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return Transaction.__unicode__.__func__(self)
+
+    class Meta:
+        index_together = [('wallet', 'created_at', 'sequence')]
+
+
+class TransactionCheckpoint(models.Model):
+    """ Totals of all compacted transactions of a wallet.
+    """
+    wallet = models.OneToOneField(Wallet, related_name='checkpoint')
+
+    # Every transaction created before this has been considered for compaction
+    compacted_until = models.DateTimeField()
+
+    # Highest block height of compacted incoming transactions
+    max_block_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+
+    transactions_count = models.PositiveIntegerField(default=0)
+
+    received = BitcoinAmountField(default=0)
+    sent = BitcoinAmountField(default=0)
+    balance = BitcoinAmountField(default=0)
+
+    def __unicode__(self):
+        return u'{} transactions until {}, balance: {} BTC'.format(self.transactions_count, self.compacted_until, self.balance)
+
+
+def _aggregate_subquery(model, fk_name, aggregate, output_field):
+    """ Aggregates rows that refer to outer OutgoingTransaction.
+    Subqueries are used, so several of these can be annotated
+    to same query without joins multiplying each other.
+    """
+    queryset = model.objects.filter(**{fk_name: OuterRef('pk')}).order_by().values(fk_name).annotate(result=aggregate).values('result')
+    return Coalesce(Subquery(queryset, output_field=output_field), Value(0), output_field=output_field)
+
+
+class OutgoingTransactionQuerySet(models.QuerySet):
+
+    def selectForUpdateSkipLocked(self):
+        """ Locks selected rows, skipping rows that others have locked.
+        Databases without SKIP LOCKED wait for the lock instead.
+        """
+        if connection.features.has_select_for_update_skip_locked:
+            return self.select_for_update(skip_locked=True)
+        return self.select_for_update()
+
+    def withSummaries(self):
+        """ Annotates outputs_total, inputs_total, fee, outputs_count and txs_count.
+        """
+        amount_field = BitcoinAmountField()
+        count_field = models.IntegerField()
+        return self.annotate(
+            outputs_total=_aggregate_subquery(OutgoingTransactionOutput, 'tx', Sum('amount'), amount_field),
+            inputs_total=_aggregate_subquery(OutgoingTransactionInput, 'tx', Sum('amount'), amount_field),
+            outputs_count=_aggregate_subquery(OutgoingTransactionOutput, 'tx', Count('id'), count_field),
+            txs_count=_aggregate_subquery(Transaction, 'outgoing_tx', Count('id'), count_field),
+        ).annotate(
+            fee=F('inputs_total') - F('outputs_total'),
+        )
 
 
 class OutgoingTransaction(models.Model):
@@ -254,31 +734,57 @@ class OutgoingTransaction(models.Model):
     # This means the moment where transaction was notified as being sent to Bitcoin network
     sent_at = models.DateTimeField(null=True, blank=True, default=None)
 
+    objects = OutgoingTransactionQuerySet.as_manager()
+
+    # These use annotations, if transaction was fetched using withSummaries()
+
+    def getOutputsTotal(self):
+        if hasattr(self, 'outputs_total'):
+            return self.outputs_total or Decimal(0)
+        return self.outputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
+
+    def getInputsTotal(self):
+        if hasattr(self, 'inputs_total'):
+            return self.inputs_total or Decimal(0)
+        return self.inputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
+
+    def getOutputsCount(self):
+        if hasattr(self, 'outputs_count'):
+            return self.outputs_count
+        return self.outputs.count()
+
+    def getTxsCount(self):
+        if hasattr(self, 'txs_count'):
+            return self.txs_count
+        return self.txs.count()
+
     def calculateFee(self):
-        outputs_total = self.outputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
-        inputs_total = self.inputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
-        fee = inputs_total - outputs_total
+        if hasattr(self, 'fee'):
+            fee = self.fee
+        else:
+            fee = self.getInputsTotal() - self.getOutputsTotal()
         return fee if fee >= 0 else None
 
     def __unicode__(self):
-        outputs_total = self.outputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
+        outputs_total = self.getOutputsTotal()
+        outputs_count = self.getOutputsCount()
+        txs_count = self.getTxsCount()
 
         if not self.inputs_selected_at:
-            return u'Sending of {} BTC to {} addresses using {} transactions.'.format(outputs_total, self.outputs.count(), self.txs.count())
+            return u'Sending of {} BTC to {} addresses using {} transactions.'.format(outputs_total, outputs_count, txs_count)
 
-        inputs_total = self.inputs.aggregate(Sum('amount'))['amount__sum'] or Decimal(0)
-        fee = inputs_total - outputs_total
+        fee = self.getInputsTotal() - outputs_total
 
         if not self.sent_at:
-            return u'Sending of {} BTC to {} addresses using {} transactions. Fee is {} BTC.'.format(outputs_total, self.outputs.count(), self.txs.count(), fee)
+            return u'Sending of {} BTC to {} addresses using {} transactions. Fee is {} BTC.'.format(outputs_total, outputs_count, txs_count, fee)
 
-        return u'Sent {} BTC to {} addresses using {} transactions. Fee was {} BTC.'.format(outputs_total, self.outputs.count(), self.txs.count(), fee)
+        return u'Sent {} BTC to {} addresses using {} transactions. Fee was {} BTC.'.format(outputs_total, outputs_count, txs_count, fee)
 
 
 class OutgoingTransactionInput(models.Model):
     tx = models.ForeignKey(OutgoingTransaction, related_name='inputs')
 
-    amount = models.DecimalField(max_digits=16, decimal_places=8)
+    amount = BitcoinAmountField()
 
     bitcoin_txid = models.CharField(max_length=64)
     bitcoin_vout = models.PositiveIntegerField()
@@ -293,7 +799,7 @@ class OutgoingTransactionInput(models.Model):
 class OutgoingTransactionOutput(models.Model):
     tx = models.ForeignKey(OutgoingTransaction, related_name='outputs')
 
-    amount = models.DecimalField(max_digits=16, decimal_places=8)
+    amount = BitcoinAmountField()
 
     bitcoin_address = BitcoinAddressField()
 
@@ -303,3 +809,84 @@ class OutgoingTransactionOutput(models.Model):
 
 class CurrentBlockHeight(models.Model):
     block_height = models.PositiveIntegerField()
+
+
+class JobLock(models.Model):
+    """ Lock that allows only one server to run a background job at a
+    time. Token is increased every time the lock is taken, so writes
+    of an owner that has lost the lock can be refused.
+    """
+    name = models.CharField(max_length=200, unique=True)
+
+    owner = models.CharField(max_length=200, blank=True, default='')
+    token = models.BigIntegerField(default=0)
+
+    expires_at = models.DateTimeField(null=True, blank=True, default=None)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __unicode__(self):
+        return u'{} locked by {} until {}'.format(self.name, self.owner or 'nobody', self.expires_at)
+
+
+class WalletAudit(models.Model):
+    """ Audited state of wallet. Transactions up to sequence have been
+    verified, and checksum covers all of them in order.
+    """
+    wallet = models.OneToOneField(Wallet, related_name='audit')
+
+    sequence = models.PositiveIntegerField(default=0)
+    balance = BitcoinAmountField(default=0)
+    checksum = models.CharField(max_length=64, blank=True, default='')
+
+    # Why audit could not advance further, if something was wrong
+    problem = models.CharField(max_length=200, blank=True, default='')
+
+    audited_at = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u'Wallet {} audited until sequence {}, balance: {} BTC'.format(self.wallet_id, self.sequence, self.balance)
+
+
+class BlockAudit(models.Model):
+    """ Incoming transactions of block, that node and ledger agreed on.
+    Totals and checksum run over all audited blocks up to this one.
+    """
+    block_height = models.PositiveIntegerField(unique=True)
+
+    transactions_count = models.PositiveIntegerField()
+    received = BitcoinAmountField()
+
+    total_transactions_count = models.PositiveIntegerField()
+    total_received = BitcoinAmountField()
+    checksum = models.CharField(max_length=64)
+
+    def __unicode__(self):
+        return u'Block {}: {} transactions, received {} BTC'.format(self.block_height, self.transactions_count, self.received)
+
+
+class LedgerAudit(models.Model):
+    """ Result of one audit run.
+    """
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    full = models.BooleanField(default=False)
+
+    # Blocks up to this height have been audited
+    block_height = models.PositiveIntegerField(null=True, blank=True, default=None)
+
+    wallets_checked = models.PositiveIntegerField(default=0)
+    blocks_checked = models.PositiveIntegerField(default=0)
+
+    # What node should hold according to ledger, and what it holds.
+    # These are empty if totals could not be compared.
+    expected_holdings = BitcoinAmountField(null=True, blank=True, default=None)
+    node_holdings = BitcoinAmountField(null=True, blank=True, default=None)
+
+    # Problems are discrepancies. Notes are changes to already
+    # audited history, that were audited again and found fine.
+    problems = JSONField(default=list)
+    notes = JSONField(default=list)
+
+    def __unicode__(self):
+        return u'{} audit at {}: {} problems'.format('Full' if self.full else 'Incremental', self.started_at, len(self.problems))
@@ -0,0 +1,174 @@
+from django.conf import settings
+from django.db import connections
+
+import cProfile
+from collections import deque
+import datetime
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+
+_state = threading.local()
+
+
+def get_profiling_dir():
+    return getattr(settings, 'PROFILING_DIR', None)
+
+
+def get_profiling_threshold():
+    return getattr(settings, 'PROFILING_THRESHOLD', 5.0)
+
+
+def get_profiling_max_dumps():
+    return getattr(settings, 'PROFILING_MAX_DUMPS', 100)
+
+
+def get_profiling_max_queries():
+    return getattr(settings, 'PROFILING_MAX_QUERIES', 10000)
+
+
+def record_rpc_call(method, duration):
+    """ Called by RPC connections after every call. Does
+    nothing, unless the call is made inside profiled().
+    """
+    rpc_calls = getattr(_state, 'rpc_calls', None)
+    if rpc_calls is not None:
+        rpc_calls.append({'method': method, 'time': duration})
+
+
+class RecordingQueriesLog(deque):
+    """ Query log of database connection, that also remembers queries
+    appended to it. Connection keeps only its latest queries, so queries
+    would be lost once the log is full. Only max_queries latest queries
+    are remembered, but all of them are counted.
+    """
+
+    def __init__(self, queries_log, max_queries):
+        super(RecordingQueriesLog, self).__init__(queries_log, queries_log.maxlen)
+        self.recorded = deque(maxlen=max_queries)
+        self.recorded_count = 0
+
+    def append(self, query):
+        super(RecordingQueriesLog, self).append(query)
+        self.recorded.append(query)
+        self.recorded_count += 1
+
+
+class QueryLog(object):
+    """ Makes database connection log its queries, and returns the
+    number of queries that were logged meanwhile and the latest of them.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        connection.queries_log = RecordingQueriesLog(connection.queries_log, get_profiling_max_queries())
+
+    def finish(self):
+        self.connection.force_debug_cursor = self.force_debug_cursor
+        queries_log = self.connection.queries_log
+        self.connection.queries_log = deque(queries_log, queries_log.maxlen)
+        return queries_log.recorded_count, [
+            {'database': self.connection.alias, 'sql': query['sql'], 'time': float(query['time'])}
+            for query in queries_log.recorded
+        ]
+
+
+class profiled(object):
+    """ Profiles the code, if PROFILING_DIR is set. If running takes longer
+    than PROFILING_THRESHOLD seconds, cProfile stats, database queries and
+    RPC calls are written to PROFILING_DIR. When profiled code is called
+    inside other profiled code, only the outermost one is profiled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, func):
+        # Every call gets its own context, so calls from many threads do not mix
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with profiled(self.name):
+                return func(*args, **kwargs)
+        return inner
+
+    def __enter__(self):
+        self.active = bool(get_profiling_dir()) and getattr(_state, 'rpc_calls', None) is None
+        if not self.active:
+            return
+        _state.rpc_calls = []
+        self.query_logs = [QueryLog(connection) for connection in connections.all()]
+        self.profile = cProfile.Profile()
+        self.started_at = time.time()
+        self.profile.enable()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.active:
+            return
+        self.profile.disable()
+        duration = time.time() - self.started_at
+        rpc_calls = _state.rpc_calls
+        _state.rpc_calls = None
+        queries_count = 0
+        queries = []
+        for query_log in self.query_logs:
+            query_log_count, query_log_queries = query_log.finish()
+            queries_count += query_log_count
+            queries += query_log_queries
+
+        if duration < get_profiling_threshold():
+            return
+        try:
+            self.writeDump(duration, queries_count, queries, rpc_calls, failed=exc_type is not None)
+        except (IOError, OSError):
+            # Profiling must never break the profiled code
+            pass
+
+    def writeDump(self, duration, queries_count, queries, rpc_calls, failed):
+        profiling_dir = get_profiling_dir()
+        if not os.path.isdir(profiling_dir):
+            os.makedirs(profiling_dir)
+
+        started_at = datetime.datetime.utcfromtimestamp(self.started_at)
+        basename = '{}-{}-{}'.format(started_at.strftime('%Y%m%dT%H%M%S.%f'), re.sub(r'[^A-Za-z0-9_.]', '_', self.name), os.getpid())
+        path = os.path.join(profiling_dir, basename)
+
+        self.profile.dump_stats(path + '.prof')
+        with open(path + '.json', 'w') as json_file:
+            json.dump({
+                'name': self.name,
+                'started_at': started_at.isoformat() + 'Z',
+                'duration': duration,
+                'failed': failed,
+                'queries_count': queries_count,
+                'queries': queries,
+                'rpc_calls': rpc_calls,
+            }, json_file)
+
+        rotate_dumps(profiling_dir, get_profiling_max_dumps())
+
+
+def list_dumps(profiling_dir):
+    """ Returns paths of dumps without extension, oldest first.
+    """
+    if not os.path.isdir(profiling_dir):
+        return []
+    names = [name[:-len('.json')] for name in os.listdir(profiling_dir) if name.endswith('.json')]
+    return [os.path.join(profiling_dir, name) for name in sorted(names)]
+
+
+def rotate_dumps(profiling_dir, max_dumps):
+    """ Removes oldest dumps, so there are at most max_dumps left.
+    """
+    dumps = list_dumps(profiling_dir)
+    for path in dumps[:max(0, len(dumps) - max_dumps)]:
+        for extension in ['.json', '.prof']:
+            try:
+                os.remove(path + extension)
+            except OSError:
+                pass
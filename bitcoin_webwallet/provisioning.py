@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import transaction
+
+import multiprocessing
+import time
+
+from cron import ImportPendingAddresses
+from keys import derive_first_address_in_worker, get_watchonly_range_chunk, init_derivation_worker, is_watchonly_mode
+from models import Address, Wallet, _get_current_block_height
+from rpc import get_rpc
+
+
+PROVISION_CHUNK_SIZE = 1000
+
+
+def provision_wallets(parent_path, start, count, workers=None, chunk_size=PROVISION_CHUNK_SIZE, import_keys=True, progress=None):
+    """ Creates wallets parent_path + [i], where i goes from start to
+    start + count - 1, each with its first address. Existing wallets are
+    skipped. Keys are derived in process pool and rows are inserted in
+    chunks. Keys are imported to node a chunk at a time, unless import_keys
+    is False or node fails. Then ImportPendingAddresses imports them later.
+    Calls progress(stats, elapsed) after every chunk. Returns stats.
+    """
+    if (parent_path + [start])[0] == 0:
+        raise Exception('Wallet paths starting with zero are reserved for internal wallets!')
+
+    watchonly = is_watchonly_mode()
+    rpc = get_rpc() if import_keys else None
+    block_height = _get_current_block_height()
+    stats = {'created': 0, 'skipped': 0, 'imported': 0}
+
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), init_derivation_worker, (settings.MASTERWALLET_BIP32_KEY,))
+    started_at = time.time()
+    try:
+        for chunk_start in range(start, start + count, chunk_size):
+            paths = [parent_path + [i] for i in range(chunk_start, min(chunk_start + chunk_size, start + count))]
+            existing = set(tuple(path) for path in Wallet.objects.filter(path__in=paths).values_list('path', flat=True))
+            paths = [path for path in paths if tuple(path) not in existing]
+            stats['skipped'] += len(existing)
+
+            if paths:
+                derived = pool.map(derive_first_address_in_worker, [(path, watchonly) for path in paths])
+                wallet_ids = _create_wallets(paths, derived, watchonly, block_height)
+                stats['created'] += len(paths)
+
+                if rpc:
+                    if watchonly:
+                        imported = _register_wallets(rpc, paths, derived, wallet_ids)
+                    else:
+                        imported = _import_first_addresses(rpc, derived, wallet_ids)
+                    if imported is None:
+                        # Node does not work, so the rest is left for cron jobs
+                        rpc = None
+                    else:
+                        stats['imported'] += imported
+
+            if progress:
+                progress(stats, time.time() - started_at)
+    finally:
+        pool.terminate()
+
+    return stats
+
+
+def _create_wallets(paths, derived, watchonly, block_height):
+    """ Inserts wallets and their first addresses. Returns IDs of wallets by path.
+    """
+    with transaction.atomic():
+        Wallet.objects.bulk_create([Wallet(path=path) for path in paths])
+        # Primary keys are not returned by every database, so they are asked separately
+        wallet_ids = dict((tuple(path), pk) for pk, path in Wallet.objects.filter(path__in=paths).values_list('pk', 'path'))
+        Address.objects.bulk_create([
+            Address(
+                wallet_id=wallet_ids[tuple(path)],
+                subpath_number=0,
+                address=btc_address,
+                import_pending=not watchonly,
+                rescan_from_height=None if watchonly else block_height,
+            )
+            for path, (btc_address, _, _) in zip(paths, derived)
+        ])
+    return wallet_ids
+
+
+def _import_first_addresses(rpc, derived, wallet_ids):
+    addresses = list(Address.objects.filter(wallet_id__in=wallet_ids.values(), subpath_number=0).select_related('wallet'))
+    private_keys = dict((btc_address, btc_private_key) for btc_address, btc_private_key, _ in derived)
+    return ImportPendingAddresses().importAddresses(rpc, addresses, [private_keys[address.address] for address in addresses])
+
+
+def _register_wallets(rpc, paths, derived, wallet_ids):
+    """ Registers ranged descriptors of wallets to node with one call.
+    """
+    range_end = get_watchonly_range_chunk()
+    requests = [{
+        'desc': descriptor,
+        'range': [0, range_end - 1],
+        'timestamp': 'now',
+        'watchonly': True,
+    } for _, _, descriptor in derived]
+    try:
+        results = rpc.importmulti(requests, {'rescan': False})
+    except Exception:
+        return None
+    registered_ids = [wallet_ids[tuple(path)] for path, result in zip(paths, results) if result.get('success')]
+    Wallet.objects.filter(pk__in=registered_ids).update(watched_range_end=range_end)
+    return len(registered_ids)
@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import ContextDecorator
+
+import random
+import threading
+import time
+
+
+APP_LABEL = 'bitcoin_webwallet'
+
+# How long measured lag of replica is trusted
+REPLICA_LAG_CHECK_INTERVAL = 1.0
+
+_state = threading.local()
+_replica_lags = {}
+_replica_lags_lock = threading.Lock()
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_replica_max_lag():
+    return getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)
+
+
+class replica_reads(ContextDecorator):
+    """ Allows reads of wallets and transactions to go to replica
+    databases. Can be used as context manager or decorator. Only
+    use this for reads that are displayed, never for reads that
+    decide what is written.
+    """
+
+    def __enter__(self):
+        _state.replica_depth = getattr(_state, 'replica_depth', 0) + 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.replica_depth -= 1
+
+
+class primary_reads(ContextDecorator):
+    """ Keeps reads in primary database, even inside replica_reads().
+    Background jobs use this, because their reads decide what is written.
+    """
+
+    def __enter__(self):
+        _state.primary_depth = getattr(_state, 'primary_depth', 0) + 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _state.primary_depth -= 1
+
+
+def _measure_replica_lag(alias):
+    """ Returns how many seconds replica is behind primary. Only
+    PostgreSQL streaming replicas can be measured, others are
+    expected to be up to date.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+        )
+        lag = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    return float(lag or 0)
+
+
+def get_replica_lag(alias):
+    now = time.time()
+    with _replica_lags_lock:
+        measured_at, lag = _replica_lags.get(alias, (None, None))
+    if measured_at is not None and now - measured_at < REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+    try:
+        lag = _measure_replica_lag(alias)
+    except Exception:
+        # Unreachable replica is not used
+        lag = None
+    with _replica_lags_lock:
+        _replica_lags[alias] = (now, lag)
+    return lag
+
+
+def get_fresh_replica():
+    """ Returns alias of random replica that is not lagging too much,
+    or None if there is no such replica.
+    """
+    max_lag = get_replica_max_lag()
+    replicas = []
+    for alias in get_replicas():
+        lag = get_replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            replicas.append(alias)
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter(object):
+    """ Routes reads inside replica_reads() to replica databases listed in
+    DATABASE_REPLICAS. Reads stay in primary database when they are inside
+    transaction or primary_reads(), when this thread has written recently,
+    or when replicas lag more than DATABASE_REPLICA_MAX_LAG seconds.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        if not getattr(_state, 'replica_depth', 0) or getattr(_state, 'primary_depth', 0):
+            return DEFAULT_DB_ALIAS
+        # Reads inside transaction are used to decide what is written
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # Replicas might not have received latest writes of this thread yet
+        written_at = getattr(_state, 'written_at', None)
+        if written_at is not None and time.time() - written_at <= get_replica_max_lag():
+            return DEFAULT_DB_ALIAS
+        return get_fresh_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        _state.written_at = time.time()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [DEFAULT_DB_ALIAS] + list(get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
+        return None
@@ -0,0 +1,220 @@
+from django.conf import settings
+
+from bitcoinrpc.authproxy import AuthServiceProxy
+
+import threading
+import time
+
+from profiling import record_rpc_call
+
+
+# Calls that do not depend on the wallet of the node. These can
+# be answered by any node that is following the blockchain.
+READ_ONLY_METHODS = set([
+    'getblock',
+    'getblockcount',
+    'getblockhash',
+    'getblockheader',
+    'getbestblockhash',
+    'estimatesmartfee',
+    'estimatefee',
+])
+
+
+def _make_url(ip, port, username, password):
+    return 'http://' + username + ':' + password + '@' + ip + ':' + str(port)
+
+
+def get_primary_rpc_url():
+    return _make_url(settings.BITCOIN_RPC_IP, settings.BITCOIN_RPC_PORT, settings.BITCOIN_RPC_USERNAME, settings.BITCOIN_RPC_PASSWORD)
+
+
+class TimedServiceProxy(object):
+    """ Works like AuthServiceProxy, but tells durations of calls to profiling.
+    """
+
+    def __init__(self, url):
+        self.proxy = AuthServiceProxy(url)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError
+        method = getattr(self.proxy, name)
+
+        def call(*args):
+            started_at = time.time()
+            try:
+                return method(*args)
+            finally:
+                record_rpc_call(name, time.time() - started_at)
+        return call
+
+
+def get_rpc():
+    """ Returns connection to primary node. This must be
+    used for every call that uses the wallet of the node.
+    """
+    return TimedServiceProxy(get_primary_rpc_url())
+
+
+# Longest time that a failing node is not asked anything
+MAX_HEALTH_CHECK_BACKOFF = 300
+
+
+class NodeState(object):
+
+    def __init__(self, url, primary):
+        self.url = url
+        self.primary = primary
+        self.healthy = primary
+        self.block_height = None
+        self.latency = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        self.retry_at = None
+
+
+class NodePool(object):
+    """ Keeps track of the health of primary and read-only nodes, and
+    routes read-only calls to the least loaded healthy node. Failing
+    nodes are checked again after a delay, that grows with every
+    failure. Connections are made with proxy_class.
+    """
+
+    def __init__(self, urls, proxy_class=TimedServiceProxy):
+        self.nodes = [NodeState(url, i == 0) for i, url in enumerate(urls)]
+        self.proxy_class = proxy_class
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.thread = None
+
+    def getHealthCheckInterval(self):
+        return getattr(settings, 'BITCOIN_RPC_HEALTH_CHECK_INTERVAL', 10)
+
+    def checkHealth(self):
+        """ Asks block height from every node. Nodes that are
+        unreachable or lag behind the others are not used.
+        """
+        for node in self.nodes:
+            if node.retry_at is not None and time.time() < node.retry_at:
+                continue
+            started_at = time.time()
+            try:
+                block_height = self.proxy_class(node.url).getblockcount()
+            except Exception:
+                with self.lock:
+                    self.markFailed(node)
+                continue
+            with self.lock:
+                node.block_height = block_height
+                node.latency = 0.7 * node.latency + 0.3 * (time.time() - started_at)
+                node.failures = 0
+                node.retry_at = None
+
+        max_lag = getattr(settings, 'BITCOIN_RPC_MAX_LAG_BLOCKS', 2)
+        with self.lock:
+            block_heights = [node.block_height for node in self.nodes if node.block_height is not None]
+            best_block_height = max(block_heights) if block_heights else None
+            for node in self.nodes:
+                node.healthy = node.block_height is not None and node.block_height >= best_block_height - max_lag
+            self.checked_at = time.time()
+
+    def markFailed(self, node):
+        """ Stops using node until back-off delay has passed.
+        Must be called while holding the lock.
+        """
+        node.healthy = False
+        node.block_height = None
+        node.failures += 1
+        node.retry_at = time.time() + min(self.getHealthCheckInterval() * 2 ** (node.failures - 1), MAX_HEALTH_CHECK_BACKOFF)
+
+    def startHealthChecks(self):
+        """ Starts checking health in background thread.
+        """
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(target=self._runHealthChecks, name='bitcoin_webwallet node health checks')
+            self.thread.daemon = True
+        self.thread.start()
+
+    def _runHealthChecks(self):
+        while True:
+            try:
+                self.checkHealth()
+            except Exception:
+                pass
+            time.sleep(self.getHealthCheckInterval())
+
+    def chooseNode(self):
+        # Health is checked right away, if there is no recent information
+        if self.checked_at is None or time.time() - self.checked_at > 3 * self.getHealthCheckInterval():
+            self.checkHealth()
+        with self.lock:
+            healthy_nodes = [node for node in self.nodes if node.healthy]
+            if not healthy_nodes:
+                return self.nodes[0]
+            return min(healthy_nodes, key=lambda node: (node.in_flight, node.latency))
+
+    def call(self, method, args):
+        if method not in READ_ONLY_METHODS:
+            raise ValueError('{} is not a read-only call!'.format(method))
+        node = self.chooseNode()
+        with self.lock:
+            node.in_flight += 1
+        try:
+            return getattr(self.proxy_class(node.url), method)(*args)
+        except Exception:
+            if node.primary:
+                raise
+            # Read-only node failed, so primary answers instead
+            with self.lock:
+                self.markFailed(node)
+            return getattr(self.proxy_class(self.nodes[0].url), method)(*args)
+        finally:
+            with self.lock:
+                node.in_flight -= 1
+
+
+class ReadOnlyRPC(object):
+    """ Works like AuthServiceProxy, but only for read-only calls.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError
+        return lambda *args: self.pool.call(name, args)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_node_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            urls = [get_primary_rpc_url()]
+            for node in getattr(settings, 'BITCOIN_RPC_READ_NODES', []):
+                urls.append(_make_url(
+                    node['IP'],
+                    node['PORT'],
+                    node.get('USERNAME', settings.BITCOIN_RPC_USERNAME),
+                    node.get('PASSWORD', settings.BITCOIN_RPC_PASSWORD),
+                ))
+            _pool = NodePool(urls)
+            if len(urls) > 1:
+                _pool.startHealthChecks()
+        return _pool
+
+
+def get_read_rpc():
+    """ Returns connection for read-only calls. If there are no
+    read-only nodes configured, primary node is used directly.
+    """
+    if not getattr(settings, 'BITCOIN_RPC_READ_NODES', None):
+        return get_rpc()
+    return ReadOnlyRPC(get_node_pool())
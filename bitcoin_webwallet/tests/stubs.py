@@ -0,0 +1,174 @@
+from bitcoinrpc.authproxy import JSONRPCException
+
+from pycoin.key import Key
+
+from contextlib import contextmanager
+from decimal import Decimal
+import hashlib
+
+from bitcoin_webwallet import cron
+from bitcoin_webwallet.locks import acquire_lock
+
+
+# Testnet master key that is used by tests
+MASTER_KEY = 'tprv8ZgxMBicQKsPd7Uf69XL1XwhmjHopUGep8GuEiJDZmbQz6o58LninorQAfcKZWARbtRtfnLcJ5MQ2AtHcQJCCRUcMRvmDUjyEmNUWwx8UbK'
+
+TEST_SETTINGS = {
+    'MASTERWALLET_BIP32_KEY': MASTER_KEY,
+    'TESTNET': True,
+    'CONFIRMED_THRESHOLD': 1,
+    'BITCOIN_WATCHONLY': False,
+}
+
+WATCHONLY_TEST_SETTINGS = dict(TEST_SETTINGS, BITCOIN_WATCHONLY=True, WATCHONLY_RANGE_CHUNK=10)
+
+
+@contextmanager
+def replaced(obj, name, value):
+    """ Replaces attribute of object, usually a module, for the duration of the block.
+    """
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield value
+    finally:
+        setattr(obj, name, original)
+
+
+def rpc_error(code, message):
+    return JSONRPCException({'code': code, 'message': message})
+
+
+def add_real_bitcoin_transactions(node):
+    """ Runs AddRealBitcoinTransactions once against stub node.
+    """
+    job = cron.AddRealBitcoinTransactions()
+    lease = acquire_lock(job.code)
+    try:
+        with replaced(cron, 'get_rpc', lambda: node), replaced(cron, 'get_read_rpc', lambda: node):
+            job.doLocked(lease)
+    finally:
+        lease.release()
+
+
+class StubNode(object):
+    """ Bitcoin node for tests. Answers the RPC calls that this library
+    makes, using blocks, transactions and unspent outputs that tests
+    give. Block hash is the height in hex, so heights are easy to find.
+    """
+
+    def __init__(self, block_count=100, has_getaddressinfo=True):
+        self.block_count = block_count
+        self.has_getaddressinfo = has_getaddressinfo
+        self.received = []
+        self.known_addresses = set()
+        self.invalid_addresses = set()
+        self.unspent_outputs = []
+        self.sent_txs = {}
+        # Addresses of imported ranged descriptors, and (descriptor, range) of every import
+        self.watchonly_addresses = set()
+        self.imported_ranges = []
+
+    def receive(self, address, amount, block_height=None, txid=None):
+        """ Adds incoming transaction, that is confirmed if block_height is given.
+        """
+        txid = txid or hashlib.sha256('{}:{}'.format(len(self.received), address)).hexdigest()
+        self.received.append({
+            'txid': txid,
+            'address': address,
+            'amount': Decimal(amount),
+            'block_height': block_height,
+            'timereceived': 1500000000 + len(self.received),
+        })
+        return txid
+
+    def getblockcount(self):
+        return self.block_count
+
+    def getblockhash(self, height):
+        return '%064x' % height
+
+    def getblock(self, block_hash):
+        height = int(block_hash, 16)
+        return {'height': height, 'time': 1500000000 + 600 * height}
+
+    def listsinceblock(self, block_hash='', target_confirmations=1, include_watchonly=False):
+        since_height = int(block_hash, 16) if block_hash else 0
+        txs = []
+        for tx in self.received:
+            if tx['block_height'] is not None and tx['block_height'] <= since_height:
+                continue
+            # Like real node, leaves out transactions to watch-only addresses unless asked
+            if tx['address'] in self.watchonly_addresses and not include_watchonly:
+                continue
+            txs.append({
+                'category': 'receive',
+                'txid': tx['txid'],
+                'address': tx['address'],
+                'amount': tx['amount'],
+                'blockhash': self.getblockhash(tx['block_height']) if tx['block_height'] is not None else None,
+                'timereceived': tx['timereceived'],
+            })
+        return {'transactions': txs}
+
+    def getaddressinfo(self, address):
+        if not self.has_getaddressinfo:
+            raise rpc_error(-32601, 'Method not found')
+        return self.validateaddress(address)
+
+    def validateaddress(self, address):
+        if address in self.invalid_addresses:
+            raise rpc_error(-5, 'Invalid address')
+        return {'address': address, 'ismine': address in self.known_addresses, 'iswatchonly': address in self.watchonly_addresses}
+
+    def importmulti(self, requests, options):
+        results = []
+        for request in requests:
+            if 'scriptPubKey' in request:
+                self.known_addresses.add(request['scriptPubKey']['address'])
+            if 'desc' in request:
+                # Descriptor is pkh(<extended public key>/*)#<checksum>
+                wallet_key = Key.from_text(request['desc'].split('#')[0][len('pkh('):-len('/*)')])
+                first, last = request['range']
+                for index in range(first, last + 1):
+                    self.watchonly_addresses.add(wallet_key.subkey(index).address(use_uncompressed=False))
+                self.imported_ranges.append((request['desc'], request['range']))
+            results.append({'success': True})
+        return results
+
+    def batch_(self, rpc_calls):
+        # Like AuthServiceProxy, raises the error of the first failed call
+        results = []
+        for rpc_call in rpc_calls:
+            method = rpc_call.pop(0)
+            if not hasattr(self, method):
+                raise rpc_error(-32601, 'Method not found')
+            results.append(getattr(self, method)(*rpc_call))
+        return results
+
+    def listunspent(self, minconf):
+        return [unspent_output for unspent_output in self.unspent_outputs if unspent_output['confirmations'] >= minconf]
+
+    def getbalance(self, account, minconf, include_watchonly):
+        return sum((unspent_output['amount'] for unspent_output in self.listunspent(minconf)), Decimal(0))
+
+    def createrawtransaction(self, inputs, outputs):
+        return 'raw:' + repr((sorted((inpt['txid'], inpt['vout']) for inpt in inputs), sorted(outputs.items())))
+
+    def signrawtransaction(self, raw_tx):
+        return {'hex': 'signed:' + raw_tx, 'complete': True}
+
+    def decoderawtransaction(self, raw_tx):
+        return {'txid': hashlib.sha256(raw_tx).hexdigest()}
+
+    def sendrawtransaction(self, raw_tx):
+        txid = self.decoderawtransaction(raw_tx)['txid']
+        if txid in self.sent_txs:
+            raise rpc_error(-27, 'Transaction already in block chain')
+        self.sent_txs[txid] = raw_tx
+        return txid
+
+    def gettransaction(self, txid, include_watchonly=False):
+        if txid not in self.sent_txs:
+            raise rpc_error(-5, 'Invalid or non-wallet transaction id')
+        return {'txid': txid, 'hex': self.sent_txs[txid], 'confirmations': 0}
@@ -0,0 +1,69 @@
+from django.test import TestCase, override_settings
+
+from decimal import Decimal
+
+from bitcoin_webwallet.audit import run_audit
+from bitcoin_webwallet.models import Address, Transaction, Wallet, WalletAudit
+from stubs import TEST_SETTINGS, StubNode, add_real_bitcoin_transactions
+
+
+@override_settings(**TEST_SETTINGS)
+class AuditTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.address = Address.objects.create(wallet=self.wallet, subpath_number=0, address='mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn')
+        self.node = StubNode(block_count=100)
+        self.node.receive(self.address.address, '1.5', block_height=50)
+        self.node.unspent_outputs.append({'txid': 'a' * 64, 'vout': 0, 'amount': Decimal('1.5'), 'confirmations': 51, 'spendable': True})
+        add_real_bitcoin_transactions(self.node)
+
+    def test_clean_ledger(self):
+        ledger_audit = run_audit(self.node)
+        self.assertEqual(ledger_audit.problems, [])
+        self.assertEqual(ledger_audit.block_height, 100 - 6)
+        self.assertEqual(ledger_audit.wallets_checked, 1)
+
+    def test_first_differing_block_is_reported(self):
+        # Node has deposits that ledger has not added
+        self.node.receive(self.address.address, '0.5', block_height=60)
+        self.node.receive(self.address.address, '0.25', block_height=70)
+
+        ledger_audit = run_audit(self.node)
+
+        block_problems = [problem for problem in ledger_audit.problems if problem.startswith('Block ')]
+        self.assertEqual(len(block_problems), 1)
+        self.assertTrue(block_problems[0].startswith('Block 60: Node has 1 transactions of 50000000 satoshis to wallet addresses, ledger has 0 transactions of 0 satoshis.'))
+        self.assertEqual(ledger_audit.block_height, 59)
+
+        # Next audit continues from the same block
+        ledger_audit = run_audit(self.node)
+        self.assertTrue(ledger_audit.problems[0].startswith('Block 60:'))
+        self.assertEqual(ledger_audit.blocks_checked, 0)
+
+    def test_changed_wallet_history_is_rebuilt(self):
+        other = Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Internal')
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('-1'), description='Internal')
+        self.assertEqual(run_audit(self.node).notes, [])
+
+        # Removing audited transaction changes running balances of later ones
+        other.delete()
+
+        ledger_audit = run_audit(self.node)
+        self.assertIn('Wallet {}: Audited transactions have changed.'.format(self.wallet.pk), ledger_audit.notes)
+        self.assertEqual(WalletAudit.objects.get(wallet=self.wallet).balance, Decimal('0.5'))
+        self.assertEqual(WalletAudit.objects.get(wallet=self.wallet).problem, '')
+
+    def test_full_audit_rebuilds_everything(self):
+        run_audit(self.node)
+        Transaction.objects.filter(wallet=self.wallet).update(description='Changed')
+        self.assertEqual(run_audit(self.node, full=True).notes, [])
+
+        deposit = Transaction.objects.get(wallet=self.wallet)
+        Transaction.objects.filter(pk=deposit.pk).update(incoming_txid='b' * 64)
+        self.node.received[0]['txid'] = 'b' * 64
+
+        ledger_audit = run_audit(self.node, full=True)
+        self.assertIn('Wallet {}: Audited transactions have changed.'.format(self.wallet.pk), ledger_audit.notes)
+        self.assertIn('Audited blocks have changed since block 50.', ledger_audit.notes)
+        self.assertEqual(ledger_audit.problems, [])
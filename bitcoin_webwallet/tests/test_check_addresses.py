@@ -0,0 +1,86 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from bitcoin_webwallet.keys import derive_address_and_private_key, get_master_key
+from bitcoin_webwallet.management.commands import check_addresses
+from bitcoin_webwallet.models import Address, Wallet
+from stubs import TEST_SETTINGS, StubNode, replaced
+
+
+class BatchRecordingNode(StubNode):
+
+    def __init__(self, *args, **kwargs):
+        super(BatchRecordingNode, self).__init__(*args, **kwargs)
+        self.batch_sizes = []
+
+    def batch_(self, rpc_calls):
+        self.batch_sizes.append(len(rpc_calls))
+        return super(BatchRecordingNode, self).batch_(rpc_calls)
+
+
+@override_settings(**TEST_SETTINGS)
+class CheckAddressesTest(TestCase):
+
+    def setUp(self):
+        wallet = Wallet.objects.create(path=[1])
+        master_key = get_master_key()
+        self.addresses = []
+        for subpath_number in range(5):
+            btc_address = derive_address_and_private_key(master_key, [1, subpath_number])[0]
+            self.addresses.append(Address.objects.create(wallet=wallet, subpath_number=subpath_number, address=btc_address))
+        self.temp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.temp_dir, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def checkAddresses(self, node, **options):
+        with replaced(check_addresses, 'get_rpc', lambda: node):
+            call_command('check_addresses', chunk_size=2, workers=1, checkpoint=self.checkpoint, stdout=StringIO(), **options)
+
+    def test_imports_missing_addresses_in_partial_batches(self):
+        node = BatchRecordingNode()
+        node.known_addresses.update([self.addresses[0].address, self.addresses[3].address])
+
+        self.checkAddresses(node)
+
+        self.assertEqual(node.batch_sizes, [2, 2, 1])
+        self.assertEqual(node.known_addresses, set(address.address for address in self.addresses))
+        with open(self.checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['last_address_id'], self.addresses[-1].pk)
+
+    def test_falls_back_to_validateaddress(self):
+        node = BatchRecordingNode(has_getaddressinfo=False)
+
+        self.checkAddresses(node)
+
+        # Every chunk is tried with getaddressinfo first
+        self.assertEqual(node.batch_sizes, [2, 2, 2, 2, 1, 1])
+        self.assertEqual(node.known_addresses, set(address.address for address in self.addresses))
+
+    def test_failed_batch_leaves_checkpoint_for_resuming(self):
+        node = BatchRecordingNode()
+        node.invalid_addresses.add(self.addresses[3].address)
+
+        with self.assertRaises(JSONRPCException):
+            self.checkAddresses(node)
+
+        # First chunk was done, second one failed as a whole
+        self.assertEqual(node.known_addresses, set([self.addresses[0].address, self.addresses[1].address]))
+        with open(self.checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)['last_address_id'], self.addresses[1].pk)
+
+        node.invalid_addresses.clear()
+        node.batch_sizes = []
+        self.checkAddresses(node)
+
+        self.assertEqual(node.batch_sizes, [2, 1])
+        self.assertEqual(node.known_addresses, set(address.address for address in self.addresses))
@@ -0,0 +1,100 @@
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+import datetime
+from decimal import Decimal
+
+from bitcoin_webwallet.audit import run_audit
+from bitcoin_webwallet.compaction import compact_wallet
+from bitcoin_webwallet.models import Address, ArchivedTransaction, Transaction, TransactionEvent, TransactionRecipient, Wallet
+from stubs import TEST_SETTINGS, StubNode, add_real_bitcoin_transactions
+
+
+@override_settings(**TEST_SETTINGS)
+class CompactionTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.address = Address.objects.create(wallet=self.wallet, subpath_number=0, address='mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn')
+        self.node = StubNode(block_count=100)
+        self.future = now() + datetime.timedelta(days=1)
+
+    def assertDepositsOnce(self, txids):
+        live_txids = list(Transaction.objects.filter(wallet=self.wallet).values_list('incoming_txid', flat=True))
+        archived_txids = list(ArchivedTransaction.objects.filter(wallet=self.wallet).values_list('incoming_txid', flat=True))
+        self.assertEqual(sorted(live_txids + archived_txids), sorted(txids))
+
+    def test_compacted_deposits_are_not_added_again(self):
+        old_txid = self.node.receive(self.address.address, '1.5', block_height=50)
+        recent_txid = self.node.receive(self.address.address, '0.5', block_height=97)
+        add_real_bitcoin_transactions(self.node)
+
+        # Transactions in blocks that are processed again are kept
+        self.assertEqual(compact_wallet(self.wallet, self.future, 7), 1)
+        self.assertEqual(ArchivedTransaction.objects.get().incoming_txid, old_txid)
+
+        self.node.block_count = 101
+        add_real_bitcoin_transactions(self.node)
+
+        self.assertDepositsOnce([old_txid, recent_txid])
+        self.assertEqual(self.wallet.getBalance(0), Decimal('2'))
+
+    def test_blocks_of_imported_addresses_are_not_compacted(self):
+        txid = self.node.receive(self.address.address, '1.5', block_height=56)
+        add_real_bitcoin_transactions(self.node)
+
+        # Key of new address was imported, so blocks since its creation are processed again
+        Address.objects.create(wallet=self.wallet, subpath_number=1, address='mfWxJ45yp2SFn7UciZyNpvDKrzbhyfKrY8', rescan_from_height=60)
+        self.assertEqual(compact_wallet(self.wallet, self.future, 7), 0)
+
+        add_real_bitcoin_transactions(self.node)
+
+        self.assertDepositsOnce([txid])
+        self.assertEqual(self.wallet.getBalance(0), Decimal('1.5'))
+
+    def test_recipients_of_compacted_transactions(self):
+        self.node.receive(self.address.address, '1.5', block_height=50)
+        add_real_bitcoin_transactions(self.node)
+        other_wallet = Wallet.objects.create(path=[2])
+        self.wallet.sendTo([(other_wallet, Decimal('0.5'))], 0)
+        sent_tx = Transaction.objects.get(wallet=self.wallet, amount__lt=0)
+
+        self.assertEqual(compact_wallet(self.wallet, self.future, 7), 2)
+
+        recipient = TransactionRecipient.objects.get()
+        self.assertEqual(recipient.wallet, self.wallet)
+        self.assertEqual(recipient.getTransaction(), ArchivedTransaction.objects.get(pk=sent_tx.pk))
+        self.assertEqual(recipient.getTransaction().amount, Decimal('-0.5'))
+
+    def test_transaction_after_whole_wallet_is_compacted(self):
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('3'), description='Internal')
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('1'), description='Internal')
+        self.assertEqual(compact_wallet(self.wallet, self.future, 7), 2)
+        self.assertFalse(Transaction.objects.filter(wallet=self.wallet).exists())
+
+        tx = Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Internal')
+
+        self.assertEqual((tx.sequence, tx.running_balance), (3, Decimal('6')))
+        self.assertEqual(TransactionEvent.objects.filter(tx_id=tx.pk).get().balance, Decimal('6'))
+        self.assertEqual([problem for problem in run_audit(self.node).problems if problem.startswith('Wallet')], [])
+
+    def test_transaction_after_newer_ones_are_compacted(self):
+        # Unconfirmed deposit is kept, but the transaction after it is compacted
+        self.node.receive(self.address.address, '1.5')
+        add_real_bitcoin_transactions(self.node)
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('-1'), description='Internal')
+        self.assertEqual(compact_wallet(self.wallet, self.future, 7), 1)
+
+        tx = Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Internal')
+        self.assertEqual((tx.sequence, tx.running_balance), (3, Decimal('2.5')))
+
+        # Deposit disappears, so balances after it are fixed, also compacted ones
+        self.node.received = []
+        add_real_bitcoin_transactions(self.node)
+        self.assertEqual(ArchivedTransaction.objects.get(wallet=self.wallet).running_balance, Decimal('-1'))
+        self.assertEqual(Transaction.objects.get(wallet=self.wallet).running_balance, Decimal('1'))
+        self.assertEqual([problem for problem in run_audit(self.node).problems if problem.startswith('Wallet')], [])
+
+    def test_too_few_confirmations(self):
+        with self.assertRaises(Exception):
+            compact_wallet(self.wallet, self.future, 6)
@@ -0,0 +1,90 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+from decimal import Decimal
+from StringIO import StringIO
+import unittest
+
+from bitcoin_webwallet.cron import SendOutgoingTransactions
+from bitcoin_webwallet.models import Address, OutgoingTransaction, OutgoingTransactionInput, OutgoingTransactionOutput, Transaction, Wallet
+from bitcoin_webwallet.utils import INTERNAL_WALLET_CHANGE
+from stubs import TEST_SETTINGS, StubNode, rpc_error
+
+
+class SpentInputsNode(StubNode):
+
+    def sendrawtransaction(self, raw_tx):
+        raise rpc_error(-25, 'Missing inputs')
+
+
+@override_settings(**TEST_SETTINGS)
+class SendOutgoingTransactionsTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.otx = OutgoingTransaction.objects.create(inputs_selected_at=now())
+        OutgoingTransactionOutput.objects.create(tx=self.otx, amount=Decimal('1'), bitcoin_address='mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn')
+        OutgoingTransactionInput.objects.create(tx=self.otx, amount=Decimal('1.0001'), bitcoin_txid='a' * 64, bitcoin_vout=0)
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('-1'), description='Sent', outgoing_tx=self.otx)
+
+    def getFeeTransactions(self):
+        return Transaction.objects.filter(outgoing_tx=self.otx, description='Fee from sent Bitcoins')
+
+    def test_transaction_sent_by_previous_lock_owner(self):
+        node = StubNode()
+        self.assertEqual(SendOutgoingTransactions().processOutgoingTransactions(node), (1, 0))
+
+        # Lock was lost after sending, so marking the transaction sent was rolled back
+        self.getFeeTransactions().delete()
+        OutgoingTransaction.objects.filter(pk=self.otx.pk).update(sent_at=None)
+
+        self.assertEqual(SendOutgoingTransactions().processOutgoingTransactions(node), (1, 0))
+        self.assertEqual(len(node.sent_txs), 1)
+        self.assertIsNotNone(OutgoingTransaction.objects.get(pk=self.otx.pk).sent_at)
+        self.assertEqual([tx.amount for tx in self.getFeeTransactions()], [Decimal('-0.0001')])
+
+    def test_conflicting_transaction_is_not_marked_sent(self):
+        with self.assertRaises(JSONRPCException):
+            SendOutgoingTransactions().processOutgoingTransactions(SpentInputsNode())
+        self.assertIsNone(OutgoingTransaction.objects.get(pk=self.otx.pk).sent_at)
+        self.assertFalse(self.getFeeTransactions().exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class SelectInputsTest(TestCase):
+
+    def test_inputs_are_assigned_in_order_of_output(self):
+        otx = OutgoingTransaction.objects.create()
+        OutgoingTransactionOutput.objects.create(tx=otx, amount=Decimal('2.5'), bitcoin_address='mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn')
+        unspent_outputs = [
+            {'txid': 'c' * 64, 'vout': 0, 'amount': Decimal('1'), 'confirmations': 30},
+            {'txid': 'a' * 64, 'vout': 1, 'amount': Decimal('1'), 'confirmations': 20},
+            {'txid': 'a' * 64, 'vout': 0, 'amount': Decimal('1'), 'confirmations': 10},
+            {'txid': 'b' * 64, 'vout': 0, 'amount': Decimal('1'), 'confirmations': 5},
+        ]
+
+        self.assertTrue(SendOutgoingTransactions().selectInputs(otx, unspent_outputs))
+
+        # Best outputs are used, but they are assigned in order of txid and vout
+        inputs = otx.inputs.order_by('pk').values_list('bitcoin_txid', 'bitcoin_vout')
+        self.assertEqual(list(inputs), [('a' * 64, 0), ('a' * 64, 1), ('c' * 64, 0)])
+        self.assertEqual(unspent_outputs, [{'txid': 'b' * 64, 'vout': 0, 'amount': Decimal('1'), 'confirmations': 5}])
+
+
+# Worker threads use connections of their own, so they need a real database
+@unittest.skipUnless(connection.features.has_select_for_update_skip_locked, 'Database does not support SELECT ... FOR UPDATE SKIP LOCKED')
+@override_settings(**TEST_SETTINGS)
+class BenchmarkOutgoingTransactionsTest(TransactionTestCase):
+
+    def test_many_workers(self):
+        output = StringIO()
+        call_command('benchmark_outgoing_transactions', transactions=20, workers='1,4', rpc_latency=0, stdout=output)
+        self.assertIn('1 workers: 20 transactions', output.getvalue())
+        self.assertIn('4 workers: 20 transactions', output.getvalue())
+        # Change addresses of fake outputs are not left to be imported
+        self.assertFalse(Address.objects.filter(wallet__path=[0, INTERNAL_WALLET_CHANGE]).exists())
+        self.assertFalse(OutgoingTransaction.objects.exists())
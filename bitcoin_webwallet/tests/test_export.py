@@ -0,0 +1,62 @@
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils.timezone import now
+
+import datetime
+from decimal import Decimal
+import os
+import shutil
+import tempfile
+
+from bitcoin_webwallet.compaction import compact_wallet
+from bitcoin_webwallet.models import OutgoingTransaction, OutgoingTransactionOutput, Transaction, Wallet
+
+
+class ExportLedgerCommandTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.temp_dir, 'export.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def exportLedger(self, *args, **options):
+        call_command('export_ledger', *args, output=self.output, **options)
+        with open(self.output) as output_file:
+            return output_file.read()
+
+    def test_invalid_dates(self):
+        for value in ['2020-13-40T00:00', 'yesterday']:
+            for name in ['since', 'until']:
+                with self.assertRaises(CommandError):
+                    self.exportLedger('transactions', **{name: value})
+
+    def test_exports_transactions(self):
+        wallet = Wallet.objects.create(path=[1])
+        tx = Transaction.objects.create(wallet=wallet, amount=Decimal('1.5'), description='Received')
+
+        lines = self.exportLedger('transactions', since='2000-01-01T00:00Z').splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split(',')[:6], [str(tx.pk), str(wallet.pk), '1', tx.created_at.isoformat(), '1.50000000', 'Received'])
+
+    def test_compacted_transactions_are_exported(self):
+        wallet = Wallet.objects.create(path=[1])
+        other_wallet = Wallet.objects.create(path=[2])
+        otx = OutgoingTransaction.objects.create(sent_at=now())
+        OutgoingTransactionOutput.objects.create(tx=otx, amount=Decimal('1'), bitcoin_address='mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn')
+        old_txs = [
+            Transaction.objects.create(wallet=wallet, amount=Decimal('3'), description='Old'),
+            Transaction.objects.create(wallet=other_wallet, amount=Decimal('5'), description='Other'),
+            Transaction.objects.create(wallet=wallet, amount=Decimal('-1'), description='Old', outgoing_tx=otx),
+        ]
+        self.assertEqual(compact_wallet(wallet, now() + datetime.timedelta(days=1), 7), 2)
+        new_tx = Transaction.objects.create(wallet=wallet, amount=Decimal('2'), description='New')
+
+        lines = self.exportLedger('transactions').splitlines()[1:]
+        self.assertEqual([int(line.split(',')[0]) for line in lines], [tx.pk for tx in old_txs + [new_tx]])
+        self.assertEqual([line.split(',')[-1] for line in lines], ['3.00000000', '5.00000000', '2.00000000', '4.00000000'])
+
+        lines = self.exportLedger('outgoing_outputs', wallet_ids=[wallet.pk]).splitlines()[1:]
+        self.assertEqual(len(lines), 1)
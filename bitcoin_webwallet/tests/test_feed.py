@@ -0,0 +1,82 @@
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+import datetime
+from decimal import Decimal
+
+from bitcoin_webwallet.cron import SequenceTransactionEvents
+from bitcoin_webwallet.feed import get_latest_cursor, get_transaction_events, is_cursor_expired, prune_transaction_events, sequence_transaction_events
+from bitcoin_webwallet.models import Transaction, TransactionEvent, Wallet
+
+
+class TransactionFeedTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.other_wallet = Wallet.objects.create(path=[2])
+
+    def createEvent(self, wallet, **kwargs):
+        return TransactionEvent.objects.create(wallet=wallet, tx_id=1, kind=TransactionEvent.CREATED, amount=Decimal('1'), balance=Decimal('1'), **kwargs)
+
+    def test_event_committed_late_is_not_missed(self):
+        cursor = get_latest_cursor()
+        self.createEvent(self.wallet, id=10)
+        sequence_transaction_events()
+        events, cursor = get_transaction_events(cursor)
+        self.assertEqual([event['id'] for event in events], [10])
+
+        # Database transaction that inserted this event committed after the one above
+        self.createEvent(self.other_wallet, id=5)
+        sequence_transaction_events()
+        events, cursor = get_transaction_events(cursor)
+        self.assertEqual([event['id'] for event in events], [5])
+        self.assertEqual(get_transaction_events(cursor), ([], cursor))
+        self.assertEqual(get_latest_cursor(), cursor)
+
+    def test_events_of_wallet_are_in_order(self):
+        cursor = get_latest_cursor()
+        tx = Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Received')
+        Transaction.objects.create(wallet=self.other_wallet, amount=Decimal('3'), description='Received')
+        tx.setBlockHeight(100)
+        self.assertEqual(sequence_transaction_events(), 3)
+
+        events, cursor = get_transaction_events(cursor, wallet_ids=[self.wallet.pk])
+        self.assertEqual([(event['kind'], event['balance']) for event in events], [(TransactionEvent.CREATED, Decimal('2')), (TransactionEvent.CONFIRMED, Decimal('2'))])
+
+    def test_pruning_expires_cursor(self):
+        for _ in range(3):
+            self.createEvent(self.wallet)
+        sequence_transaction_events()
+        first_cursor, cursor = 1, get_latest_cursor()
+        self.assertFalse(is_cursor_expired(first_cursor))
+
+        # Latest event is kept
+        self.assertEqual(prune_transaction_events(now() + datetime.timedelta(days=1)), 2)
+        self.assertTrue(is_cursor_expired(first_cursor))
+        self.assertFalse(is_cursor_expired(cursor - 1))
+        self.assertEqual(get_transaction_events(cursor - 1)[0][0]['position'], cursor)
+
+    def test_reading_feed_does_not_write(self):
+        self.createEvent(self.wallet)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(get_transaction_events(get_latest_cursor()), ([], 0))
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+
+        # Event of writer that failed to give positions gets one from cron job
+        SequenceTransactionEvents().do()
+        self.assertEqual(len(get_transaction_events()[0]), 1)
+
+
+class TransactionFeedCommitTest(TransactionTestCase):
+
+    def test_events_get_positions_after_commit(self):
+        wallet = Wallet.objects.create(path=[1])
+        cursor = get_latest_cursor()
+        tx = Transaction.objects.create(wallet=wallet, amount=Decimal('2'), description='Received')
+        tx.setBlockHeight(100)
+
+        events, cursor = get_transaction_events(cursor)
+        self.assertEqual([(event['kind'], event['position']) for event in events], [(TransactionEvent.CREATED, 1), (TransactionEvent.CONFIRMED, 2)])
+        self.assertEqual(sequence_transaction_events(), 0)
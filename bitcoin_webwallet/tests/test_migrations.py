@@ -0,0 +1,99 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils.timezone import now
+
+import datetime
+from decimal import Decimal
+
+
+class BackfillMigrationTest(TransactionTestCase):
+    """ Migrates database back to the state before a backfill, adds
+    rows with historical models, and runs the backfill.
+    """
+
+    def setUp(self):
+        self.addCleanup(self.migrateToLatest)
+
+    def migrate(self, migration_name):
+        """ Migrates to given migration and returns historical models of that state.
+        """
+        target = [('bitcoin_webwallet', migration_name)]
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return MigrationExecutor(connection).loader.project_state(target).apps
+
+    def migrateToLatest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def createTransactions(self, apps, sending_addresses):
+        """ Creates live transaction with given sending_addresses and archived one with
+        reversed order of them. Returns wallet, live transaction and archived transaction.
+        """
+        Wallet = apps.get_model('bitcoin_webwallet', 'Wallet')
+        Transaction = apps.get_model('bitcoin_webwallet', 'Transaction')
+        ArchivedTransaction = apps.get_model('bitcoin_webwallet', 'ArchivedTransaction')
+        wallet = Wallet.objects.create(path=[1])
+        created_at = now() - datetime.timedelta(days=1)
+        amount = -sum(Decimal(sending_address['amount']) for sending_address in sending_addresses)
+        archived_tx = ArchivedTransaction.objects.create(
+            id=1000,
+            wallet=wallet,
+            created_at=created_at,
+            amount=amount,
+            description='Sent',
+            sending_addresses=list(reversed(sending_addresses)),
+            sequence=1,
+            running_balance=amount,
+            archived_at=now(),
+        )
+        live_tx = Transaction.objects.create(
+            wallet=wallet,
+            created_at=created_at + datetime.timedelta(hours=1),
+            amount=amount,
+            description='Sent',
+            sending_addresses=sending_addresses,
+            sequence=2,
+            running_balance=2 * amount,
+        )
+        return wallet, live_tx, archived_tx
+
+    def test_recipients_are_backfilled(self):
+        apps = self.migrate('0014_transaction_recipient')
+        Transaction = apps.get_model('bitcoin_webwallet', 'Transaction')
+        TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+        sending_addresses = [
+            {'amount': '1', 'address': 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'},
+            {'amount': '2'},
+        ]
+        wallet, live_tx, archived_tx = self.createTransactions(apps, sending_addresses)
+        Transaction.objects.create(wallet=wallet, amount=Decimal('5'), description='Received', sequence=3, running_balance=Decimal('-1'))
+        # Transaction whose recipients were created before an interrupted migration
+        done_tx = Transaction.objects.create(wallet=wallet, amount=Decimal('-4'), description='Sent', sending_addresses=[{'amount': '4'}], sequence=4, running_balance=Decimal('-5'))
+        TransactionRecipient.objects.create(tx_id=done_tx.pk, created_at=done_tx.created_at, amount=Decimal('4'))
+
+        apps = self.migrate('0015_backfill_transaction_recipients')
+        TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+        recipients = TransactionRecipient.objects.order_by('tx_id', 'pk').values_list('tx_id', 'created_at', 'amount', 'address')
+        self.assertEqual(list(recipients), [
+            (live_tx.pk, live_tx.created_at, Decimal('1'), 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'),
+            (live_tx.pk, live_tx.created_at, Decimal('2'), None),
+            (done_tx.pk, done_tx.created_at, Decimal('4'), None),
+            (archived_tx.pk, archived_tx.created_at, Decimal('2'), None),
+            (archived_tx.pk, archived_tx.created_at, Decimal('1'), 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'),
+        ])
+
+    def test_recipient_wallets_are_backfilled(self):
+        apps = self.migrate('0019_transaction_recipient_wallet')
+        TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+        wallet, live_tx, archived_tx = self.createTransactions(apps, [{'amount': '3'}])
+        for tx in [live_tx, archived_tx]:
+            TransactionRecipient.objects.create(tx_id=tx.pk, created_at=tx.created_at, amount=Decimal('3'))
+        # Recipient of a transaction that has been deleted
+        TransactionRecipient.objects.create(tx_id=999999, created_at=now(), amount=Decimal('1'))
+
+        apps = self.migrate('0020_backfill_transaction_recipient_wallets')
+        TransactionRecipient = apps.get_model('bitcoin_webwallet', 'TransactionRecipient')
+        recipients = TransactionRecipient.objects.order_by('tx_id').values_list('tx_id', 'wallet_id')
+        self.assertEqual(list(recipients), [(live_tx.pk, wallet.pk), (archived_tx.pk, wallet.pk)])
@@ -0,0 +1,132 @@
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+import datetime
+from decimal import Decimal
+
+from bitcoin_webwallet import models
+from bitcoin_webwallet.keys import derive_address_and_private_key
+from bitcoin_webwallet.models import Address, ArchivedTransaction, Transaction, TransactionRecipient, Wallet, WalletQuerySet
+from stubs import TEST_SETTINGS, replaced
+
+
+class WalletHistoryTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.started_at = now() - datetime.timedelta(days=1)
+
+        # Compacted transaction, that is older than the others
+        ArchivedTransaction.objects.create(id=1000, wallet=self.wallet, created_at=self.started_at, amount=Decimal('5'), description='Old', sequence=1, running_balance=Decimal('5'))
+
+        self.first = Transaction.objects.create(wallet=self.wallet, amount=Decimal('1'), description='Received', created_at=self.started_at + datetime.timedelta(hours=2))
+        # Deposit that the node received before the previous one
+        self.late = Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Received', created_at=self.started_at + datetime.timedelta(hours=1))
+        self.last = Transaction.objects.create(wallet=self.wallet, amount=Decimal('-3'), description='Sent', created_at=self.started_at + datetime.timedelta(hours=3))
+
+    def test_late_transaction_is_created_with_latest_one(self):
+        self.late.refresh_from_db()
+        self.assertEqual(self.late.created_at, self.started_at + datetime.timedelta(hours=2))
+        self.assertEqual((self.late.sequence, self.late.running_balance), (3, Decimal('8')))
+
+    def test_balance_at_follows_creation_time(self):
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at - datetime.timedelta(hours=1)), Decimal('0'))
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at), Decimal('5'))
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at + datetime.timedelta(minutes=90)), Decimal('5'))
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at + datetime.timedelta(hours=2)), Decimal('8'))
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at + datetime.timedelta(hours=4)), Decimal('5'))
+
+    def test_balance_at_is_running_balance(self):
+        # Running balance is trusted instead of adding amounts up
+        Transaction.objects.filter(pk=self.first.pk).update(amount=Decimal('100'))
+        self.assertEqual(self.wallet.getBalanceAt(self.started_at + datetime.timedelta(hours=2)), Decimal('8'))
+        self.assertEqual([tx.balance for tx in self.wallet.getStatement()], [Decimal('5'), Decimal('6'), Decimal('8'), Decimal('5')])
+
+    def test_statement_follows_creation_time(self):
+        statement = [(tx.pk, tx.balance) for tx in self.wallet.getStatement()]
+        self.assertEqual(statement, [(1000, Decimal('5')), (self.first.pk, Decimal('6')), (self.late.pk, Decimal('8')), (self.last.pk, Decimal('5'))])
+
+        statement = [(tx.pk, tx.balance) for tx in self.wallet.getStatement(since=self.started_at + datetime.timedelta(minutes=90))]
+        self.assertEqual(statement, [(self.first.pk, Decimal('6')), (self.late.pk, Decimal('8')), (self.last.pk, Decimal('5'))])
+
+        statement = [(tx.pk, tx.balance) for tx in self.wallet.getStatement(until=self.started_at + datetime.timedelta(hours=2))]
+        self.assertEqual(statement, [(1000, Decimal('5')), (self.first.pk, Decimal('6')), (self.late.pk, Decimal('8'))])
+
+
+class WalletLockTest(TestCase):
+
+    def setUp(self):
+        self.sender = Wallet.objects.create(path=[3])
+        self.receiver = Wallet.objects.create(path=[1])
+        self.address_owner = Wallet.objects.create(path=[2])
+        self.address = Address.objects.create(wallet=self.address_owner, subpath_number=0, address='1BoatSLRHtKNngkdXEeobR76b53LETtpyT')
+        Transaction.objects.create(wallet=self.sender, amount=Decimal('10'), description='Received')
+
+    def test_send_to_locks_all_wallets_first(self):
+        locked = []
+        original_lock_in_order = WalletQuerySet.lockInOrder
+
+        def record_lock(queryset, wallet_ids):
+            locked.append((sorted(wallet_ids), Transaction.objects.count()))
+            return original_lock_in_order(queryset, wallet_ids)
+
+        with replaced(WalletQuerySet, 'lockInOrder', record_lock):
+            self.sender.sendTo([(self.receiver, Decimal('1')), (self.address.address, Decimal('2'))], 0)
+
+        # Every wallet is locked once, before any of them is changed
+        self.assertEqual(locked, [(sorted([self.sender.pk, self.receiver.pk, self.address_owner.pk]), 1)])
+        self.assertEqual(self.receiver.getBalance(0), Decimal('1'))
+        self.assertEqual(self.address_owner.getBalance(0), Decimal('2'))
+        self.assertEqual(self.sender.getBalance(0), Decimal('7'))
+
+
+class TransactionRecipientTest(TestCase):
+
+    def setUp(self):
+        self.sender = Wallet.objects.create(path=[1])
+        self.receiver = Wallet.objects.create(path=[2])
+        self.external_address = 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'
+        Transaction.objects.create(wallet=self.sender, amount=Decimal('10'), description='Received')
+
+    def test_send_to_creates_recipients(self):
+        self.sender.sendTo([(self.receiver, Decimal('1')), (self.external_address, Decimal('2'))], 0)
+
+        tx = Transaction.objects.get(wallet=self.sender, amount=Decimal('-3'))
+        recipients = TransactionRecipient.objects.order_by('pk').values_list('tx_id', 'wallet_id', 'created_at', 'amount', 'address')
+        self.assertEqual(list(recipients), [
+            (tx.pk, self.sender.pk, tx.created_at, Decimal('1'), None),
+            (tx.pk, self.sender.pk, tx.created_at, Decimal('2'), self.external_address),
+        ])
+        self.assertEqual(TransactionRecipient.objects.get(amount=Decimal('2')).getTransaction(), tx)
+
+    def test_total_sent_to_address(self):
+        self.sender.sendTo([(self.external_address, Decimal('2'))], 0)
+        self.sender.sendTo([(self.external_address, Decimal('3')), (self.receiver, Decimal('1'))], 0)
+        TransactionRecipient.objects.filter(amount=Decimal('2')).update(created_at=now() - datetime.timedelta(days=2))
+        yesterday = now() - datetime.timedelta(days=1)
+
+        self.assertEqual(TransactionRecipient.objects.toAddress(self.external_address).getTotal(), Decimal('5'))
+        self.assertEqual(TransactionRecipient.objects.toAddress(self.external_address, since=yesterday).getTotal(), Decimal('3'))
+        self.assertEqual(TransactionRecipient.objects.toAddress(self.external_address, until=yesterday).getTotal(), Decimal('2'))
+        self.assertEqual(self.sender.transaction_recipients.toAddress('mwCwTceJvYV27KXBc3NJZys6CjsgsoeHmf').getTotal(), Decimal('0'))
+
+
+@override_settings(**TEST_SETTINGS)
+class AddressAllocationTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[0, 1], internal_wallet=True)
+
+    def test_address_created_by_concurrent_caller_is_returned(self):
+        def derive_while_other_worker_creates(master_key, path):
+            # Other worker creates the address before this one gets the wallet lock
+            result = derive_address_and_private_key(master_key, path)
+            if not Address.objects.filter(wallet=self.wallet, subpath_number=path[-1]).exists():
+                Address.objects.create(wallet=self.wallet, subpath_number=path[-1], address=result[0])
+            return result
+
+        with replaced(models, 'derive_address_and_private_key', derive_while_other_worker_creates):
+            address = self.wallet.getUnusedAddress()
+
+        self.assertEqual(address, Address.objects.get(wallet=self.wallet))
+        self.assertEqual(address.subpath_number, 0)
@@ -0,0 +1,42 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from collections import deque
+import json
+import os
+import shutil
+import tempfile
+
+from bitcoin_webwallet.models import Wallet
+from bitcoin_webwallet.profiling import list_dumps, profiled
+
+
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.wallet = Wallet.objects.create(path=[1])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_queries_are_dumped_after_query_log_is_full(self):
+        queries_log = connection.queries_log
+        connection.queries_log = deque([{'sql': 'SELECT 0', 'time': '0.000'}] * 5, maxlen=5)
+        try:
+            with override_settings(PROFILING_DIR=self.temp_dir, PROFILING_THRESHOLD=0, PROFILING_MAX_QUERIES=8):
+                with profiled('test'):
+                    for _ in range(12):
+                        Wallet.objects.get(pk=self.wallet.pk)
+            self.assertEqual(type(connection.queries_log), deque)
+            self.assertEqual(connection.queries_log.maxlen, 5)
+        finally:
+            connection.queries_log = queries_log
+
+        with open(list_dumps(self.temp_dir)[-1] + '.json') as json_file:
+            dump = json.load(json_file)
+        # Only the latest queries are kept, but all of them are counted
+        queries = dump['queries']
+        self.assertEqual(dump['queries_count'], 12)
+        self.assertEqual(len(queries), 8)
+        self.assertTrue(all('bitcoin_webwallet_wallet' in query['sql'] for query in queries))
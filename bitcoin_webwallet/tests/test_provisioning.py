@@ -0,0 +1,93 @@
+from django.test import TestCase, override_settings
+
+from bitcoin_webwallet import cron, provisioning
+from bitcoin_webwallet.keys import derive_address_and_private_key, get_master_key, get_wallet_descriptor
+from bitcoin_webwallet.models import Address, Wallet
+from bitcoin_webwallet.provisioning import provision_wallets
+from stubs import TEST_SETTINGS, WATCHONLY_TEST_SETTINGS, StubNode, replaced, rpc_error
+
+
+class DownNode(StubNode):
+
+    def __init__(self, *args, **kwargs):
+        super(DownNode, self).__init__(*args, **kwargs)
+        self.importmulti_calls = 0
+
+    def importmulti(self, requests, options):
+        self.importmulti_calls += 1
+        raise rpc_error(-28, 'Loading wallet...')
+
+
+class ProvisioningTestMixin(object):
+
+    def provision(self, node, start=0, count=5):
+        with replaced(provisioning, 'get_rpc', lambda: node), replaced(cron, 'get_read_rpc', lambda: node):
+            return provision_wallets([7], start, count, workers=1, chunk_size=2)
+
+    def getFirstAddresses(self):
+        return dict(
+            (tuple(address.wallet.path), address)
+            for address in Address.objects.filter(wallet__path__subtree=[7], subpath_number=0).select_related('wallet')
+        )
+
+
+@override_settings(**TEST_SETTINGS)
+class ProvisionWalletsTest(ProvisioningTestMixin, TestCase):
+
+    def test_wallets_are_created_with_imported_first_addresses(self):
+        node = StubNode()
+        self.assertEqual(self.provision(node), {'created': 5, 'skipped': 0, 'imported': 5})
+
+        master_key = get_master_key()
+        addresses = self.getFirstAddresses()
+        self.assertEqual(sorted(addresses), [(7, i) for i in range(5)])
+        for path, address in addresses.items():
+            self.assertEqual(address.address, derive_address_and_private_key(master_key, list(path) + [0])[0])
+            self.assertFalse(address.import_pending)
+        self.assertEqual(node.known_addresses, set(address.address for address in addresses.values()))
+
+    def test_existing_wallets_are_skipped_on_restart(self):
+        # Previous run was interrupted after the first chunk
+        self.assertEqual(self.provision(StubNode(), count=2), {'created': 2, 'skipped': 0, 'imported': 2})
+        Wallet.objects.create(path=[7, 3])
+
+        node = StubNode()
+        self.assertEqual(self.provision(node), {'created': 2, 'skipped': 3, 'imported': 2})
+        self.assertEqual(sorted(self.getFirstAddresses()), [(7, 0), (7, 1), (7, 2), (7, 4)])
+        self.assertEqual(len(node.known_addresses), 2)
+
+        self.assertEqual(self.provision(StubNode()), {'created': 0, 'skipped': 5, 'imported': 0})
+
+    def test_keys_are_left_pending_when_node_fails(self):
+        node = DownNode()
+        self.assertEqual(self.provision(node), {'created': 5, 'skipped': 0, 'imported': 0})
+
+        # Node is not asked again after it has failed once
+        self.assertEqual(node.importmulti_calls, 1)
+        addresses = self.getFirstAddresses().values()
+        self.assertEqual(len(addresses), 5)
+        self.assertTrue(all(address.import_pending for address in addresses))
+        self.assertEqual(Address.objects.filter(import_error__contains='Loading wallet').count(), 2)
+
+
+@override_settings(**WATCHONLY_TEST_SETTINGS)
+class ProvisionWatchOnlyWalletsTest(ProvisioningTestMixin, TestCase):
+
+    def test_wallets_are_registered_as_ranges(self):
+        node = StubNode()
+        self.assertEqual(self.provision(node, count=3), {'created': 3, 'skipped': 0, 'imported': 3})
+
+        master_key = get_master_key()
+        self.assertEqual(node.imported_ranges, [(get_wallet_descriptor(master_key, [7, i]), [0, 9]) for i in range(3)])
+        self.assertEqual(list(Wallet.objects.subtree([7]).values_list('watched_range_end', flat=True)), [10] * 3)
+        for address in self.getFirstAddresses().values():
+            self.assertFalse(address.import_pending)
+            self.assertIn(address.address, node.watchonly_addresses)
+        self.assertEqual(node.known_addresses, set())
+
+    def test_wallets_are_not_watched_when_node_fails(self):
+        node = DownNode()
+        self.assertEqual(self.provision(node, count=3), {'created': 3, 'skipped': 0, 'imported': 0})
+
+        self.assertEqual(node.importmulti_calls, 1)
+        self.assertEqual(list(Wallet.objects.subtree([7]).values_list('watched_range_end', flat=True)), [0] * 3)
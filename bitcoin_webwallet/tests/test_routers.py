@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from decimal import Decimal
+from unittest import skipUnless
+
+from bitcoin_webwallet import cron, routers
+from bitcoin_webwallet.models import CurrentBlockHeight, Transaction, Wallet
+from stubs import TEST_SETTINGS, StubNode, replaced
+
+
+# Second database of the project is used as replica
+REPLICA = next((alias for alias in sorted(settings.DATABASES) if alias != DEFAULT_DB_ALIAS), None)
+
+
+@skipUnless(REPLICA, 'Needs a second database in DATABASES')
+@override_settings(
+    DATABASE_ROUTERS=['bitcoin_webwallet.routers.ReplicaRouter'],
+    DATABASE_REPLICAS=[REPLICA],
+    DATABASE_REPLICA_MAX_LAG=0,
+    **TEST_SETTINGS
+)
+class ReplicaRouterTest(TransactionTestCase):
+    # Reads inside transaction always go to primary, so tests are not run inside one
+    multi_db = True
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.other_wallet = Wallet.objects.create(path=[2])
+        Transaction.objects.create(wallet=self.wallet, amount=Decimal('2'), description='Received')
+        self.forgetWrites()
+
+    def forgetWrites(self):
+        # Otherwise reads stay in primary, because this thread has just written
+        routers._state.written_at = None
+
+    def test_reads_go_to_replica_only_when_asked(self):
+        self.assertEqual(router.db_for_read(Wallet), DEFAULT_DB_ALIAS)
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Wallet), REPLICA)
+            with routers.primary_reads():
+                self.assertEqual(router.db_for_read(Wallet), DEFAULT_DB_ALIAS)
+        self.assertEqual(router.db_for_write(Wallet), DEFAULT_DB_ALIAS)
+
+    def test_send_to_uses_primary(self):
+        with routers.replica_reads():
+            with CaptureQueriesContext(connections[REPLICA]) as replica_queries, CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as primary_queries:
+                self.wallet.sendTo([(self.other_wallet, Decimal('1.5'))], 0)
+
+        self.assertEqual(len(replica_queries), 0)
+        sqls = [query['sql'] for query in primary_queries]
+        self.assertTrue(any(sql.startswith('SELECT') for sql in sqls))
+        self.assertTrue(any(sql.startswith('INSERT') for sql in sqls))
+        self.assertEqual(self.other_wallet.getBalance(0), Decimal('1.5'))
+
+    def test_cron_jobs_use_primary(self):
+        node = StubNode(block_count=100)
+        node.receive('mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn', '1', block_height=99)
+
+        with routers.replica_reads(), replaced(cron, 'get_rpc', lambda: node), replaced(cron, 'get_read_rpc', lambda: node):
+            with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+                cron.AddRealBitcoinTransactions().do()
+
+        self.assertEqual(len(replica_queries), 0)
+        self.assertEqual(CurrentBlockHeight.objects.get().block_height, 100)
@@ -0,0 +1,115 @@
+from django.test import SimpleTestCase, override_settings
+
+import time
+
+from bitcoin_webwallet.rpc import NodePool, ReadOnlyRPC
+
+
+class StubNodes(object):
+    """ Several nodes, that are reached by their URLs.
+    """
+
+    def __init__(self, block_heights):
+        self.block_heights = block_heights
+        self.failing = set()
+        self.calls = []
+
+    def proxy(self, url):
+        return StubProxy(self, url)
+
+
+class StubProxy(object):
+
+    def __init__(self, nodes, url):
+        self.nodes = nodes
+        self.url = url
+
+    def _call(self, method):
+        self.nodes.calls.append((self.url, method))
+        if self.url in self.nodes.failing:
+            raise IOError('Connection refused')
+
+    def getblockcount(self):
+        self._call('getblockcount')
+        return self.nodes.block_heights[self.url]
+
+    def getblockhash(self, height):
+        self._call('getblockhash')
+        return '{}:{}'.format(self.url, height)
+
+    def getbalance(self):
+        self._call('getbalance')
+        return 0
+
+
+@override_settings(BITCOIN_RPC_HEALTH_CHECK_INTERVAL=10, BITCOIN_RPC_MAX_LAG_BLOCKS=2)
+class NodePoolTest(SimpleTestCase):
+
+    def setUp(self):
+        self.nodes = StubNodes({'primary': 100, 'read1': 100, 'read2': 100})
+        self.pool = NodePool(['primary', 'read1', 'read2'], proxy_class=self.nodes.proxy)
+        self.rpc = ReadOnlyRPC(self.pool)
+
+    def test_only_read_only_calls_are_routed(self):
+        self.pool.checkHealth()
+        with self.assertRaises(ValueError):
+            self.rpc.getbalance()
+        self.assertNotIn('getbalance', [method for _, method in self.nodes.calls])
+
+    def test_least_loaded_healthy_node_is_used(self):
+        self.nodes.block_heights['read2'] = 97
+        self.pool.checkHealth()
+        self.assertEqual([node.healthy for node in self.pool.nodes], [True, True, False])
+
+        self.pool.nodes[0].latency = 0.5
+        self.pool.nodes[1].latency = 0.1
+        self.assertEqual(self.rpc.getblockhash(5), 'read1:5')
+
+        # Node with calls in flight is avoided
+        self.pool.nodes[1].in_flight = 1
+        self.assertEqual(self.rpc.getblockhash(5), 'primary:5')
+
+    def test_failing_read_node_fails_over_to_primary(self):
+        self.pool.checkHealth()
+        self.pool.nodes[0].latency = 0.5
+        self.nodes.failing.add('read1')
+        self.nodes.failing.add('read2')
+
+        self.assertEqual(self.rpc.getblockhash(5), 'primary:5')
+        self.assertEqual(self.rpc.getblockhash(6), 'primary:6')
+        self.assertEqual([node.healthy for node in self.pool.nodes], [True, False, False])
+        self.assertEqual([node.in_flight for node in self.pool.nodes], [0, 0, 0])
+
+    def test_failing_primary_is_not_hidden(self):
+        self.nodes.failing.add('primary')
+        self.nodes.failing.add('read1')
+        self.nodes.failing.add('read2')
+        with self.assertRaises(IOError):
+            self.rpc.getblockhash(5)
+
+    def test_failing_node_is_checked_again_after_back_off(self):
+        self.nodes.failing.add('read1')
+        self.pool.checkHealth()
+        read1 = self.pool.nodes[1]
+        self.assertFalse(read1.healthy)
+        self.assertAlmostEqual(read1.retry_at - time.time(), 10, delta=1)
+
+        # Node is not asked during back-off, even if it would work again
+        self.nodes.failing.discard('read1')
+        del self.nodes.calls[:]
+        self.pool.checkHealth()
+        self.assertNotIn('read1', [url for url, _ in self.nodes.calls])
+        self.assertFalse(read1.healthy)
+
+        # Delay doubles with every failure
+        self.nodes.failing.add('read1')
+        read1.retry_at = time.time()
+        self.pool.checkHealth()
+        self.assertEqual(read1.failures, 2)
+        self.assertAlmostEqual(read1.retry_at - time.time(), 20, delta=1)
+
+        self.nodes.failing.discard('read1')
+        read1.retry_at = time.time()
+        self.pool.checkHealth()
+        self.assertTrue(read1.healthy)
+        self.assertEqual(read1.failures, 0)
@@ -0,0 +1,76 @@
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, override_settings
+
+from pycoin.key.validate import is_address_valid as pycoin_is_address_valid
+
+from bitcoin_webwallet import validation
+from bitcoin_webwallet.fields import BitcoinAddressValidator
+from bitcoin_webwallet.validation import clear_validation_cache, get_invalid_addresses, is_address_valid, validate_addresses
+
+
+MAINNET_ADDRESSES = ['1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy']
+TESTNET_ADDRESSES = ['mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn', '2MzQwSSnBHWHqSAqtTVQ6v47XtaisrJa1Vc']
+INVALID_ADDRESSES = [
+    # Checksum does not match
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb',
+    # Characters that are not in base58
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7Divf0O',
+    u'1A1zP1eP5QGefi2DMPTfTL5SLmv7Divf\xe4a',
+    '',
+    '1',
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',
+]
+
+
+class ValidationTest(SimpleTestCase):
+
+    def setUp(self):
+        clear_validation_cache()
+
+    def tearDown(self):
+        clear_validation_cache()
+
+    def test_networks(self):
+        self.assertEqual(validate_addresses(MAINNET_ADDRESSES + TESTNET_ADDRESSES, 'BTC'), [True, True, False, False])
+        self.assertEqual(validate_addresses(MAINNET_ADDRESSES + TESTNET_ADDRESSES, 'XTN'), [False, False, True, True])
+
+    def test_invalid_addresses(self):
+        addresses = MAINNET_ADDRESSES + INVALID_ADDRESSES
+        self.assertEqual(get_invalid_addresses(addresses, 'BTC'), INVALID_ADDRESSES)
+        for netcode in ['BTC', 'XTN']:
+            self.assertEqual(validate_addresses(INVALID_ADDRESSES, netcode), [False] * len(INVALID_ADDRESSES))
+
+    def test_same_results_as_pycoin(self):
+        for netcode in ['BTC', 'XTN']:
+            for address in MAINNET_ADDRESSES + TESTNET_ADDRESSES + INVALID_ADDRESSES[:2]:
+                self.assertEqual(is_address_valid(address, netcode), bool(pycoin_is_address_valid(address, allowable_netcodes=[netcode])), address)
+
+    def test_network_follows_testnet_setting(self):
+        with override_settings(TESTNET=True):
+            self.assertEqual(validate_addresses(TESTNET_ADDRESSES), [True, True])
+            BitcoinAddressValidator()(TESTNET_ADDRESSES[0])
+            with self.assertRaises(ValidationError):
+                BitcoinAddressValidator()(MAINNET_ADDRESSES[0])
+        with override_settings(TESTNET=False):
+            self.assertEqual(validate_addresses(TESTNET_ADDRESSES), [False, False])
+            BitcoinAddressValidator()(MAINNET_ADDRESSES[0])
+
+    @override_settings(ADDRESS_VALIDATION_CACHE_SIZE=2)
+    def test_memo_evicts_least_recently_used(self):
+        validate_addresses(MAINNET_ADDRESSES, 'BTC')
+        # Using first address again makes the second one least recently used
+        validate_addresses(MAINNET_ADDRESSES[:1] + INVALID_ADDRESSES[:1], 'BTC')
+
+        self.assertEqual(list(validation._cache.results.items()), [
+            (('BTC', MAINNET_ADDRESSES[0]), True),
+            (('BTC', INVALID_ADDRESSES[0]), False),
+        ])
+
+        # Results do not depend on what is remembered
+        self.assertEqual(validate_addresses(MAINNET_ADDRESSES + INVALID_ADDRESSES[:1], 'BTC'), [True, True, False])
+        self.assertEqual(len(validation._cache.results), 2)
+
+    def test_memo_is_per_network(self):
+        self.assertTrue(is_address_valid(MAINNET_ADDRESSES[0], 'BTC'))
+        self.assertFalse(is_address_valid(MAINNET_ADDRESSES[0], 'XTN'))
+        self.assertTrue(is_address_valid(MAINNET_ADDRESSES[0], 'BTC'))
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+
+from bitcoin_webwallet import views
+
+
+class ExportLedgerViewTest(TestCase):
+
+    def exportLedger(self, **params):
+        request = RequestFactory().get('/export/transactions/', params)
+        request.user = User(username='staff', is_staff=True, is_active=True)
+        return views.export_ledger(request, 'transactions')
+
+    def test_valid_dates(self):
+        response = self.exportLedger(since='2020-01-01T00:00Z', until='2020-12-31T23:59:59Z')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(''.join(response.streaming_content).splitlines()[0].split(',')[0], 'id')
+
+    def test_invalid_dates(self):
+        for value in ['2020-13-40T00:00', 'yesterday']:
+            for name in ['since', 'until']:
+                self.assertEqual(self.exportLedger(**{name: value}).status_code, 400)
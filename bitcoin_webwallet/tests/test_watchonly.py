@@ -0,0 +1,73 @@
+from django.test import TestCase, override_settings
+
+from decimal import Decimal
+
+from bitcoin_webwallet import cron, models
+from bitcoin_webwallet.audit import run_audit
+from bitcoin_webwallet.keys import get_master_key, get_wallet_descriptor
+from bitcoin_webwallet.models import Address, Transaction, Wallet
+from stubs import WATCHONLY_TEST_SETTINGS, StubNode, add_real_bitcoin_transactions, replaced
+
+
+class FailingImportNode(StubNode):
+
+    def importmulti(self, requests, options):
+        return [{'success': False, 'error': {'code': -4, 'message': 'Wallet is locked'}} for _ in requests]
+
+
+@override_settings(**WATCHONLY_TEST_SETTINGS)
+class WatchOnlyTest(TestCase):
+
+    def setUp(self):
+        self.wallet = Wallet.objects.create(path=[1])
+        self.descriptor = get_wallet_descriptor(get_master_key(), [1])
+        self.node = StubNode(block_count=100)
+
+    def createAddresses(self, node, count):
+        with replaced(models, 'get_rpc', lambda: node):
+            return [self.wallet.getOrCreateAddress(subpath_number) for subpath_number in range(count)]
+
+    def test_addresses_are_registered_as_ranges(self):
+        addresses = self.createAddresses(self.node, 11)
+
+        # One import per chunk of ten addresses, and no private keys
+        self.assertEqual(self.node.imported_ranges, [(self.descriptor, [0, 9]), (self.descriptor, [10, 19])])
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).watched_range_end, 20)
+        self.assertEqual(self.node.known_addresses, set())
+        for address in addresses:
+            self.assertIn(address.address, self.node.watchonly_addresses)
+            self.assertFalse(address.import_pending)
+
+    def test_extend_watched_range(self):
+        self.wallet.extendWatchedRange(self.node, 5)
+        self.wallet.extendWatchedRange(self.node, 3)
+        self.wallet.extendWatchedRange(self.node, 8)
+        self.assertEqual(self.node.imported_ranges, [(self.descriptor, [0, 4]), (self.descriptor, [5, 7])])
+
+        with self.assertRaises(Exception):
+            self.wallet.extendWatchedRange(FailingImportNode(), 20)
+        self.assertEqual(Wallet.objects.get(pk=self.wallet.pk).watched_range_end, 8)
+
+    def test_failed_registration_creates_no_address(self):
+        with self.assertRaises(Exception):
+            self.createAddresses(FailingImportNode(), 1)
+        self.assertFalse(Address.objects.exists())
+
+    def test_cron_extends_ranges_that_are_half_used(self):
+        self.createAddresses(self.node, 6)
+        self.node.imported_ranges = []
+
+        with replaced(cron, 'get_rpc', lambda: self.node):
+            cron.ExtendWatchedRanges().do()
+
+        self.assertEqual(self.node.imported_ranges, [(self.descriptor, [10, 15])])
+
+    def test_watchonly_deposits_are_added_and_audited(self):
+        address = self.createAddresses(self.node, 1)[0]
+        self.node.receive(address.address, '1.5', block_height=50)
+        self.node.unspent_outputs.append({'txid': 'a' * 64, 'vout': 0, 'amount': Decimal('1.5'), 'confirmations': 51, 'spendable': False, 'solvable': True})
+
+        add_real_bitcoin_transactions(self.node)
+
+        self.assertEqual(Transaction.objects.get(wallet=self.wallet).amount, Decimal('1.5'))
+        self.assertEqual(run_audit(self.node).problems, [])
@@ -0,0 +1,9 @@
+from django.conf.urls import url
+
+import views
+
+
+urlpatterns = [
+    url(r'^export/(?P<kind>[a-z_]+)/$', views.export_ledger, name='bitcoin_webwallet_export'),
+    url(r'^transaction-events/$', views.transaction_events, name='bitcoin_webwallet_transaction_events'),
+]
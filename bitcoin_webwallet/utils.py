@@ -1,11 +1,16 @@
 from django.conf import settings
 from django.core.cache import cache
+from django.db.models import Min
 
-from models import Wallet
+from models import Address, Wallet
 
 
 INTERNAL_WALLET_CHANGE = 0
 
+# AddRealBitcoinTransactions processes this many latest blocks again,
+# in case something (for example fork) has modified their transactions.
+EXTRA_BLOCKS_TO_PROCESS = 6
+
 
 def get_or_create_internal_wallet(internal_wallet_id):
     return Wallet.objects.get_or_create(path=[0, internal_wallet_id], defaults={'internal_wallet': True})[0]
@@ -16,3 +21,16 @@ def get_fee_in_satoshis_per_byte():
     if fee:
         return fee
     return getattr(settings, 'DEFAULT_FEE_SATOSHIS_PER_BYTE', 250)
+
+
+def get_final_block_height(block_height):
+    """ Returns the highest block whose incoming transactions will not be
+    processed again by AddRealBitcoinTransactions, when it has processed
+    blocks up to block_height.
+    """
+    final_block_height = block_height - EXTRA_BLOCKS_TO_PROCESS
+    # Blocks since creation of addresses are processed again, once their keys are imported
+    rescan_from_height = Address.objects.filter(rescan_from_height__isnull=False).aggregate(Min('rescan_from_height'))['rescan_from_height__min']
+    if rescan_from_height is not None:
+        final_block_height = min(final_block_height, rescan_from_height - EXTRA_BLOCKS_TO_PROCESS - 1)
+    return final_block_height
@@ -0,0 +1,116 @@
+from django.conf import settings
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_VALUES = dict((c, i) for i, c in enumerate(BASE58_ALPHABET))
+
+# Version bytes of P2PKH and P2SH addresses
+ADDRESS_VERSIONS = {
+    'BTC': (b'\x00', b'\x05'),
+    'XTN': (b'\x6f', b'\xc4'),
+}
+
+
+def get_netcode():
+    return 'XTN' if getattr(settings, 'TESTNET', False) else 'BTC'
+
+
+def b58decode_check(value):
+    """ Decodes base58check string and returns its payload, or
+    None if string is not valid base58 or checksum does not match.
+    """
+    number = 0
+    for c in value:
+        digit = BASE58_VALUES.get(c)
+        if digit is None:
+            return None
+        number = number * 58 + digit
+    data_hex = '%x' % number if number else ''
+    if len(data_hex) % 2:
+        data_hex = '0' + data_hex
+    # Every leading '1' means one leading zero byte
+    leading_zeros = len(value) - len(value.lstrip('1'))
+    data = b'\x00' * leading_zeros + data_hex.decode('hex')
+    if len(data) < 4:
+        return None
+    payload, checksum = data[:-4], data[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        return None
+    return payload
+
+
+def _is_address_valid_uncached(address, netcode):
+    payload = b58decode_check(address)
+    if payload is None or len(payload) != 21:
+        return False
+    return payload[:1] in ADDRESS_VERSIONS[netcode]
+
+
+class _ValidationCache(object):
+    """ Bounded least recently used memo of validation results.
+    """
+
+    def __init__(self):
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            result = self.results.pop(key, None)
+            if result is not None:
+                self.results[key] = result
+            return result
+
+    def set(self, key, result):
+        max_size = getattr(settings, 'ADDRESS_VALIDATION_CACHE_SIZE', 10000)
+        with self.lock:
+            self.results.pop(key, None)
+            self.results[key] = result
+            while len(self.results) > max_size:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+
+_cache = _ValidationCache()
+
+
+def validate_addresses(addresses, netcode=None):
+    """ Validates list of addresses in one pass. Returns list of booleans
+    in same order. Network is selected from TESTNET setting by default.
+    """
+    netcode = netcode or get_netcode()
+    results = []
+    for address in addresses:
+        try:
+            address = str(address)
+        except UnicodeEncodeError:
+            results.append(False)
+            continue
+        key = (netcode, address)
+        result = _cache.get(key)
+        if result is None:
+            result = _is_address_valid_uncached(address, netcode)
+            _cache.set(key, result)
+        results.append(result)
+    return results
+
+
+def is_address_valid(address, netcode=None):
+    return validate_addresses([address], netcode)[0]
+
+
+def get_invalid_addresses(addresses, netcode=None):
+    """ Returns those addresses that are not valid, preserving their order.
+    """
+    return [address for address, valid in zip(addresses, validate_addresses(addresses, netcode)) if not valid]
+
+
+def clear_validation_cache():
+    _cache.clear()
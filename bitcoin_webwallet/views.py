@@ -0,0 +1,78 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+
+from export import EXPORTS, EXPORT_FORMATS, export
+from feed import FEED_PAGE_SIZE, get_transaction_events, is_cursor_expired, wait_for_transaction_events
+from keys import path_from_str
+
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Longest time that one request waits for transaction events
+MAX_WAIT_SECONDS = 60
+
+
+@staff_member_required
+def export_ledger(request, kind):
+    """ Streams ledger export. Supports GET parameters format,
+    wallet (many times), path, since and until.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown export!')
+
+    try:
+        wallet_ids = [int(wallet_id) for wallet_id in request.GET.getlist('wallet')]
+        path = request.GET.get('path')
+        if path is not None:
+            path = path_from_str(path)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid wallet or path!')
+
+    filters = {'wallet_ids': wallet_ids, 'path': path}
+    for name in ['since', 'until']:
+        value = request.GET.get(name)
+        try:
+            # Invalid values are either not parsed at all, or they raise ValueError
+            filters[name] = parse_datetime(value) if value else None
+        except ValueError:
+            filters[name] = None
+        if value and not filters[name]:
+            return HttpResponseBadRequest('Invalid ' + name + '!')
+
+    response = StreamingHttpResponse(export(kind, export_format, **filters), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, export_format)
+    return response
+
+
+@staff_member_required
+@transaction.non_atomic_requests
+def transaction_events(request):
+    """ Returns transaction events after GET parameter cursor, and
+    cursor for the next request. Supports GET parameters wallet (many
+    times), limit, and wait, which is how many seconds to wait for
+    new events, if there are none yet.
+    """
+    try:
+        cursor = int(request.GET.get('cursor', 0))
+        wallet_ids = [int(wallet_id) for wallet_id in request.GET.getlist('wallet')]
+        limit = max(1, min(int(request.GET.get('limit', FEED_PAGE_SIZE)), FEED_PAGE_SIZE * 10))
+        wait = max(0.0, min(float(request.GET.get('wait', 0)), MAX_WAIT_SECONDS))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor, wallet, limit or wait!')
+
+    if wait:
+        events, next_cursor = wait_for_transaction_events(cursor, wallet_ids, limit, timeout=wait)
+    else:
+        events, next_cursor = get_transaction_events(cursor, wallet_ids, limit)
+    return JsonResponse({
+        'events': events,
+        'cursor': next_cursor,
+        'expired': is_cursor_expired(cursor),
+    }, encoder=DjangoJSONEncoder)